@@ -0,0 +1,178 @@
+# annotations.py
+# Annotated overlays served from memory: the analysis endpoints keep the decoded scan and the fitted
+# geometry in the result cache, and GET /api/annotated/<structure>/<scan_id> draws and encodes the
+# overlay (JPEG or WebP, at the requested width) on demand, without running inference again.
+# Encoded renders are cached by scan, model version, format and size.
+
+import os
+import hashlib
+import cv2
+import numpy as np
+from flask import Blueprint, Response, jsonify, request
+from dicom_io import decode_scan_upload
+from model_registry import MODEL_PATHS
+from reference_ranges import TCD_REFERENCE, TCD_TOLERANCE_MM, get_normal_ranges
+from result_cache import cache_key, get_cache
+from roi_refinement import parse_mode
+from tracing import span
+
+bp = Blueprint("annotations", __name__)
+
+# Scans are kept (and overlays rendered) at most this wide
+MAX_WIDTH = int(os.environ.get("DRUEL_RENDER_MAX_WIDTH", "1024"))
+MIN_WIDTH = 64
+QUALITY = int(os.environ.get("DRUEL_RENDER_QUALITY", "85"))
+FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+# Renders are immutable for a given URL (the model version is part of the cache key)
+CACHE_CONTROL = "private, max-age=86400"
+
+GEOMETRY_COLOR = (0, 255, 0)
+TEXT_COLORS = {"brain": (0, 255, 255), "cerebellum": (255, 255, 0), "ventricular": (255, 255, 0)}
+
+def scan_id(digest, frame=0):
+    """Identifier of an uploaded scan (and frame) in render URLs and the scan cache"""
+    return digest + (f":{frame}" if frame else "")
+
+def remember_scan(scan, img):
+    """Keep the decoded grayscale scan (downscaled to MAX_WIDTH) so its overlays can be rendered later"""
+    cache = get_cache()
+    if img.shape[1] > MAX_WIDTH:
+        height = max(1, round(img.shape[0] * MAX_WIDTH / img.shape[1]))
+        img = cv2.resize(img, (MAX_WIDTH, height), interpolation=cv2.INTER_AREA)
+    cache.put("scan", scan, img)
+
+def ensure_scan(scan, file_storage, frame=0):
+    """
+    Keep the scan for an analysis answered from the measurement cache, decoding the upload again
+    only when the scan itself has left the cache
+    """
+    if get_cache().get("scan", scan) is None:
+        img, _ = decode_scan_upload(file_storage, frame)
+        if img is not None:
+            remember_scan(scan, img)
+
+def ellipse_overlay(ellipse, frame_shape):
+    """Overlay geometry for an ellipse fitted in an image (or mask) of `frame_shape`"""
+    (cx, cy), (width, height), angle = ellipse
+    return {"frame": [int(frame_shape[1]), int(frame_shape[0])],
+            "ellipse": [[float(cx), float(cy)], [float(width), float(height)], float(angle)]}
+
+def box_overlay(box, frame_shape):
+    """Overlay geometry for an (x, y, w, h) box found in an image (or mask) of `frame_shape`"""
+    return {"frame": [int(frame_shape[1]), int(frame_shape[0])], "box": [int(v) for v in box]}
+
+def annotation_url(structure, scan, mode="coarse"):
+    """Path of the rendered overlay for the analysis just made (query: format, width, gestationalAge)"""
+    url = f"/api/annotated/{structure}/{scan}"
+    return url + (f"?mode={mode}" if mode != "coarse" else "")
+
+def _labels(structure, measurement, gest_age_weeks):
+    """Overlay text; the TCD/LVW assessment is added when the gestational age is given"""
+    if structure == "brain":
+        return [f"BPD: {measurement['bpd_mm']:.1f}mm", f"HC: {measurement['hc_mm']:.1f}mm"]
+    if structure == "cerebellum":
+        label = f"TCD: {measurement['tcd_mm']:.1f}mm"
+        if gest_age_weeks is not None:
+            expected = TCD_REFERENCE.get(gest_age_weeks, gest_age_weeks)
+            label += " (Normal)" if abs(measurement["tcd_mm"] - expected) <= TCD_TOLERANCE_MM else " (Abnormal)"
+        return [label]
+    label = f"LVW: {measurement['lvw_mm']:.1f}mm"
+    if gest_age_weeks is not None:
+        label += " (Normal)" if measurement["lvw_mm"] < get_normal_ranges(gest_age_weeks)["LVW_max"] else " (Abnormal)"
+    return [label]
+
+def render(img, overlay, labels, width, text_color):
+    """
+    BGR copy of grayscale `img` resized to `width`, with the overlay geometry (scaled from the frame it
+    was fitted in, which may be the 128x128 mask) and the labels drawn at that size
+    """
+    height = max(1, round(img.shape[0] * width / img.shape[1]))
+    interpolation = cv2.INTER_AREA if width < img.shape[1] else cv2.INTER_LINEAR
+    canvas = cv2.cvtColor(cv2.resize(img, (width, height), interpolation=interpolation), cv2.COLOR_GRAY2BGR)
+
+    frame_width, frame_height = overlay["frame"]
+    scale = np.array([width / frame_width, height / frame_height])
+    if "ellipse" in overlay:
+        # Scaled as points: the mask frame is stretched differently along x and y
+        (cx, cy), (axis_x, axis_y), angle = overlay["ellipse"]
+        t = np.linspace(0, 2 * np.pi, 90, endpoint=False)
+        theta = np.deg2rad(angle)
+        x = axis_x / 2 * np.cos(t)
+        y = axis_y / 2 * np.sin(t)
+        points = np.stack([cx + x * np.cos(theta) - y * np.sin(theta), cy + x * np.sin(theta) + y * np.cos(theta)], 1)
+        cv2.polylines(canvas, [np.round(points * scale).astype(np.int32)], True, GEOMETRY_COLOR, 2, cv2.LINE_AA)
+    else:
+        x, y, w, h = overlay["box"]
+        top_left = np.round(np.array([x, y]) * scale).astype(int)
+        bottom_right = np.round(np.array([x + w, y + h]) * scale).astype(int)
+        cv2.rectangle(canvas, tuple(int(v) for v in top_left), tuple(int(v) for v in bottom_right), GEOMETRY_COLOR, 2)
+
+    # Text sized for the output, as drawn by the annotate_* functions on a ~512 px image
+    font_scale = float(np.clip(0.6 * width / 512, 0.4, 1.5))
+    thickness = max(1, round(2 * font_scale / 0.6))
+    line_height = round(25 * font_scale / 0.6)
+    for i, label in enumerate(labels):
+        cv2.putText(canvas, label, (10, line_height * (i + 1) - 5), cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                    text_color, thickness, cv2.LINE_AA)
+    return canvas
+
+def encode(image, fmt, quality=QUALITY):
+    """`image` encoded in memory as `fmt` ("jpeg" or "webp"): bytes"""
+    extension, _, quality_flag = FORMATS[fmt]
+    ok, buffer = cv2.imencode(extension, image, [quality_flag, quality])
+    if not ok:
+        raise ValueError(f"Could not encode the overlay as {fmt}")
+    return buffer.tobytes()
+
+@bp.route("/api/annotated/<structure>/<scan>", methods=["GET"])
+def annotated(structure, scan):
+    """
+    The annotated overlay of an analysed scan, from the `annotation_url` of an analysis response.
+    Query: format (jpeg, the default, or webp), width (px, default the scan's up to DRUEL_RENDER_MAX_WIDTH),
+    mode (as analysed) and gestationalAge (adds the TCD/LVW assessment). 404 once the scan has left
+    the cache or the model version has changed; analyse it again.
+    """
+    if structure not in MODEL_PATHS:
+        return jsonify({"error": f"Unknown structure '{structure}'"}), 404
+    fmt = request.args.get("format", "jpeg").lower().replace("jpg", "jpeg")
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(FORMATS)}"}), 400
+    try:
+        mode = parse_mode(request.args.get("mode"))
+        width = request.args.get("width", type=int)
+        gest_age_weeks = request.args.get("gestationalAge", type=int)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if width is not None and not MIN_WIDTH <= width <= MAX_WIDTH:
+        return jsonify({"error": f"width must be between {MIN_WIDTH} and {MAX_WIDTH}"}), 400
+
+    cache = get_cache()
+    key = cache_key(structure, scan, mode if mode != "coarse" else None)
+    measurement = cache.get("measurement", key)
+    if measurement is None or not measurement.get("overlay"):
+        return jsonify({"error": "No analysis of this scan with the current model. Please analyze it again."}), 404
+
+    render_key = f"{key}:{fmt}:{width or 'full'}:{gest_age_weeks or ''}"
+    etag = hashlib.sha256(render_key.encode()).hexdigest()[:32]
+    if etag in request.if_none_match:
+        return Response(status=304, headers={"ETag": f'"{etag}"', "Cache-Control": CACHE_CONTROL})
+
+    data = cache.get("render", render_key)
+    if data is None:
+        img = cache.get("scan", scan)
+        if img is None:
+            return jsonify({"error": "Scan no longer cached. Please analyze it again."}), 404
+        with span("annotations", "render"):
+            canvas = render(img, measurement["overlay"], _labels(structure, measurement, gest_age_weeks),
+                            width or img.shape[1], TEXT_COLORS[structure])
+        with span("annotations", "encode"):
+            data = encode(canvas, fmt)
+        cache.put("render", render_key, data)
+
+    response = Response(data, mimetype=FORMATS[fmt][1])
+    response.headers["ETag"] = f'"{etag}"'
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
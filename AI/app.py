@@ -1,42 +1,39 @@
 # app.py (Flask API for Fetal Brain Analysis)
 
 import os
+import hashlib
 import logging
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, request, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
-import cv2
 import numpy as np
-from tensorflow.keras.models import load_model
-from fetal_brain_diagnosis import preprocess_image, build_unet, calculate_bpd_and_hc_from_mask
+from annotations import bp as annotations_bp, annotation_url, ellipse_overlay, ensure_scan, remember_scan, scan_id
+from batch_analysis import (NDJSON_MIMETYPE, chunked, close_uploads, detach_uploads, gestational_age_for, iter_uploaded_images,
+                            ndjson_line, parse_gestational_ages)
+from biometry import select_thresholds
+from fetal_brain_diagnosis import (annotate_bpd_and_hc, preprocess_image, calculate_bpd_and_hc_from_mask,
+                                   fit_binary_bpd_and_hc)
+from debug_artifacts import start_capture
+from dicom_io import (FrameOutOfRange, decode_scan_bytes, decode_scan_upload, measurement_spacing, parse_frame,
+                      pipeline_spacings)
+from image_io import configure_app, upload_digest
+from inference_scheduler import QueueFull
+from metrics import record_threshold_level
+from model_registry import get_scheduler, is_ready, start_warmup
+from ops import bp as ops_bp, model_unavailable, note_error, queue_full, request_priority
+from reference_ranges import REFERENCE_DATA, TOLERANCE
+from result_cache import cache_key, get_cache
+from roi_refinement import parse_mode, refine_bpd_and_hc, refine_fields, refine_report
+from tracing import span
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+bp = Blueprint("brain", __name__)
 
-# Load trained model once
-try:
-    model = build_unet()
-    model.load_weights("./models/unet_brain_seg.h5")
-    logger.info("Model loaded successfully")
-except Exception as e:
-    logger.error(f"Error loading model: {str(e)}")
-    model = None
-
-# Reference measurements for gestational ages 18-24 weeks
-REFERENCE_DATA = {
-    18: {"hc": 145, "bpd": 42},
-    19: {"hc": 155, "bpd": 45},
-    20: {"hc": 170, "bpd": 48},
-    21: {"hc": 180, "bpd": 50},
-    22: {"hc": 190, "bpd": 53},
-    23: {"hc": 200, "bpd": 56},
-    24: {"hc": 210, "bpd": 59}
-}
-
-# Tolerance range (±10%) for normal measurements
-TOLERANCE = 0.10
+# Load and warm the trained model once, in the background
+# (shared with the other services when hosted by server.py)
+start_warmup(["brain"])
 
 def evaluate_measurement(value, reference, measurement_type, gest_age):
     """
@@ -78,10 +75,42 @@ def evaluate_measurement(value, reference, measurement_type, gest_age):
     
     return status, detail
 
-@app.route("/api/analyze-brain", methods=["POST"])
+def build_brain_report(bpd, hc, gest_age_weeks):
+    """
+    Evaluate BPD/HC against the reference for the gestational age and build the response body
+    """
+    # Get reference values for the gestational age
+    reference = REFERENCE_DATA[gest_age_weeks]
+    
+    # Evaluate measurements
+    bpd_status, bpd_detail = evaluate_measurement(bpd, reference["bpd"], "BPD", gest_age_weeks)
+    hc_status, hc_detail = evaluate_measurement(hc, reference["hc"], "HC", gest_age_weeks)
+    
+    # Generate summary message
+    if bpd_status == "normal" and hc_status == "normal":
+        summary = "BPD and HC measurements are normal."
+    elif bpd_status == "abnormal" and hc_status == "abnormal":
+        summary = "Both BPD and HC measurements are abnormal."
+    elif bpd_status == "abnormal":
+        summary = "BPD measurement is abnormal while HC is normal."
+    else:  # hc_status == "abnormal"
+        summary = "HC measurement is abnormal while BPD is normal."
+
+    return {
+        "summary": summary,
+        "bpd_mm": round(bpd, 2),
+        "hc_mm": round(hc, 2),
+        "bpd_status": bpd_status,
+        "hc_status": hc_status,
+        "bpd_detail": bpd_detail,
+        "hc_detail": hc_detail
+    }
+
+@bp.route("/api/analyze-brain", methods=["POST"])
 def analyze():
-    if model is None:
-        return jsonify({"error": "Model not loaded. Please check server logs."}), 500
+    if not is_ready("brain"):
+        return model_unavailable("brain")
+    scheduler = get_scheduler("brain")
         
     if "image" not in request.files:
         return jsonify({"error": "Missing image file"}), 400
@@ -96,84 +125,250 @@ def analyze():
         # Check if gestational age is in our reference range
         if gest_age_weeks < 18 or gest_age_weeks > 24:
             return jsonify({"error": "Gestational age must be between 18-24 weeks"}), 400
+
+        # "coarse" (default) or "refine": a second pass on a crop around the skull,
+        # and the frame of a multi-frame DICOM upload
+        try:
+            mode = parse_mode(request.form.get("measurementMode"))
+            frame = parse_frame(request.form.get("frame"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         filename = secure_filename(file.filename)
-        os.makedirs("temp", exist_ok=True)
-        image_path = os.path.join("temp", filename)
-        file.save(image_path)
-        logger.info(f"Image saved to {image_path}")
 
-        # Read image
-        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        # Same image and model as an earlier request: only the gestational-age evaluation runs again
+        cache = get_cache()
+        digest = scan_id(upload_digest(file), frame)
+        key = cache_key("brain", digest)
+        measurement_key = key if mode == "coarse" else cache_key("brain", digest, mode)
+        measurement = cache.get("measurement", measurement_key)
+        if measurement is not None:
+            logger.info(f"Result cache hit for {filename}")
+            with span("brain", "evaluate"):
+                report = build_brain_report(measurement["bpd_mm"], measurement["hc_mm"], gest_age_weeks)
+            if mode == "refine":
+                report.update(refine_report(measurement))
+            if measurement.get("overlay"):
+                ensure_scan(digest, file, frame)
+                report["annotation_url"] = annotation_url("brain", digest, mode)
+            return jsonify(report)
+
+        # Decode the upload in memory (a DICOM header also gives the pixel spacing)
+        try:
+            with span("brain", "decode"):
+                img, spacing = decode_scan_upload(file, frame)
+        except FrameOutOfRange as e:
+            return jsonify({"error": str(e)}), 400
         if img is None:
-            logger.error(f"Failed to read image at {image_path}")
+            logger.error(f"Failed to decode uploaded image {filename}")
             return jsonify({"error": "Invalid image or file format"}), 400
+        mask_spacing, source_spacing = pipeline_spacings(spacing, img.shape)
+        # Kept for rendering the annotated overlay later (see annotations.py)
+        remember_scan(digest, img)
 
         logger.info(f"Image shape: {img.shape}, min: {np.min(img)}, max: {np.max(img)}")
         
         try:
-            input_img = preprocess_image(img).reshape(1, 128, 128, 1)
-            logger.info(f"Preprocessed image shape: {input_img.shape}")
-            
-            predicted_mask = model.predict(input_img)[0].reshape(128, 128)
+            predicted_mask = cache.get("mask", key)
+            if predicted_mask is None:
+                with span("brain", "preprocess"):
+                    input_img = preprocess_image(img)
+                logger.info(f"Preprocessed image shape: {input_img.shape}")
+
+                # Batched with any concurrent requests for the brain model
+                with span("brain", "inference"):
+                    predicted_mask = scheduler.predict(input_img, request_priority())
+                cache.put("mask", key, predicted_mask)
             logger.info(f"Predicted mask shape: {predicted_mask.shape}, sum: {np.sum(predicted_mask)}")
             
-            # Save debug images if needed
-            cv2.imwrite(os.path.join("temp", f"debug_original_{filename}"), img)
-            cv2.imwrite(os.path.join("temp", f"debug_mask_{filename}"), (predicted_mask * 255).astype(np.uint8))
+            # Save debug images if this request is sampled (written in the background)
+            debug = start_capture(tag=os.path.splitext(filename)[0])
+            debug.save("original", img)
+            debug.save("mask", predicted_mask, scale=255)
 
-            bpd, hc, ellipse, center, annotated = calculate_bpd_and_hc_from_mask(
-                predicted_mask, img, pixel_spacing=0.3, gest_age_weeks=gest_age_weeks)
+            roi, refined = None, False
+            if mode == "refine":
+                # Segment a crop around the skull again; the coarse fit is used if nothing was localized
+                # or no ellipse could be fitted in the crop
+                with span("brain", "refine"):
+                    bpd, hc, ellipse, roi = refine_bpd_and_hc(
+                        img, predicted_mask, lambda x: scheduler.predict(x, request_priority()),
+                        pixel_spacing=measurement_spacing(source_spacing, "brain"), debug=debug)
+                refined = ellipse is not None
+                if refined:
+                    annotated = annotate_bpd_and_hc(img, ellipse, bpd, hc)
+                    overlay = ellipse_overlay(ellipse, img.shape)
+                else:
+                    logger.warning(f"Refinement failed for {filename} (ROI {roi}); using the coarse fit")
+            if not refined:
+                with span("brain", "postprocess"):
+                    bpd, hc, ellipse, center, annotated = calculate_bpd_and_hc_from_mask(
+                        predicted_mask, img, pixel_spacing=measurement_spacing(mask_spacing, "brain"),
+                        gest_age_weeks=gest_age_weeks, debug=debug)
+                # Fitted on the 128x128 mask
+                overlay = ellipse_overlay(ellipse, predicted_mask.shape[:2]) if ellipse is not None else None
             
             # Save annotated image
-            cv2.imwrite(os.path.join("temp", f"debug_annotated_{filename}"), annotated)
+            debug.save("annotated", annotated)
             
+        except QueueFull as e:
+            return queue_full(e)
         except Exception as e:
             logger.error(f"Error in image processing: {str(e)}")
+            note_error(e)
             return jsonify({"error": f"Processing error: {str(e)}"}), 500
 
-        os.remove(image_path)  # clean up temp file
-        
         if bpd is None or hc is None:
             logger.error("BPD or HC calculation failed")
             return jsonify({"error": "Could not analyze image. Brain contour may not be visible."}), 500
         
         logger.info(f"Analysis successful. BPD: {bpd:.2f}mm, HC: {hc:.2f}mm")
+        measurement = {"bpd_mm": float(bpd), "hc_mm": float(hc), "overlay": overlay}
+        if mode == "refine":
+            measurement.update(refine_fields(roi, refined))
+        cache.put("measurement", measurement_key, measurement)
         
-        # Get reference values for the gestational age
-        reference = REFERENCE_DATA[gest_age_weeks]
-        
-        # Evaluate measurements
-        bpd_status, bpd_detail = evaluate_measurement(bpd, reference["bpd"], "BPD", gest_age_weeks)
-        hc_status, hc_detail = evaluate_measurement(hc, reference["hc"], "HC", gest_age_weeks)
-        
-        # Generate summary message
-        if bpd_status == "normal" and hc_status == "normal":
-            summary = "BPD and HC measurements are normal."
-        elif bpd_status == "abnormal" and hc_status == "abnormal":
-            summary = "Both BPD and HC measurements are abnormal."
-        elif bpd_status == "abnormal":
-            summary = "BPD measurement is abnormal while HC is normal."
-        else:  # hc_status == "abnormal"
-            summary = "HC measurement is abnormal while BPD is normal."
-
-        return jsonify({
-            "summary": summary,
-            "bpd_mm": round(bpd, 2),
-            "hc_mm": round(hc, 2),
-            "bpd_status": bpd_status,
-            "hc_status": hc_status,
-            "bpd_detail": bpd_detail,
-            "hc_detail": hc_detail
-        })
+        with span("brain", "evaluate"):
+            report = build_brain_report(bpd, hc, gest_age_weeks)
+        if mode == "refine":
+            report.update(refine_report(measurement))
+        report["annotation_url"] = annotation_url("brain", digest, mode)
+        return jsonify(report)
         
     except Exception as e:
         logger.error(f"Unhandled exception: {str(e)}")
+        note_error(e)
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
-@app.route("/api/health", methods=["GET"])
-def health_check():
-    return jsonify({"status": "Server is running", "model_loaded": model is not None})
+@bp.route("/api/analyze-brain/batch", methods=["POST"])
+def analyze_batch():
+    """
+    Analyze many images in one request: a multipart list under `images` and/or a zip under `archive`.
+    Gestational age is the shared `gestationalAge` or per image via `gestationalAges` (JSON object
+    of filename -> weeks). One NDJSON line is streamed per image as soon as its chunk is done,
+    followed by a final {"done": true, ...} line. Inference runs in the "bulk" lane by default and
+    waits for room there, so a large batch slows down rather than crowding out interactive scans.
+    Each chunk is thresholded at once (biometry.select_thresholds, the same ladder as the single-image
+    path) and every mask is then measured with the same ellipse fit as /api/analyze-brain, so both
+    endpoints give the same BPD and HC for an image; masks with no usable threshold go through the
+    single-image classical fallback.
+    """
+    if not is_ready("brain"):
+        return model_unavailable("brain")
+    scheduler = get_scheduler("brain")
+    priority = request_priority("bulk")
+    # Turned away with 429 up front when the lane is already full
+    scheduler.check_admission(priority)
+
+    if "images" not in request.files and "archive" not in request.files:
+        return jsonify({"error": "Missing images or archive"}), 400
+
+    try:
+        shared_age, per_image_ages = parse_gestational_ages(request.form)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid gestational age: {str(e)}"}), 400
+
+    cache = get_cache()
+    # Read while the response streams, after the view has returned
+    uploads = detach_uploads(request)
+
+    def analyze_chunk(chunk):
+        ready = []
+        for index, (filename, data) in chunk:
+            gest_age_weeks = gestational_age_for(filename, shared_age, per_image_ages)
+            if gest_age_weeks is None:
+                yield {"index": index, "filename": filename, "error": "Missing gestational age"}
+            elif gest_age_weeks < 18 or gest_age_weeks > 24:
+                yield {"index": index, "filename": filename, "error": "Gestational age must be between 18-24 weeks"}
+            else:
+                digest = hashlib.sha256(data).hexdigest()
+                key = cache_key("brain", digest)
+                measurement_key = cache_key("brain", digest, "batch")
+                measurement = cache.get("measurement", measurement_key)
+                if measurement is not None:
+                    yield {"index": index, "filename": filename,
+                           **build_brain_report(measurement["bpd_mm"], measurement["hc_mm"], gest_age_weeks)}
+                    continue
+
+                img, spacing = decode_scan_bytes(data)
+                if img is None:
+                    yield {"index": index, "filename": filename, "error": "Invalid image or file format"}
+                else:
+                    mask_spacing = measurement_spacing(pipeline_spacings(spacing, img.shape)[0], "brain")
+                    ready.append([index, filename, img, gest_age_weeks, key, cache.get("mask", key), mask_spacing,
+                                  measurement_key])
+
+        if not ready:
+            return
+
+        # One set of batched forward passes for the images without a cached mask
+        uncached = [item for item in ready if item[5] is None]
+        if uncached:
+            with span("brain", "preprocess"):
+                inputs = [preprocess_image(item[2]) for item in uncached]
+            with span("brain", "inference"):
+                masks = scheduler.predict_many(inputs, priority, block=True)
+            for item, predicted_mask in zip(uncached, masks):
+                item[5] = predicted_mask
+                cache.put("mask", item[4], predicted_mask)
+
+        # Thresholds for the whole chunk in one vectorized pass; the fit itself is the single-image one
+        with span("brain", "postprocess"):
+            binary, _, levels = select_thresholds(np.stack([item[5] for item in ready]))
+
+        for i, (index, filename, img, gest_age_weeks, key, predicted_mask, mask_spacing, measurement_key) in enumerate(ready):
+            if levels[i] >= 0:
+                # Counted in /metrics as the single-image path counts it (fit_bpd_and_hc records the fallback)
+                record_threshold_level("brain", int(levels[i]))
+                with span("brain", "postprocess"):
+                    bpd, hc, ellipse = fit_binary_bpd_and_hc(binary[i], pixel_spacing=mask_spacing)
+            else:
+                # Prediction too weak for every threshold: the single-image path with its classical fallback
+                debug = start_capture(tag=os.path.splitext(os.path.basename(filename))[0])
+                with span("brain", "postprocess"):
+                    bpd, hc, ellipse, _, _ = calculate_bpd_and_hc_from_mask(
+                        predicted_mask, img, pixel_spacing=mask_spacing, gest_age_weeks=gest_age_weeks, debug=debug)
+            if bpd is None or hc is None:
+                yield {"index": index, "filename": filename,
+                       "error": "Could not analyze image. Brain contour may not be visible."}
+            else:
+                # Same payload as the single-image path (the ellipse is in 128x128 mask coordinates)
+                cache.put("measurement", measurement_key, {"bpd_mm": float(bpd), "hc_mm": float(hc),
+                                                          "overlay": ellipse_overlay(ellipse, predicted_mask.shape[:2])})
+                yield {"index": index, "filename": filename, **build_brain_report(bpd, hc, gest_age_weeks)}
+
+    def generate():
+        count = 0
+        errors = 0
+        try:
+            for chunk in chunked(enumerate(iter_uploaded_images(uploads))):
+                try:
+                    results = list(analyze_chunk(chunk))
+                except Exception as e:
+                    logger.error(f"Batch chunk failed: {str(e)}")
+                    results = [{"index": index, "filename": filename, "error": f"Processing error: {str(e)}"}
+                               for index, (filename, _) in chunk]
+
+                for result in results:
+                    count += 1
+                    errors += "error" in result
+                    yield ndjson_line(result)
+        except Exception as e:
+            logger.error(f"Batch request failed: {str(e)}")
+            errors += 1
+            yield ndjson_line({"error": f"An unexpected error occurred: {str(e)}"})
+        finally:
+            close_uploads(uploads)
+
+        yield ndjson_line({"done": True, "count": count, "errors": errors})
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+app = Flask(__name__)
+configure_app(app)
+app.register_blueprint(bp)
+app.register_blueprint(annotations_bp)
+app.register_blueprint(ops_bp)
 
 if __name__ == "__main__":
     app.run(debug=True, port=4000)
\ No newline at end of file
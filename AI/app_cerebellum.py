@@ -1,29 +1,22 @@
 # app_cerebellum.py
 # Flask API for cerebellum segmentation and TCD measurement
 
-import os
-from flask import Flask, request, jsonify
-from werkzeug.utils import secure_filename
-import cv2
-from fetal_cerebellum_diagnosis import build_unet, preprocess_image, calculate_tcd_from_mask
+from flask import Blueprint, Flask, request, jsonify
+from annotations import bp as annotations_bp, annotation_url, ellipse_overlay, ensure_scan, remember_scan, scan_id
+from fetal_cerebellum_diagnosis import preprocess_image, fit_tcd
+from dicom_io import FrameOutOfRange, decode_scan_upload, measurement_spacing, parse_frame, pipeline_spacings
+from image_io import configure_app, upload_digest
+from model_registry import get_scheduler, is_ready, start_warmup
+from ops import bp as ops_bp, model_unavailable, request_priority
+from reference_ranges import TCD_REFERENCE, TCD_TOLERANCE_MM
+from result_cache import cache_key, get_cache
+from roi_refinement import parse_mode, refine_fields, refine_report, refine_tcd
+from tracing import span
 
-app = Flask(__name__)
-
-# Load model on startup
-MODEL_PATH = "./models/unet_cerebellum_seg.h5"
-model = build_unet()
-model.load_weights(MODEL_PATH)
+bp = Blueprint("cerebellum", __name__)
 
-# TCD reference data (gestational age in weeks -> expected TCD in mm)
-TCD_REFERENCE = {
-    18: 18,
-    19: 19,
-    20: 20,
-    21: 21,
-    22: 22,
-    23: 23,
-    24: 24
-}
+# Load model on startup (loaded and warmed in the background)
+start_warmup(["cerebellum"])
 
 def is_tcd_normal(tcd_mm, gest_age_weeks):
     """Check if TCD measurement is within normal range for gestational age"""
@@ -38,39 +31,85 @@ def is_tcd_normal(tcd_mm, gest_age_weeks):
         expected_tcd = TCD_REFERENCE[gest_age_weeks]
     
     # Allow for 2mm variation (+/-) from expected value
-    return abs(tcd_mm - expected_tcd) <= 2
+    return abs(tcd_mm - expected_tcd) <= TCD_TOLERANCE_MM
 
-@app.route("/analyze-cerebellum", methods=["POST"])
+@bp.route("/analyze-cerebellum", methods=["POST"])
 def analyze_cerebellum():
+    if not is_ready("cerebellum"):
+        return model_unavailable("cerebellum")
+    scheduler = get_scheduler("cerebellum")
+
     if "image" not in request.files or "gestationalAge" not in request.form:
         return jsonify({"error": "Missing image or gestational age"}), 400
 
     file = request.files["image"]
     gest_age_weeks = int(request.form["gestationalAge"])
-    filename = secure_filename(file.filename)
-    image_path = os.path.join("temp", filename)
-    os.makedirs("temp", exist_ok=True)
-    file.save(image_path)
 
-    # Load and preprocess
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        return jsonify({"error": "Invalid image"}), 400
+    # "coarse" (default) or "refine": a second pass on a crop around the cerebellum,
+    # and the frame of a multi-frame DICOM upload
+    try:
+        mode = parse_mode(request.form.get("measurementMode"))
+        frame = parse_frame(request.form.get("frame"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    input_img = preprocess_image(img).reshape(1, 128, 128, 1)
-    predicted_mask = model.predict(input_img)[0].reshape(128, 128)
+    # A re-upload of the same image (same model) reuses its TCD; only the assessment below runs again
+    cache = get_cache()
+    digest = scan_id(upload_digest(file), frame)
+    key = cache_key("cerebellum", digest)
+    measurement_key = key if mode == "coarse" else cache_key("cerebellum", digest, mode)
+    measurement = cache.get("measurement", measurement_key)
+    if measurement is not None:
+        tcd_mm = measurement["tcd_mm"]
+        if measurement.get("overlay"):
+            ensure_scan(digest, file, frame)
+    else:
+        # Load and preprocess (decoded in memory, nothing written to disk)
+        try:
+            with span("cerebellum", "decode"):
+                img, spacing = decode_scan_upload(file, frame)
+        except FrameOutOfRange as e:
+            return jsonify({"error": str(e)}), 400
+        if img is None:
+            return jsonify({"error": "Invalid image"}), 400
+        mask_spacing, source_spacing = pipeline_spacings(spacing, img.shape)
+        # Kept for rendering the annotated overlay later (see annotations.py)
+        remember_scan(digest, img)
 
-    tcd_mm, _, status = calculate_tcd_from_mask(
-        predicted_mask, img, pixel_spacing=0.3, gest_age_weeks=gest_age_weeks
-    )
+        predicted_mask = cache.get("mask", key)
+        if predicted_mask is None:
+            with span("cerebellum", "preprocess"):
+                input_img = preprocess_image(img)
+            with span("cerebellum", "inference"):
+                predicted_mask = scheduler.predict(input_img, request_priority())
+            cache.put("mask", key, predicted_mask)
 
-    os.remove(image_path)  # cleanup
+        roi, refined = None, False
+        if mode == "refine":
+            # Segment a crop around the cerebellum again; the coarse fit is used if nothing was localized
+            # or no ellipse could be fitted in the crop
+            with span("cerebellum", "refine"):
+                tcd_mm, ellipse, roi = refine_tcd(img, predicted_mask,
+                                                  lambda x: scheduler.predict(x, request_priority()),
+                                                  pixel_spacing=measurement_spacing(source_spacing, "cerebellum"))
+            refined = tcd_mm is not None
+            frame_shape = img.shape
+        if not refined:
+            # Only the fit: the overlay is drawn on demand by annotations.py
+            with span("cerebellum", "postprocess"):
+                tcd_mm, ellipse = fit_tcd(predicted_mask, pixel_spacing=measurement_spacing(mask_spacing, "cerebellum"))
+            frame_shape = predicted_mask.shape[:2]
 
-    if tcd_mm is None:
-        return jsonify({"error": "Could not detect cerebellum"}), 500
+        if tcd_mm is None:
+            return jsonify({"error": "Could not detect cerebellum"}), 500
+        measurement = {"tcd_mm": float(tcd_mm), "overlay": ellipse_overlay(ellipse, frame_shape)}
+        if mode == "refine":
+            measurement.update(refine_fields(roi, refined))
+        cache.put("measurement", measurement_key, measurement)
     
     # New assessment and response formatting
-    tcd_normal = is_tcd_normal(tcd_mm, gest_age_weeks)
+    with span("cerebellum", "evaluate"):
+        tcd_normal = is_tcd_normal(tcd_mm, gest_age_weeks)
     expected_tcd = TCD_REFERENCE.get(gest_age_weeks, gest_age_weeks)  # Use rule of thumb if outside reference
     
     result = {
@@ -89,8 +128,18 @@ def analyze_cerebellum():
             result["recommendation"] = "Please perform more tests to narrow down causes. Low TCD may indicate cerebellar hypoplasia, which can be associated with genetic syndromes (e.g., Dandy-Walker), infections, or ischemia."
         else:  # high
             result["recommendation"] = "Please perform more tests to narrow down causes. High TCD measurements are rare and might indicate advanced development, macrosomia, or misdated gestation."
-    
+
+    if mode == "refine":
+        result.update(refine_report(measurement))
+    if measurement.get("overlay"):
+        result["annotation_url"] = annotation_url("cerebellum", digest, mode)
     return jsonify(result)
 
+app = Flask(__name__)
+configure_app(app)
+app.register_blueprint(bp)
+app.register_blueprint(annotations_bp)
+app.register_blueprint(ops_bp)
+
 if __name__ == "__main__":
     app.run(debug=True, port=4001)
\ No newline at end of file
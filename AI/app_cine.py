@@ -0,0 +1,93 @@
+# app_cine.py
+# Flask API for cine-loop (video) analysis: best frame and measurements per structure from one clip
+
+import logging
+from flask import Blueprint, Flask, request, jsonify
+from cine_analysis import (MAX_FRAMES, VIDEO_EXTENSIONS, analyze_frames, check_gestational_age, clip_fps,
+                           iter_video_frames, upload_as_file)
+from dicom_io import DICOM_EXTENSIONS, DicomFile, is_dicom, pipeline_spacings
+from image_io import configure_app
+from model_registry import MODEL_PATHS, get_scheduler, is_ready, start_warmup
+from ops import bp as ops_bp, model_unavailable, request_priority
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint("cine", __name__)
+
+# Every structure can be requested from a clip (loaded and warmed in the background)
+start_warmup(list(MODEL_PATHS))
+
+@bp.route("/api/analyze-cine", methods=["POST"])
+def analyze_cine():
+    """
+    Analyze a cine loop uploaded under `video` (a video file or a multi-frame DICOM, whose frames are
+    read one at a time and whose header pixel spacing is used). `structures` (comma-separated, default all) picks the
+    models; with `gestationalAge` each best-frame measurement is also evaluated against the reference.
+    Inference runs in the "bulk" lane unless X-Priority says otherwise.
+    """
+    if "video" not in request.files:
+        return jsonify({"error": "Missing video file"}), 400
+    file = request.files["video"]
+    dicom = is_dicom(file.stream) or (file.filename or "").lower().endswith(DICOM_EXTENSIONS)
+    if not dicom and not (file.filename or "").lower().endswith(VIDEO_EXTENSIONS):
+        return jsonify({"error": f"Unsupported video format (expected {', '.join(VIDEO_EXTENSIONS + DICOM_EXTENSIONS)})"}), 400
+
+    structures = [s.strip() for s in request.form.get("structures", ",".join(MODEL_PATHS)).split(",") if s.strip()]
+    unknown = [s for s in structures if s not in MODEL_PATHS]
+    if unknown or not structures:
+        return jsonify({"error": f"structures must be a comma-separated subset of {', '.join(MODEL_PATHS)}"}), 400
+
+    gest_age_weeks = request.form.get("gestationalAge")
+    try:
+        gest_age_weeks = int(gest_age_weeks) if gest_age_weeks else None
+    except ValueError:
+        return jsonify({"error": "Invalid gestational age"}), 400
+    if gest_age_weeks is not None:
+        try:
+            check_gestational_age(gest_age_weeks)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    for structure in structures:
+        if not is_ready(structure):
+            return model_unavailable(structure)
+
+    # A clip queues many frames: like the batch endpoint it runs in the "bulk" lane by default, so a long
+    # loop cannot fill the interactive lane. Every lane is checked before any frame is decoded, then
+    # each chunk waits for room
+    priority = request_priority("bulk")
+    predictors = {}
+    for structure in structures:
+        scheduler = get_scheduler(structure)
+        scheduler.check_admission(priority)
+        predictors[structure] = lambda inputs, scheduler=scheduler: scheduler.predict_many(inputs, priority, block=True)
+
+    if dicom:
+        try:
+            clip = DicomFile(file.stream)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        mask_spacing, _ = pipeline_spacings(clip.pixel_spacing, (clip.rows, clip.columns))
+        report = analyze_frames(clip.iter_frames(MAX_FRAMES), predictors, gest_age_weeks, fps=clip.fps,
+                                span=lambda stage: span("cine", stage), pixel_spacing=mask_spacing)
+    else:
+        with upload_as_file(file) as path:
+            try:
+                frames = iter_video_frames(path)
+                report = analyze_frames(frames, predictors, gest_age_weeks, fps=clip_fps(path),
+                                        span=lambda stage: span("cine", stage))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+    logger.info(f"Cine analysis: {report['frames']} in {report['elapsed_s']}s "
+                f"({report['throughput_fps']} frames/sec)")
+    return jsonify(report)
+
+app = Flask(__name__)
+configure_app(app)
+app.register_blueprint(bp)
+app.register_blueprint(ops_bp)
+
+if __name__ == "__main__":
+    app.run(debug=True, port=4003)
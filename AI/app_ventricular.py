@@ -1,38 +1,21 @@
 # app_ventricular.py
 # Flask API for lateral ventricular width (LVW) measurement and analysis
 
-import os
-from flask import Flask, request, jsonify
-from werkzeug.utils import secure_filename
-import cv2
-from fetal_ventricular_diagnosis import build_unet, preprocess_image, calculate_lvw_from_mask
+from flask import Blueprint, Flask, request, jsonify
+from annotations import bp as annotations_bp, annotation_url, box_overlay, ensure_scan, remember_scan, scan_id
+from fetal_ventricular_diagnosis import preprocess_image, fit_lvw
+from dicom_io import FrameOutOfRange, decode_scan_upload, measurement_spacing, parse_frame, pipeline_spacings
+from image_io import configure_app, upload_digest
+from model_registry import get_scheduler, is_ready, start_warmup
+from ops import bp as ops_bp, model_unavailable, request_priority
+from reference_ranges import get_normal_ranges
+from result_cache import cache_key, get_cache
+from tracing import span
 
-app = Flask(__name__)
-
-# Load model at startup
-MODEL_PATH = "./models/unet_ventricular_seg.h5"
-model = build_unet()
-model.load_weights(MODEL_PATH)
+bp = Blueprint("ventricular", __name__)
 
-# Define normal ranges based on gestational age
-def get_normal_ranges(gest_age_weeks):
-    normal_ranges = {
-        18: {"HC": 145, "BPD": 42, "TCD": 18, "LVW_max": 10},
-        19: {"HC": 155, "BPD": 45, "TCD": 19, "LVW_max": 10},
-        20: {"HC": 170, "BPD": 48, "TCD": 20, "LVW_max": 10},
-        21: {"HC": 180, "BPD": 50, "TCD": 21, "LVW_max": 10},
-        22: {"HC": 190, "BPD": 53, "TCD": 22, "LVW_max": 10},
-        23: {"HC": 200, "BPD": 56, "TCD": 23, "LVW_max": 10},
-        24: {"HC": 210, "BPD": 59, "TCD": 24, "LVW_max": 10},
-    }
-    
-    # If gestational age is outside our table, use closest value
-    if gest_age_weeks < 18:
-        return normal_ranges[18]
-    elif gest_age_weeks > 24:
-        return normal_ranges[24]
-    else:
-        return normal_ranges[gest_age_weeks]
+# Load model at startup (loaded and warmed in the background)
+start_warmup(["ventricular"])
 
 def analyze_lvw(lvw_mm, gest_age_weeks):
     normal_range = get_normal_ranges(gest_age_weeks)
@@ -65,37 +48,65 @@ def analyze_lvw(lvw_mm, gest_age_weeks):
         "recommendation": recommendation
     }
 
-@app.route("/analyze-ventricles", methods=["POST"])
+@bp.route("/analyze-ventricles", methods=["POST"])
 def analyze_ventricles():
+    if not is_ready("ventricular"):
+        return model_unavailable("ventricular")
+    scheduler = get_scheduler("ventricular")
+
     if "image" not in request.files or "gestationalAge" not in request.form:
         return jsonify({"error": "Missing image or gestational age"}), 400
 
     file = request.files["image"]
     gest_age_weeks = int(request.form["gestationalAge"])
-    filename = secure_filename(file.filename)
-    image_path = os.path.join("temp", filename)
-    os.makedirs("temp", exist_ok=True)
-    file.save(image_path)
-
-    # Load image
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        return jsonify({"error": "Invalid image"}), 400
+    # Frame of a multi-frame DICOM upload
+    try:
+        frame = parse_frame(request.form.get("frame"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    input_img = preprocess_image(img).reshape(1, 128, 128, 1)
-    predicted_mask = model.predict(input_img)[0].reshape(128, 128)
+    # A re-upload of the same image (same model) reuses its LVW; only analyze_lvw runs again
+    cache = get_cache()
+    digest = scan_id(upload_digest(file), frame)
+    key = cache_key("ventricular", digest)
+    measurement = cache.get("measurement", key)
+    if measurement is not None:
+        lvw_mm = measurement["lvw_mm"]
+        if measurement.get("overlay"):
+            ensure_scan(digest, file, frame)
+    else:
+        # Load image (decoded in memory, nothing written to disk)
+        try:
+            with span("ventricular", "decode"):
+                img, spacing = decode_scan_upload(file, frame)
+        except FrameOutOfRange as e:
+            return jsonify({"error": str(e)}), 400
+        if img is None:
+            return jsonify({"error": "Invalid image"}), 400
+        mask_spacing = measurement_spacing(pipeline_spacings(spacing, img.shape)[0], "ventricular")
+        # Kept for rendering the annotated overlay later (see annotations.py)
+        remember_scan(digest, img)
 
-    lvw_mm, _, _ = calculate_lvw_from_mask(
-        predicted_mask, img, pixel_spacing=0.3, gest_age_weeks=gest_age_weeks
-    )
+        predicted_mask = cache.get("mask", key)
+        if predicted_mask is None:
+            with span("ventricular", "preprocess"):
+                input_img = preprocess_image(img)
+            with span("ventricular", "inference"):
+                predicted_mask = scheduler.predict(input_img, request_priority())
+            cache.put("mask", key, predicted_mask)
 
-    os.remove(image_path)
+        # Only the fit: the overlay is drawn on demand by annotations.py
+        with span("ventricular", "postprocess"):
+            lvw_mm, box = fit_lvw(predicted_mask, pixel_spacing=mask_spacing)
 
-    if lvw_mm is None:
-        return jsonify({"error": "Unable to detect ventricles"}), 500
+        if lvw_mm is None:
+            return jsonify({"error": "Unable to detect ventricles"}), 500
+        measurement = {"lvw_mm": float(lvw_mm), "overlay": box_overlay(box, predicted_mask.shape[:2])}
+        cache.put("measurement", key, measurement)
 
     # Analyze the LVW measurement
-    analysis = analyze_lvw(lvw_mm, gest_age_weeks)
+    with span("ventricular", "evaluate"):
+        analysis = analyze_lvw(lvw_mm, gest_age_weeks)
     
     # Prepare response
     response = {
@@ -106,8 +117,16 @@ def analyze_ventricles():
         "details": analysis["details"],
         "recommendation": analysis["recommendation"]
     }
+    if measurement.get("overlay"):
+        response["annotation_url"] = annotation_url("ventricular", digest)
 
     return jsonify(response)
 
+app = Flask(__name__)
+configure_app(app)
+app.register_blueprint(bp)
+app.register_blueprint(annotations_bp)
+app.register_blueprint(ops_bp)
+
 if __name__ == "__main__":
     app.run(debug=True, port=4002)
\ No newline at end of file
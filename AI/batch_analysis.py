@@ -0,0 +1,82 @@
+# batch_analysis.py
+# Helpers for batch endpoints: iterate uploaded images (multipart list or zip) and stream NDJSON results
+
+import os
+import json
+import zipfile
+
+# Images per inference chunk; bounds how many decoded images are held at once
+BATCH_CHUNK_SIZE = int(os.environ.get("DRUEL_BATCH_CHUNK_SIZE", "16"))
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".dcm", ".dicom")
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+def parse_gestational_ages(form):
+    """
+    Read the shared `gestationalAge` and the optional per-image `gestationalAges`
+    (JSON object mapping filename -> weeks) from a batch request form.
+    Returns (shared_age or None, {filename: weeks}). Raises ValueError on malformed input.
+    """
+    shared = form.get("gestationalAge")
+    shared = int(shared) if shared not in (None, "") else None
+
+    per_image = {}
+    if form.get("gestationalAges"):
+        mapping = json.loads(form["gestationalAges"])
+        if not isinstance(mapping, dict):
+            raise ValueError("gestationalAges must be a JSON object of filename -> weeks")
+        per_image = {str(name): int(weeks) for name, weeks in mapping.items()}
+
+    return shared, per_image
+
+def gestational_age_for(filename, shared, per_image):
+    """Per-image age if given (by full name or basename), otherwise the shared one"""
+    if filename in per_image:
+        return per_image[filename]
+    return per_image.get(os.path.basename(filename), shared)
+
+def detach_uploads(request):
+    """
+    The request's uploaded files, taken over from it for a streamed response: Flask closes a
+    request's files when the view returns, before the response body is generated. The caller
+    closes them when done.
+    """
+    files = request.files
+    # Request.close() only closes what is cached on the request
+    request.__dict__.pop("files", None)
+    return files
+
+def close_uploads(files):
+    for file in files.values():
+        file.close()
+
+def iter_uploaded_images(files):
+    """
+    Yield (filename, encoded bytes) for every image in the request, lazily.
+    Accepts a multipart list under `images` and/or zip archives under `archive`;
+    archive members are read one at a time.
+    """
+    for file in files.getlist("images"):
+        yield file.filename, file.read()
+
+    for archive in files.getlist("archive"):
+        with zipfile.ZipFile(archive.stream) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                yield info.filename, zf.read(info)
+
+def chunked(iterable, size=BATCH_CHUNK_SIZE):
+    """Group an iterable into lists of at most `size` items"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def ndjson_line(obj):
+    return json.dumps(obj) + "\n"
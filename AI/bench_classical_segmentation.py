@@ -0,0 +1,123 @@
+# bench_classical_segmentation.py
+# Per-image cost of the classical_segmentation recipes against the functions they replaced
+# (which rebuilt their CLAHE object and structuring elements on every call), single images and
+# segment_batch() over a stack, and a check that the masks are unchanged.
+#
+# Usage:
+#   python bench_classical_segmentation.py --samples 200 --output bench_classical_segmentation.json
+
+import os
+import json
+import time
+import argparse
+import cv2
+import numpy as np
+from classical_segmentation import IMG_SIZE, segment, segment_batch
+from image_io import iter_image_folder
+from model_registry import DATASET_DIRS
+
+# ---------------- The implementations before classical_segmentation.py, for reference ----------------
+def legacy_brain_fallback(original_img):
+    img_proc = cv2.resize(original_img, (128, 128))
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    img_proc = clahe.apply(img_proc)
+    blur = cv2.GaussianBlur(img_proc, (5, 5), 0)
+    thresh = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 21, 5)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=1)
+    closing = cv2.morphologyEx(opening, cv2.MORPH_CLOSE, kernel, iterations=2)
+    edges = cv2.Canny(blur, 30, 150)
+    closed_edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+    combined = cv2.bitwise_or(closing, closed_edges)
+    contours, _ = cv2.findContours(combined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    binary_mask = np.zeros((128, 128), dtype=np.uint8)
+    if contours:
+        contours = sorted(contours, key=cv2.contourArea, reverse=True)
+        cv2.drawContours(binary_mask, [contours[0]], -1, 1, thickness=cv2.FILLED)
+        for i in range(1, min(3, len(contours))):
+            if cv2.contourArea(contours[i]) > 100:
+                cv2.drawContours(binary_mask, [contours[i]], -1, 1, thickness=cv2.FILLED)
+    return cv2.morphologyEx(binary_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+def _legacy_fill_largest(binary, count):
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    mask = np.zeros_like(binary)
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:count]:
+        cv2.drawContours(mask, [contour], -1, 255, thickness=cv2.FILLED)
+    return mask
+
+def _legacy_bright_regions(img):
+    blurred = cv2.GaussianBlur(img, (5, 5), 0)
+    equalized = cv2.equalizeHist(blurred)
+    _, thresh = cv2.threshold(equalized, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    return cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+def legacy_thalamic(img):
+    img = cv2.resize(img, IMG_SIZE)
+    blur = cv2.GaussianBlur(img, (5, 5), 0)
+    edges = cv2.Canny(blur, 30, 150)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    return _legacy_fill_largest(cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel), 1) // 255
+
+def legacy_cerebellum(img):
+    return _legacy_fill_largest(_legacy_bright_regions(cv2.resize(img, IMG_SIZE)), 1) // 255
+
+def legacy_ventricular(img):
+    return _legacy_fill_largest(_legacy_bright_regions(cv2.resize(img, IMG_SIZE)), 2) // 255
+
+# Recipe -> (legacy function, plane whose dataset images it runs on)
+CASES = {
+    "brain_fallback": (legacy_brain_fallback, "brain"),
+    "thalamic": (legacy_thalamic, "brain"),
+    "cerebellum": (legacy_cerebellum, "cerebellum"),
+    "ventricular": (legacy_ventricular, "ventricular"),
+}
+
+def per_image_ms(function, images, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function(images)
+        best = min(best, time.perf_counter() - started)
+    return round(best * 1000.0 / len(images), 4)
+
+def run_benchmark(samples, repeats, workers):
+    report = {"samples": samples, "repeats": repeats, "workers": workers, "recipes": {}}
+    images_by_plane = {}
+    for recipe, (legacy, plane) in CASES.items():
+        if plane not in images_by_plane:
+            images = [img for _, img in iter_image_folder(DATASET_DIRS[plane][0], limit=samples)]
+            images_by_plane[plane] = np.stack([cv2.resize(img, IMG_SIZE) for img in images])
+        stack = images_by_plane[plane]
+
+        legacy_masks = np.stack([legacy(img) for img in stack])
+        identical = bool(np.array_equal(legacy_masks, segment_batch(stack, recipe)))
+        result = {
+            "images": len(stack),
+            "identical_masks": identical,
+            "legacy_ms": per_image_ms(lambda xs: [legacy(img) for img in xs], stack, repeats),
+            "segment_ms": per_image_ms(lambda xs: [segment(img, recipe) for img in xs], stack, repeats),
+            "segment_batch_ms": per_image_ms(lambda xs: segment_batch(xs, recipe), stack, repeats),
+            f"segment_batch_{workers}_threads_ms": per_image_ms(
+                lambda xs: segment_batch(xs, recipe, workers=workers), stack, repeats),
+        }
+        result["speedup"] = round(result["legacy_ms"] / result["segment_batch_ms"], 2)
+        report["recipes"][recipe] = result
+        print(f"{recipe:15s} legacy {result['legacy_ms']:.3f} ms  segment {result['segment_ms']:.3f} ms  "
+              f"batch {result['segment_batch_ms']:.3f} ms  batch x{workers} "
+              f"{result[f'segment_batch_{workers}_threads_ms']:.3f} ms  identical {identical}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the classical segmentation recipes")
+    parser.add_argument("--samples", type=int, default=200, help="images per plane from AI/dataset")
+    parser.add_argument("--repeats", type=int, default=3, help="best of this many runs is reported")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default="bench_classical_segmentation.json")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.samples, args.repeats, args.workers)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
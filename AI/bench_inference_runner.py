@@ -0,0 +1,51 @@
+# bench_inference_runner.py
+# Microbenchmark: model.predict vs the compiled InferenceRunner for batch sizes 1-32.
+#
+# Usage:
+#   python bench_inference_runner.py
+#   python bench_inference_runner.py --xla --iterations 50 --weights ./models/unet_brain_seg.h5
+
+import os
+import time
+import argparse
+import numpy as np
+from inference_runner import InferenceRunner
+from unet import build_unet
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32]
+
+def time_calls(fn, inputs, iterations):
+    fn(inputs)  # warm-up / tracing
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn(inputs)
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return float(np.median(timings))
+
+def run_benchmark(weights=None, iterations=20, xla=False):
+    model = build_unet(compile=False)
+    if weights and os.path.exists(weights):
+        model.load_weights(weights)
+    runner = InferenceRunner(model, jit_compile=xla)
+
+    rng = np.random.default_rng(0)
+    print(f"{'batch':>5}  {'predict ms':>11}  {'runner ms':>10}  {'ms/img pred':>11}  {'ms/img run':>10}  {'speedup':>7}")
+    results = []
+    for batch_size in BATCH_SIZES:
+        inputs = rng.random((batch_size, 128, 128, 1), dtype=np.float32)
+        predict_ms = time_calls(lambda x: model.predict(x, verbose=0), inputs, iterations)
+        runner_ms = time_calls(runner.run, inputs, iterations)
+        results.append((batch_size, predict_ms, runner_ms))
+        print(f"{batch_size:>5}  {predict_ms:>11.2f}  {runner_ms:>10.2f}  {predict_ms / batch_size:>11.2f}  "
+              f"{runner_ms / batch_size:>10.2f}  {predict_ms / runner_ms:>6.2f}x")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare model.predict with InferenceRunner latency")
+    parser.add_argument("--weights", default=None, help="optional .h5 weights (latency does not depend on them)")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--xla", action="store_true", help="compile the runner with XLA")
+    args = parser.parse_args()
+
+    run_benchmark(args.weights, args.iterations, args.xla)
@@ -0,0 +1,224 @@
+# bench_pipeline.py
+# Per-stage benchmark of the thalamic, cerebellum and ventricular pipelines over AI/dataset:
+# decode, preprocess, inference, post-processing (threshold/contours), annotation and reference
+# evaluation, for several batch sizes. Results are saved as JSON and can be checked against a baseline.
+#
+# Usage:
+#   python bench_pipeline.py --output bench_pipeline.json
+#   python bench_pipeline.py --baseline bench_baseline.json --threshold 10   # exit 1 on a regression
+#   python bench_pipeline.py --output bench_baseline.json                    # record a new baseline
+
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import platform
+import numpy as np
+from biometry import evaluate_bpd_hc, evaluate_lvw, evaluate_tcd
+from fetal_brain_diagnosis import annotate_bpd_and_hc, fit_bpd_and_hc, preprocess_image
+from fetal_cerebellum_diagnosis import annotate_tcd, fit_tcd
+from fetal_ventricular_diagnosis import annotate_lvw, fit_lvw
+from image_io import decode_image_bytes
+from inference_backends import KerasBackend, load_backend
+from model_registry import DATASET_DIRS, MODEL_PATHS
+
+PLANES = ["brain", "cerebellum", "ventricular"]
+BATCH_SIZES = [1, 4, 8, 16]
+STAGES = ["decode", "preprocess", "inference", "postprocess", "annotate", "evaluate"]
+
+# Gestational age used for the reference evaluation stage
+BENCH_GA_WEEKS = 21
+
+def load_samples(plane, samples):
+    """Encoded image bytes from the plane's dataset folder (read once, so disk I/O is not timed)"""
+    folder = DATASET_DIRS[plane][0]
+    data = []
+    for fname in sorted(os.listdir(folder)):
+        if fname.endswith(".png") and len(data) < samples:
+            with open(os.path.join(folder, fname), "rb") as f:
+                data.append(f.read())
+    return data
+
+def load_plane_backend(plane):
+    """The configured backend for the plane; untrained Keras weights when the .h5 is missing"""
+    if os.path.exists(MODEL_PATHS[plane]):
+        return load_backend(MODEL_PATHS[plane]), True
+    print(f"  {MODEL_PATHS[plane]} not found: using untrained weights (post-processing timings are not representative)")
+    return KerasBackend(None), False
+
+def measure(plane, mask, img):
+    """Post-processing stage: mask -> (measurement, geometry)"""
+    if plane == "brain":
+        bpd, hc, ellipse = fit_bpd_and_hc(mask, img)
+        return (bpd, hc), ellipse
+    if plane == "cerebellum":
+        return fit_tcd(mask)
+    return fit_lvw(mask)
+
+def annotate(plane, img, value, geometry):
+    if plane == "brain":
+        return annotate_bpd_and_hc(img, geometry, *value)
+    if plane == "cerebellum":
+        return annotate_tcd(img, geometry, value, "")
+    return annotate_lvw(img, geometry, value, "")
+
+def evaluate(plane, value):
+    if plane == "brain":
+        return evaluate_bpd_hc(value[0], value[1], BENCH_GA_WEEKS)
+    if plane == "cerebellum":
+        return evaluate_tcd(value, BENCH_GA_WEEKS)
+    return evaluate_lvw(value, BENCH_GA_WEEKS)
+
+def summarize(timings_ms):
+    if not timings_ms:
+        return None
+    timings_ms = np.asarray(timings_ms)
+    return {
+        "count": int(len(timings_ms)),
+        "p50_ms": round(float(np.percentile(timings_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(timings_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(timings_ms, 99)), 3),
+        "mean_ms": round(float(timings_ms.mean()), 3),
+    }
+
+def run_batch_size(plane, backend, data, batch_size):
+    """
+    Run the whole pipeline over `data` in batches of `batch_size`. Per-image stages are timed per
+    image; inference is timed per batch. Returns per-stage summaries and end-to-end throughput.
+    """
+    timings = {stage: [] for stage in STAGES}
+    started = time.perf_counter()
+
+    for i in range(0, len(data), batch_size):
+        imgs, inputs = [], []
+        for encoded in data[i:i + batch_size]:
+            t0 = time.perf_counter()
+            img = decode_image_bytes(encoded)
+            t1 = time.perf_counter()
+            inputs.append(preprocess_image(img).astype(np.float32))
+            t2 = time.perf_counter()
+            timings["decode"].append((t1 - t0) * 1000.0)
+            timings["preprocess"].append((t2 - t1) * 1000.0)
+            imgs.append(img)
+
+        t0 = time.perf_counter()
+        masks = backend.predict(np.stack(inputs)).reshape(-1, 128, 128)
+        timings["inference"].append((time.perf_counter() - t0) * 1000.0)
+
+        for img, mask in zip(imgs, masks):
+            t0 = time.perf_counter()
+            value, geometry = measure(plane, mask, img)
+            t1 = time.perf_counter()
+            timings["postprocess"].append((t1 - t0) * 1000.0)
+            if geometry is None:
+                continue
+            annotate(plane, img, value, geometry)
+            t2 = time.perf_counter()
+            evaluate(plane, value)
+            t3 = time.perf_counter()
+            timings["annotate"].append((t2 - t1) * 1000.0)
+            timings["evaluate"].append((t3 - t2) * 1000.0)
+
+    elapsed = time.perf_counter() - started
+    stages = {stage: summarize(values) for stage, values in timings.items()}
+    stages["inference"]["per_image_mean_ms"] = round(stages["inference"]["mean_ms"] * len(timings["inference"])
+                                                     / len(data), 3)
+    return {
+        "images": len(data),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_ips": round(len(data) / elapsed, 2) if elapsed > 0 else 0.0,
+        "stages": stages,
+    }
+
+def run_benchmark(planes, samples, batch_sizes):
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "samples": samples,
+            "batch_sizes": batch_sizes,
+        },
+        "planes": {},
+    }
+    # The pipeline functions print diagnostics for every image; keep them off the console
+    with open(os.devnull, "w") as devnull:
+        for plane in planes:
+            print(f"{plane}:")
+            data = load_samples(plane, samples)
+            backend, trained = load_plane_backend(plane)
+            backend.warm_up(batch_sizes)
+            results = {"trained_weights": trained, "backend": backend.name, "batch_sizes": {}}
+            for batch_size in batch_sizes:
+                with contextlib.redirect_stdout(devnull):
+                    result = run_batch_size(plane, backend, data, batch_size)
+                results["batch_sizes"][str(batch_size)] = result
+                print(f"  batch {batch_size:>3}: {result['throughput_ips']:8.2f} images/sec  "
+                      + "  ".join(f"{stage} p50 {result['stages'][stage]['p50_ms']:.2f}ms"
+                                  for stage in STAGES if result["stages"][stage]))
+            report["planes"][plane] = results
+    return report
+
+def compare_to_baseline(report, baseline, threshold_percent):
+    """
+    Regressions of more than `threshold_percent` against the baseline: slower p50/p95 stage latency
+    or lower throughput, for every plane and batch size present in both reports.
+    """
+    regressions = []
+    for plane, results in report["planes"].items():
+        base_results = baseline.get("planes", {}).get(plane)
+        if base_results is None:
+            continue
+        for batch_size, result in results["batch_sizes"].items():
+            base = base_results["batch_sizes"].get(batch_size)
+            if base is None:
+                continue
+
+            limit = 1 + threshold_percent / 100.0
+            if result["throughput_ips"] * limit < base["throughput_ips"]:
+                regressions.append(f"{plane} batch {batch_size}: throughput {base['throughput_ips']} -> "
+                                   f"{result['throughput_ips']} images/sec")
+            for stage in STAGES:
+                current, previous = result["stages"].get(stage), base["stages"].get(stage)
+                if not current or not previous:
+                    continue
+                for stat in ("p50_ms", "p95_ms"):
+                    if current[stat] > previous[stat] * limit:
+                        regressions.append(f"{plane} batch {batch_size}: {stage} {stat} "
+                                           f"{previous[stat]} -> {current[stat]}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage benchmark of the analysis pipelines")
+    parser.add_argument("--planes", nargs="+", choices=PLANES, default=PLANES)
+    parser.add_argument("--samples", type=int, default=50, help="images per plane from AI/dataset")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=BATCH_SIZES)
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument("--baseline", default=None, help="earlier report to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="allowed slowdown in percent before a stage counts as a regression")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.planes, args.samples, args.batch_sizes)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.threshold)
+        report["baseline"] = {"path": args.baseline, "threshold_percent": args.threshold,
+                              "regressions": regressions}
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.threshold}% against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            exit_code = 1
+        else:
+            print(f"No regressions beyond {args.threshold}% against {args.baseline}")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+    sys.exit(exit_code)
@@ -0,0 +1,110 @@
+# bench_roi_refinement.py
+# Coarse vs coarse-to-fine (ROI) measurement for the brain and cerebellum pipelines: latency per image
+# and measurement stability, i.e. how much BPD/HC/TCD move when the same frame is shifted by a few pixels.
+#
+# Usage:
+#   python bench_roi_refinement.py --samples 30 --output bench_roi_refinement.json
+
+import os
+import json
+import time
+import argparse
+import contextlib
+import cv2
+import numpy as np
+from bench_pipeline import load_plane_backend, load_samples, summarize
+from dicom_io import measurement_spacing, pipeline_spacings
+from fetal_brain_diagnosis import fit_bpd_and_hc, preprocess_image
+from fetal_cerebellum_diagnosis import fit_tcd
+from image_io import decode_image_bytes
+from roi_refinement import ROI_MARGIN, refine_bpd_and_hc, refine_tcd
+
+PLANES = ["brain", "cerebellum"]
+MODES = ["coarse", "refine"]
+
+# Translations (dx, dy) in frame pixels applied to every image for the stability check
+JITTER = [(0, 0), (4, 0), (-4, 0), (0, 4), (0, -4), (3, 3), (-3, -3)]
+
+def shift(img, dx, dy):
+    matrix = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(img, matrix, (img.shape[1], img.shape[0]), borderMode=cv2.BORDER_REFLECT)
+
+def measure(plane, mode, img, predict):
+    """The plane's measurements (a tuple of mm values, or None) in `mode`"""
+    coarse_mask = predict(preprocess_image(img))
+    mask_spacing, source_spacing = (measurement_spacing(spacing, plane) for spacing in pipeline_spacings(None, img.shape))
+    if plane == "brain":
+        if mode == "refine":
+            bpd, hc, _, _ = refine_bpd_and_hc(img, coarse_mask, predict, pixel_spacing=source_spacing)
+        else:
+            bpd, hc, _ = fit_bpd_and_hc(coarse_mask, img, pixel_spacing=mask_spacing)
+        return None if bpd is None else (bpd, hc)
+
+    if mode == "refine":
+        tcd, _, _ = refine_tcd(img, coarse_mask, predict, pixel_spacing=source_spacing)
+    else:
+        tcd, _ = fit_tcd(coarse_mask, pixel_spacing=mask_spacing)
+    return None if tcd is None else (tcd,)
+
+def run_plane(plane, backend, images):
+    predict = lambda x: backend.predict(x[None].astype(np.float32)).reshape(128, 128)
+    results = {}
+    for mode in MODES:
+        latencies, variations, failures = [], [], 0
+        for img in images:
+            values = []
+            for dx, dy in JITTER:
+                shifted = shift(img, dx, dy)
+                started = time.perf_counter()
+                try:
+                    value = measure(plane, mode, shifted, predict)
+                except cv2.error:  # e.g. too few contour points to fit an ellipse
+                    value = None
+                latencies.append((time.perf_counter() - started) * 1000.0)
+                if value is None:
+                    failures += 1
+                else:
+                    values.append(value)
+            # Coefficient of variation of each measurement across the shifted copies
+            if len(values) > 1:
+                values = np.asarray(values)
+                variations.append(values.std(axis=0) / np.maximum(values.mean(axis=0), 1e-6) * 100.0)
+
+        variations = np.asarray(variations) if variations else np.zeros((0, 1))
+        results[mode] = {
+            "latency": summarize(latencies),
+            "failures": failures,
+            "cv_percent_mean": [round(float(v), 3) for v in variations.mean(axis=0)] if len(variations) else None,
+            "cv_percent_p95": [round(float(v), 3) for v in np.percentile(variations, 95, axis=0)]
+                              if len(variations) else None,
+        }
+    return results
+
+def run_benchmark(planes, samples):
+    report = {"jitter": JITTER, "roi_margin": ROI_MARGIN, "samples": samples, "planes": {}}
+    # The measurement functions print diagnostics for every image; keep them off the console
+    with open(os.devnull, "w") as devnull:
+        for plane in planes:
+            images = [decode_image_bytes(data) for data in load_samples(plane, samples)]
+            backend, trained = load_plane_backend(plane)
+            backend.warm_up([1])
+            with contextlib.redirect_stdout(devnull):
+                results = run_plane(plane, backend, images)
+            report["planes"][plane] = {"trained_weights": trained, "modes": results}
+            for mode in MODES:
+                r = results[mode]
+                print(f"{plane:10s} {mode:6s} p50 {r['latency']['p50_ms']:8.2f} ms  p95 {r['latency']['p95_ms']:8.2f} ms  "
+                      f"CV {r['cv_percent_mean']}%  failures {r['failures']}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark coarse vs ROI-refined measurement")
+    parser.add_argument("--planes", nargs="+", choices=PLANES, default=PLANES)
+    parser.add_argument("--samples", type=int, default=30, help="images per plane from AI/dataset")
+    parser.add_argument("--output", default="bench_roi_refinement.json")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.planes, args.samples)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
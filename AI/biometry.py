@@ -0,0 +1,200 @@
+# biometry.py
+# Vectorized batch biometry (BPD/HC/TCD/LVW) on (N, 128, 128) stacks of predicted masks
+
+import math
+import cv2
+import numpy as np
+from reference_ranges import REFERENCE_DATA, TOLERANCE, TCD_REFERENCE, TCD_TOLERANCE_MM, NORMAL_RANGES
+
+# Threshold ladder: the first threshold leaving more than MIN_MASK_PIXELS foreground pixels is used
+MASK_THRESHOLDS = [0.5, 0.25, 0.1, 0.05]
+MIN_MASK_PIXELS = 200
+
+# ---------------- Reference tables as arrays ----------------
+_GA_MIN = min(REFERENCE_DATA)
+_GA_MAX = max(REFERENCE_DATA)
+_GA_RANGE = range(_GA_MIN, _GA_MAX + 1)
+
+_REF_BPD = np.array([REFERENCE_DATA[ga]["bpd"] for ga in _GA_RANGE], dtype=np.float64)
+_REF_HC = np.array([REFERENCE_DATA[ga]["hc"] for ga in _GA_RANGE], dtype=np.float64)
+_REF_TCD = np.array([TCD_REFERENCE[ga] for ga in _GA_RANGE], dtype=np.float64)
+_REF_LVW_MAX = np.array([NORMAL_RANGES[ga]["LVW_max"] for ga in _GA_RANGE], dtype=np.float64)
+
+# ---------------- Thresholding ----------------
+def select_thresholds(masks, thresholds=MASK_THRESHOLDS, min_pixels=MIN_MASK_PIXELS):
+    """
+    Pick the threshold for every mask in one pass.
+    Returns (binary uint8 stack, chosen threshold per mask, ladder level per mask).
+    Masks where no threshold passes get threshold NaN, level -1 and an empty binary mask;
+    these are the ones the single-image path sends to the classical CV fallback.
+    """
+    masks = np.asarray(masks, dtype=np.float32).reshape(-1, 128, 128)
+    thresholds = np.asarray(thresholds, dtype=np.float32)
+
+    # Pixel counts for every (mask, threshold) pair: (N, T)
+    counts = (masks[:, None, :, :] > thresholds[None, :, None, None]).sum(axis=(2, 3))
+    passes = counts > min_pixels
+
+    level = np.where(passes.any(axis=1), passes.argmax(axis=1), -1)
+    chosen = np.where(level >= 0, thresholds[np.maximum(level, 0)], np.nan)
+
+    binary = (masks > np.where(level >= 0, chosen, np.inf)[:, None, None]).astype(np.uint8)
+    return binary, chosen, level
+
+def keep_largest_component(binary):
+    """
+    Zero every pixel outside each mask's largest connected component, matching the
+    largest-contour selection of the single-image functions.
+    """
+    out = np.zeros_like(binary)
+    for i, mask in enumerate(binary):
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        if count > 1:
+            largest = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+            out[i] = labels == largest
+    return out
+
+def fill_largest_contour(binary):
+    """
+    Each mask's largest external contour (by contour area, as the single-image functions pick it)
+    drawn filled: other components are dropped and holes inside the outline are filled, so the
+    moments describe the same outline cv2.fitEllipse is given.
+    """
+    out = np.zeros_like(binary)
+    for i, mask in enumerate(binary):
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if contours:
+            cv2.drawContours(out[i], [max(contours, key=cv2.contourArea)], -1, 1, thickness=cv2.FILLED)
+    return out
+
+# ---------------- Measurements ----------------
+def ellipse_from_moments(binary):
+    """
+    Ellipse of equal second moments for every mask in the stack.
+    Returns (cx, cy, major, minor, angle_deg), each of shape (N,); axes are full lengths in pixels
+    (NaN for empty masks). This matches cv2.fitEllipse on the contour only for a solid, filled,
+    roughly elliptical region: rings and holes change the moments but not the contour fit, so pass
+    masks through fill_largest_contour() first. Real masks are rarely that regular: on the dataset's
+    masks, BPD from the moments differs from fit_bpd_and_hc by 19% on average (median 9%, up to 91%
+    where the skull outline is an open arc, whose contour fit overshoots) and TCD from fit_tcd by
+    7.5% (median 6%, up to 31%). The analysis endpoints measure with the fit_* functions; this
+    engine is for ranking frames and for comparing two sets of masks measured the same way.
+    """
+    binary = np.asarray(binary, dtype=np.float64)
+    n, h, w = binary.shape
+    xs = np.arange(w, dtype=np.float64)
+    ys = np.arange(h, dtype=np.float64)
+
+    col_sums = binary.sum(axis=1)  # (N, W)
+    row_sums = binary.sum(axis=2)  # (N, H)
+    m00 = col_sums.sum(axis=1)
+    safe = np.where(m00 > 0, m00, 1.0)
+
+    cx = col_sums @ xs / safe
+    cy = row_sums @ ys / safe
+    mu20 = col_sums @ (xs * xs) / safe - cx * cx
+    mu02 = row_sums @ (ys * ys) / safe - cy * cy
+    mu11 = np.einsum("nhw,h,w->n", binary, ys, xs) / safe - cx * cy
+
+    # Eigenvalues of the covariance matrix; a filled ellipse with semi-axis a has variance a^2 / 4
+    common = np.sqrt(((mu20 - mu02) / 2) ** 2 + mu11 ** 2)
+    lambda1 = (mu20 + mu02) / 2 + common
+    lambda2 = np.maximum((mu20 + mu02) / 2 - common, 0.0)
+    major = 4 * np.sqrt(lambda1)
+    minor = 4 * np.sqrt(lambda2)
+    angle = np.degrees(0.5 * np.arctan2(2 * mu11, mu20 - mu02))
+
+    empty = m00 == 0
+    for values in (cx, cy, major, minor, angle):
+        values[empty] = np.nan
+    return cx, cy, major, minor, angle
+
+def horizontal_extent(binary):
+    """Bounding-box width in pixels of every mask (0 for empty masks), like cv2.boundingRect"""
+    cols = np.asarray(binary).any(axis=1)  # (N, W)
+    w = cols.shape[1]
+    first = cols.argmax(axis=1)
+    last = w - 1 - cols[:, ::-1].argmax(axis=1)
+    return np.where(cols.any(axis=1), last - first + 1, 0)
+
+def measure_batch(masks, structure, pixel_spacing=0.3, largest_component=True):
+    """
+    Measure a stack of predicted masks for one structure ("brain", "cerebellum" or "ventricular").
+    `pixel_spacing` may be a scalar or one value per mask. With `largest_component`, each mask is
+    reduced to its filled largest contour first. The ventricular width equals fit_lvw's; BPD, HC
+    and TCD are moment estimates that can differ from the single-image fits by tens of percent on
+    real masks (see ellipse_from_moments), so report those with the fit_* functions.
+    Returns a dict of (N,) arrays in mm, NaN where nothing could be measured.
+    """
+    masks = np.asarray(masks, dtype=np.float32).reshape(-1, 128, 128)
+    spacing = np.broadcast_to(np.asarray(pixel_spacing, dtype=np.float64), (len(masks),))
+
+    if structure == "brain":
+        binary, chosen, level = select_thresholds(masks)
+    else:
+        # The cerebellum and ventricular paths use a fixed 0.5 threshold
+        binary, chosen, level = select_thresholds(masks, thresholds=[0.5], min_pixels=0)
+
+    if largest_component:
+        binary = fill_largest_contour(binary)
+
+    result = {"threshold": chosen, "threshold_level": level}
+
+    if structure == "ventricular":
+        width = horizontal_extent(binary).astype(np.float64)
+        result["lvw_mm"] = np.where(width > 0, width * spacing, np.nan)
+        return result
+
+    cx, cy, major, minor, angle = ellipse_from_moments(binary)
+    # Geometry in mask pixels, drawable as the cv2 ellipse ((center_x, center_y), (major, minor), angle)
+    result.update({"center_x": cx, "center_y": cy, "major": major, "minor": minor, "angle": angle})
+
+    # As fit_bpd_and_hc and fit_tcd read them: cv2.fitEllipse returns its axes shortest first, and
+    # those functions take BPD from the second axis and TCD from the first
+    if structure == "brain":
+        result["bpd_mm"] = major * spacing
+        result["hc_mm"] = math.pi * ((major + minor) / 2) * spacing
+    elif structure == "cerebellum":
+        result["tcd_mm"] = minor * spacing
+    else:
+        raise ValueError(f"Unknown structure: {structure}")
+
+    return result
+
+# ---------------- Reference evaluation ----------------
+def _ga_index(gest_age_weeks):
+    ga = np.asarray(gest_age_weeks, dtype=np.int64)
+    return ga, np.clip(ga, _GA_MIN, _GA_MAX) - _GA_MIN
+
+def evaluate_bpd_hc(bpd_mm, hc_mm, gest_age_weeks):
+    """
+    Array version of app.evaluate_measurement for BPD and HC.
+    Returns boolean arrays (bpd_normal, hc_normal, ga_in_range); results outside 18-24 weeks
+    use the nearest table row and are flagged by ga_in_range.
+    """
+    ga, idx = _ga_index(gest_age_weeks)
+    bpd_mm = np.asarray(bpd_mm, dtype=np.float64)
+    hc_mm = np.asarray(hc_mm, dtype=np.float64)
+
+    ref_bpd = _REF_BPD[idx]
+    ref_hc = _REF_HC[idx]
+    bpd_normal = (bpd_mm >= ref_bpd * (1 - TOLERANCE)) & (bpd_mm <= ref_bpd * (1 + TOLERANCE))
+    hc_normal = (hc_mm >= ref_hc * (1 - TOLERANCE)) & (hc_mm <= ref_hc * (1 + TOLERANCE))
+    return bpd_normal, hc_normal, (ga >= _GA_MIN) & (ga <= _GA_MAX)
+
+def evaluate_tcd(tcd_mm, gest_age_weeks):
+    """
+    Array version of app_cerebellum.is_tcd_normal. Returns (tcd_normal, expected_tcd).
+    """
+    ga, idx = _ga_index(gest_age_weeks)
+    in_table = (ga >= _GA_MIN) & (ga <= _GA_MAX)
+    expected = np.where(in_table, _REF_TCD[idx], ga.astype(np.float64))
+    return np.abs(np.asarray(tcd_mm, dtype=np.float64) - expected) <= TCD_TOLERANCE_MM, expected
+
+def evaluate_lvw(lvw_mm, gest_age_weeks):
+    """
+    Array version of the app_ventricular.analyze_lvw status. Returns (lvw_normal, lvw_max).
+    """
+    _, idx = _ga_index(gest_age_weeks)
+    lvw_max = _REF_LVW_MAX[idx]
+    return np.asarray(lvw_mm, dtype=np.float64) < lvw_max, lvw_max
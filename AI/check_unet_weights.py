@@ -0,0 +1,73 @@
+# check_unet_weights.py
+# Check that the serving U-Net (unet.build_unet, built from the shared encoder/decoder) loads the .h5
+# checkpoints written by the training scripts and gives the same masks as the training architecture.
+# For each model, the checkpoint is loaded into both graphs, which are compared layer by layer
+# (type and weight shapes, in load order) and on images from its dataset. A model without a
+# checkpoint is checked with a freshly initialised training model saved as one.
+#
+# Usage:
+#   python check_unet_weights.py --samples 16 --output check_unet_weights.json
+
+import os
+import json
+import argparse
+import tempfile
+import numpy as np
+from compare_backends import load_inputs
+from model_registry import MODEL_PATHS
+from train_model import build_unet as build_training_unet
+from unet import build_unet
+
+# Largest |difference| of mask probabilities accepted (float32 round-off only)
+MAX_ABS_DIFF = 1e-5
+
+def layer_signature(model):
+    """(layer type, weight shapes) of every layer holding weights, in the order load_weights reads them"""
+    return [(type(layer).__name__, [tuple(w.shape) for w in layer.get_weights()])
+            for layer in model.layers if layer.get_weights()]
+
+def check_model(name, samples):
+    path = MODEL_PATHS[name]
+    reference = build_training_unet()
+    tmp = None
+    if not os.path.exists(path):
+        # Saved the way ModelCheckpoint saves a full model
+        tmp = tempfile.NamedTemporaryFile(suffix=".h5", delete=False)
+        tmp.close()
+        reference.save(tmp.name)
+    weights = tmp.name if tmp else path
+    try:
+        reference.load_weights(weights)
+        serving = build_unet(compile=False)
+        serving.load_weights(weights)
+    finally:
+        if tmp:
+            os.remove(tmp.name)
+
+    inputs = load_inputs(name, samples)
+    difference = float(np.abs(reference.predict(inputs, verbose=0) - serving.predict(inputs, verbose=0)).max())
+    result = {
+        "weights": path if not tmp else "freshly initialised",
+        "same_layers": layer_signature(reference) == layer_signature(serving),
+        "max_abs_diff": difference,
+        "images": len(inputs),
+    }
+    result["ok"] = result["same_layers"] and difference <= MAX_ABS_DIFF
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the serving U-Net against the training architecture")
+    parser.add_argument("--models", nargs="+", choices=sorted(MODEL_PATHS), default=sorted(MODEL_PATHS))
+    parser.add_argument("--samples", type=int, default=16, help="images per model from AI/dataset")
+    parser.add_argument("--output", default="check_unet_weights.json")
+    args = parser.parse_args()
+
+    report = {name: check_model(name, args.samples) for name in args.models}
+    for name, result in report.items():
+        print(f"{name:12s} {result['weights']}: same layers {result['same_layers']}, "
+              f"max |diff| {result['max_abs_diff']:.2e} -> {'OK' if result['ok'] else 'MISMATCH'}")
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+    if not all(result["ok"] for result in report.values()):
+        raise SystemExit(1)
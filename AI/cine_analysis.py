@@ -0,0 +1,217 @@
+# cine_analysis.py
+# Cine-loop (video) analysis: frames are decoded one at a time, near-duplicates are skipped with a cheap
+# frame-difference test, the rest are batched through the U-Nets, and the best frame per structure
+# (ranked by mask confidence x ellipse fit) is measured as the still endpoints measure an image.
+# Only one chunk of frames and the best frame and mask per structure are held at a time, so memory
+# does not grow with the clip length.
+
+import os
+import time
+import shutil
+import tempfile
+import contextlib
+import cv2
+import numpy as np
+from batch_analysis import BATCH_CHUNK_SIZE
+from biometry import (ellipse_from_moments, evaluate_bpd_hc, evaluate_lvw, evaluate_tcd, keep_largest_component,
+                      select_thresholds)
+from dicom_io import measurement_spacing
+from fetal_brain_diagnosis import fit_bpd_and_hc, preprocess_image
+from fetal_cerebellum_diagnosis import fit_tcd
+from fetal_ventricular_diagnosis import fit_lvw
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm")
+
+# Mean absolute difference (0-255) from the last analysed frame below which a frame is skipped
+DIFF_THRESHOLD = float(os.environ.get("DRUEL_CINE_DIFF_THRESHOLD", "3.0"))
+# Frames are compared at this size, so the test costs a resize and a subtraction
+DIFF_SIZE = (64, 64)
+# Longest clip analysed; later frames are ignored
+MAX_FRAMES = int(os.environ.get("DRUEL_CINE_MAX_FRAMES", "3000"))
+
+@contextlib.contextmanager
+def upload_as_file(file_storage):
+    """
+    Path of a temporary copy of an upload, for decoders that need a file (cv2.VideoCapture).
+    The copy is streamed in chunks and removed afterwards.
+    """
+    extension = os.path.splitext(file_storage.filename or "")[1].lower() or ".mp4"
+    file_storage.stream.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as tmp:
+        shutil.copyfileobj(file_storage.stream, tmp)
+    try:
+        yield tmp.name
+    finally:
+        os.remove(tmp.name)
+
+def clip_fps(path):
+    capture = cv2.VideoCapture(path)
+    try:
+        return capture.get(cv2.CAP_PROP_FPS) or None
+    finally:
+        capture.release()
+
+def iter_video_frames(path, max_frames=MAX_FRAMES):
+    """Yield (index, grayscale frame) for each decodable frame of the clip, one at a time"""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError("Could not open the video")
+    try:
+        index = 0
+        while index < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if frame.ndim == 3:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            yield index, frame
+            index += 1
+    finally:
+        capture.release()
+
+def skip_similar(frames, threshold=DIFF_THRESHOLD, counts=None):
+    """
+    Drop frames whose downsampled mean absolute difference from the last kept frame is below
+    `threshold`. `counts` (a dict) receives the number of frames "decoded" and "skipped".
+    """
+    last = None
+    for index, frame in frames:
+        thumb = cv2.resize(frame, DIFF_SIZE, interpolation=cv2.INTER_AREA)
+        if counts is not None:
+            counts["decoded"] = counts.get("decoded", 0) + 1
+        if last is not None and cv2.absdiff(thumb, last).mean() < threshold:
+            if counts is not None:
+                counts["skipped"] = counts.get("skipped", 0) + 1
+            continue
+        last = thumb
+        yield index, frame
+
+def frame_scores(masks, structure):
+    """
+    Quality of each (128, 128) mask for measuring `structure`: mean confidence inside the
+    binarized largest component, times how well it matches its equal-moments ellipse (IoU)
+    for the elliptical structures. 0 for empty masks. Only used to rank frames; the selected
+    frame is measured with measure_frame().
+    """
+    masks = np.asarray(masks, dtype=np.float32).reshape(-1, 128, 128)
+    if structure == "brain":
+        binary, _, _ = select_thresholds(masks)
+    else:
+        binary, _, _ = select_thresholds(masks, thresholds=[0.5], min_pixels=0)
+    binary = keep_largest_component(binary)
+
+    area = binary.sum(axis=(1, 2))
+    confidence = (masks * binary).sum(axis=(1, 2)) / np.maximum(area, 1)
+    if structure == "ventricular":
+        return np.where(area > 0, confidence, 0.0)
+
+    cx, cy, major, minor, angle = ellipse_from_moments(binary)
+    fit = np.zeros(len(masks))
+    for i in np.flatnonzero(area > 0):
+        ellipse = np.zeros((128, 128), dtype=np.uint8)
+        cv2.ellipse(ellipse, ((cx[i], cy[i]), (major[i], minor[i]), angle[i]), 1, thickness=cv2.FILLED)
+        union = np.logical_or(ellipse, binary[i]).sum()
+        fit[i] = np.logical_and(ellipse, binary[i]).sum() / union if union else 0.0
+    return confidence * fit
+
+def measure_frame(structure, mask, frame, pixel_spacing=(0.3, 0.3)):
+    """
+    Measurements of one frame from its (128, 128) mask, fitted as the still endpoints do
+    (fit_bpd_and_hc, with its classical fallback, fit_tcd or fit_lvw): dict of mm values,
+    empty if nothing could be fitted. `pixel_spacing` is the (x, y) mask spacing.
+    """
+    pixel_spacing = measurement_spacing(pixel_spacing, structure)
+    try:
+        if structure == "brain":
+            bpd_mm, hc_mm, _ = fit_bpd_and_hc(mask, frame, pixel_spacing)
+            return {} if bpd_mm is None else {"bpd_mm": bpd_mm, "hc_mm": hc_mm}
+        if structure == "cerebellum":
+            tcd_mm, _ = fit_tcd(mask, pixel_spacing)
+            return {} if tcd_mm is None else {"tcd_mm": tcd_mm}
+        lvw_mm, _ = fit_lvw(mask, pixel_spacing)
+        return {} if lvw_mm is None else {"lvw_mm": lvw_mm}
+    except cv2.error:  # too few contour points to fit an ellipse
+        return {}
+
+def check_gestational_age(gest_age_weeks):
+    """ValueError outside the reference data (18-24 weeks), as the still brain endpoint answers"""
+    if gest_age_weeks < 18 or gest_age_weeks > 24:
+        raise ValueError("Gestational age must be between 18-24 weeks")
+
+def _evaluate(structure, measurement, gest_age_weeks):
+    check_gestational_age(gest_age_weeks)
+    if structure == "brain":
+        bpd_normal, hc_normal, _ = evaluate_bpd_hc(measurement["bpd_mm"], measurement["hc_mm"], gest_age_weeks)
+        return {"bpd_normal": bool(bpd_normal), "hc_normal": bool(hc_normal)}
+    if structure == "cerebellum":
+        tcd_normal, expected = evaluate_tcd(measurement["tcd_mm"], gest_age_weeks)
+        return {"tcd_normal": bool(tcd_normal), "expected_tcd_mm": round(float(expected), 2)}
+    lvw_normal, lvw_max = evaluate_lvw(measurement["lvw_mm"], gest_age_weeks)
+    return {"lvw_normal": bool(lvw_normal), "lvw_max_mm": round(float(lvw_max), 2)}
+
+def analyze_frames(frames, predictors, gest_age_weeks=None, chunk_size=BATCH_CHUNK_SIZE, fps=None, span=None,
+                   pixel_spacing=(0.3, 0.3)):
+    """
+    Run the cine pipeline over `frames` ((index, grayscale frame) pairs, e.g. from iter_video_frames).
+    `predictors` maps structure -> function(list of preprocessed inputs) -> list of (128, 128) masks.
+    `pixel_spacing` is the (x, y) spacing in mm per mask pixel.
+    `span(stage)` (optional) is a context manager timing each stage.
+    Returns the report: frame counts, frames per second and the best frame per structure.
+    ValueError if `gest_age_weeks` is given and outside 18-24 weeks.
+    """
+    if gest_age_weeks is not None:
+        check_gestational_age(gest_age_weeks)
+    span = span or (lambda stage: contextlib.nullcontext())
+    started = time.perf_counter()
+    counts = {"decoded": 0, "skipped": 0}
+    best = {structure: (-1.0, None, None, None) for structure in predictors}  # (score, frame index, frame, mask)
+    analysed = 0
+
+    chunk = []
+    kept = iter(skip_similar(frames, counts=counts))
+    while True:
+        with span("decode"):
+            chunk = [item for _, item in zip(range(chunk_size), kept)]
+        if not chunk:
+            break
+        analysed += len(chunk)
+        with span("preprocess"):
+            inputs = [preprocess_image(frame) for _, frame in chunk]
+
+        for structure, predict in predictors.items():
+            with span("inference"):
+                masks = np.stack(predict(inputs))
+            with span("postprocess"):
+                scores = frame_scores(masks, structure)
+            i = int(np.argmax(scores))
+            if scores[i] > best[structure][0]:
+                best[structure] = (float(scores[i]), chunk[i][0], chunk[i][1], masks[i].copy())
+
+    elapsed = time.perf_counter() - started
+    structures = {}
+    for structure, (score, index, frame, mask) in best.items():
+        if mask is None or score <= 0:
+            structures[structure] = {"error": f"No usable {structure} frame found"}
+            continue
+        with span("postprocess"):
+            values = measure_frame(structure, mask, frame, pixel_spacing)
+        measurement = {name: round(float(value), 2) for name, value in values.items()}
+        if not measurement:
+            structures[structure] = {"error": f"Could not measure the best {structure} frame"}
+            continue
+        result = {"frame_index": index, "score": round(score, 4), **measurement}
+        if fps:
+            result["time_s"] = round(index / fps, 3)
+        if gest_age_weeks is not None:
+            with span("evaluate"):
+                result.update(_evaluate(structure, measurement, gest_age_weeks))
+        structures[structure] = result
+
+    return {
+        "frames": {"decoded": counts["decoded"], "skipped": counts["skipped"], "analysed": analysed},
+        "clip_fps": round(fps, 2) if fps else None,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_fps": round(counts["decoded"] / elapsed, 2) if elapsed > 0 else 0.0,
+        "analysed_fps": round(analysed / elapsed, 2) if elapsed > 0 else 0.0,
+        "structures": structures,
+    }
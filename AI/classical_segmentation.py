@@ -0,0 +1,107 @@
+# classical_segmentation.py
+# Classical-CV segmentation shared by the serving fallback (fit_bpd_and_hc) and offline mask generation
+# (mask_generation.py): structuring elements are built once, recipes are named, and segment_batch()
+# runs a recipe over a stack of images into one preallocated (N, 128, 128) array.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+IMG_SIZE = (128, 128)
+
+# Built once at import instead of on every call
+KERNEL_3 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+KERNEL_5 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+
+CLAHE_CLIP_LIMIT = 2.0
+CLAHE_TILE_GRID = (8, 8)
+
+# CLAHE objects keep internal buffers, so each thread gets its own (created on first use)
+_local = threading.local()
+
+def _clahe():
+    clahe = getattr(_local, "clahe", None)
+    if clahe is None:
+        clahe = _local.clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID)
+    return clahe
+
+def _fill_largest(binary, count, min_area=None):
+    """
+    The `count` largest external contours of `binary`, filled with 1. After the first, contours
+    must be larger than `min_area` (when given) to be kept.
+    """
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    mask = np.zeros(binary.shape, dtype=np.uint8)
+    for i, contour in enumerate(sorted(contours, key=cv2.contourArea, reverse=True)[:count]):
+        if i > 0 and min_area is not None and cv2.contourArea(contour) <= min_area:
+            continue
+        cv2.drawContours(mask, [contour], -1, 1, thickness=cv2.FILLED)
+    return mask
+
+def _bright_regions(img):
+    blurred = cv2.GaussianBlur(img, (5, 5), 0)
+    equalized = cv2.equalizeHist(blurred)
+    _, thresh = cv2.threshold(equalized, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, KERNEL_3, iterations=2)
+
+# ---------------- Recipes: 128x128 uint8 grayscale -> 128x128 uint8 mask of 0/1 ----------------
+def thalamic(img):
+    """Edges -> closing -> largest filled contour (skull outline); training masks for the brain plane"""
+    blur = cv2.GaussianBlur(img, (5, 5), 0)
+    edges = cv2.Canny(blur, 30, 150)
+    closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, KERNEL_5)
+    return _fill_largest(closed, 1)
+
+def cerebellum(img):
+    """Equalized Otsu threshold -> closing -> largest filled contour (cerebellum)"""
+    return _fill_largest(_bright_regions(img), 1)
+
+def ventricular(img):
+    """Equalized Otsu threshold -> closing -> two largest filled contours (lateral ventricles)"""
+    return _fill_largest(_bright_regions(img), 2)
+
+def brain_fallback(img):
+    """
+    CLAHE -> adaptive threshold + opening/closing, combined with closed Canny edges -> largest contour
+    plus up to two more over 100 px -> closing. Used when the U-Net brain mask is too weak.
+    """
+    enhanced = _clahe().apply(img)
+    blur = cv2.GaussianBlur(enhanced, (5, 5), 0)
+    thresh = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 21, 5)
+    opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, KERNEL_5, iterations=1)
+    closing = cv2.morphologyEx(opening, cv2.MORPH_CLOSE, KERNEL_5, iterations=2)
+    edges = cv2.morphologyEx(cv2.Canny(blur, 30, 150), cv2.MORPH_CLOSE, KERNEL_5)
+    mask = _fill_largest(cv2.bitwise_or(closing, edges), 3, min_area=100)
+    return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, KERNEL_5, iterations=2)
+
+RECIPES = {
+    "thalamic": thalamic,
+    "cerebellum": cerebellum,
+    "ventricular": ventricular,
+    "brain_fallback": brain_fallback,
+}
+
+def segment(img, recipe):
+    """Mask (128x128, 0/1) of grayscale `img` (resized to 128x128 if needed) with the named recipe"""
+    if img.shape[:2] != IMG_SIZE[::-1]:
+        img = cv2.resize(img, IMG_SIZE)
+    return RECIPES[recipe](img)
+
+def segment_batch(images, recipe, workers=None):
+    """
+    Masks for a stack (N, 128, 128) or list of grayscale images: an (N, 128, 128) uint8 array of 0/1.
+    With `workers` > 1 images are split across threads (OpenCV releases the GIL).
+    """
+    out = np.empty((len(images),) + IMG_SIZE[::-1], dtype=np.uint8)
+
+    def run(i):
+        out[i] = segment(images[i], recipe)
+
+    if workers and workers > 1 and len(images) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(run, range(len(images))))
+    else:
+        for i in range(len(images)):
+            run(i)
+    return out
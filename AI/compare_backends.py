@@ -0,0 +1,116 @@
+# compare_backends.py
+# Compare exported TFLite models against the Keras baseline: latency, memory and measurement drift.
+#
+# Usage:
+#   python compare_backends.py --samples 50 --output backend_report.json
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from biometry import measure_batch
+from dataset_cache import DatasetCache
+from metrics import process_rss_bytes
+from inference_backends import QUANTIZATIONS, KerasBackend, TFLiteBackend, tflite_path
+from model_registry import DATASET_DIRS, MODEL_PATHS
+
+# Measurement reported for each model
+MEASUREMENTS = {
+    "brain": ["bpd_mm", "hc_mm"],
+    "cerebellum": ["tcd_mm"],
+    "ventricular": ["lvw_mm"],
+}
+
+def load_inputs(name, samples):
+    """The first `samples` preprocessed images of the model's dataset, from the dataset cache"""
+    images, _, _ = DatasetCache().load(*DATASET_DIRS[name])
+    return np.array(images[:samples], dtype=np.float32)
+
+def predict_all(backend, inputs, batch_size=16):
+    return np.concatenate([backend.predict(inputs[i:i + batch_size]) for i in range(0, len(inputs), batch_size)])
+
+def profile_backend(name, variant, inputs):
+    """Load one backend variant and measure load memory, single-image latency and its masks"""
+    rss_before = process_rss_bytes()
+    started = time.perf_counter()
+    if variant == "keras":
+        backend = KerasBackend(MODEL_PATHS[name])
+        model_file = MODEL_PATHS[name]
+    else:
+        model_file = tflite_path(MODEL_PATHS[name], variant)
+        backend = TFLiteBackend(model_file)
+    load_s = time.perf_counter() - started
+
+    backend.predict(inputs[:1])  # warm-up
+
+    latencies = []
+    for i in range(len(inputs)):
+        started = time.perf_counter()
+        backend.predict(inputs[i:i + 1])
+        latencies.append((time.perf_counter() - started) * 1000.0)
+
+    masks = predict_all(backend, inputs).reshape(-1, 128, 128)
+    return {
+        "model_file_mb": round(os.path.getsize(model_file) / 1e6, 2),
+        "load_s": round(load_s, 3),
+        "rss_increase_mb": round((process_rss_bytes() - rss_before) / 1e6, 1),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies, 50)), 2),
+            "p95": round(float(np.percentile(latencies, 95)), 2),
+            "mean": round(float(np.mean(latencies)), 2),
+        },
+    }, masks
+
+def drift(name, baseline_masks, masks):
+    """Absolute difference (mm) between measurements from the baseline and variant masks"""
+    baseline = measure_batch(baseline_masks, name)
+    variant = measure_batch(masks, name)
+    report = {}
+    for key in MEASUREMENTS[name]:
+        diff = np.abs(variant[key] - baseline[key])
+        valid = ~np.isnan(diff)
+        report[key] = {
+            "mean_abs_mm": round(float(diff[valid].mean()), 3) if valid.any() else None,
+            "max_abs_mm": round(float(diff[valid].max()), 3) if valid.any() else None,
+            "unmeasurable_changed": int((np.isnan(variant[key]) != np.isnan(baseline[key])).sum()),
+        }
+    mask_diff = np.abs(masks - baseline_masks)
+    report["mask_mean_abs_diff"] = round(float(mask_diff.mean()), 5)
+    return report
+
+def compare(names, samples):
+    report = {}
+    for name in names:
+        inputs = load_inputs(name, samples)
+        print(f"{name}: {len(inputs)} images")
+
+        baseline_stats, baseline_masks = profile_backend(name, "keras", inputs)
+        report[name] = {"keras": baseline_stats}
+
+        for quantization in QUANTIZATIONS:
+            if not os.path.exists(tflite_path(MODEL_PATHS[name], quantization)):
+                continue
+            variant = f"tflite_{quantization}"
+            stats, masks = profile_backend(name, quantization, inputs)
+            stats["drift"] = drift(name, baseline_masks, masks)
+            stats["speedup_p50"] = round(baseline_stats["latency_ms"]["p50"] / stats["latency_ms"]["p50"], 2)
+            report[name][variant] = stats
+
+        for variant, stats in report[name].items():
+            print(f"  {variant:16s} p50 {stats['latency_ms']['p50']:8.2f} ms  "
+                  f"p95 {stats['latency_ms']['p95']:8.2f} ms  "
+                  f"file {stats['model_file_mb']:7.2f} MB  rss +{stats['rss_increase_mb']:.1f} MB")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare TFLite exports with the Keras baseline")
+    parser.add_argument("--models", nargs="+", choices=sorted(MODEL_PATHS), default=sorted(MODEL_PATHS))
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--output", default="backend_report.json")
+    args = parser.parse_args()
+
+    report = compare(args.models, args.samples)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
@@ -0,0 +1,93 @@
+# compare_multitask.py
+# Compare the multi-task U-Net against the three separate models: latency for a full exam
+# (every structure for one image), weight memory and measurement agreement per structure.
+#
+# Usage:
+#   python compare_multitask.py --samples 50 --output multitask_report.json
+
+import json
+import time
+import argparse
+import numpy as np
+from compare_backends import drift, load_inputs, predict_all
+from inference_backends import KerasBackend, MultiTaskKerasBackend
+from metrics import process_rss_bytes
+from model_registry import MODEL_PATHS, MULTITASK_HEADS, MULTITASK_MODEL_PATH
+
+def percentiles(latencies):
+    return {
+        "p50": round(float(np.percentile(latencies, 50)), 2),
+        "p95": round(float(np.percentile(latencies, 95)), 2),
+        "mean": round(float(np.mean(latencies)), 2),
+    }
+
+def load_models(build):
+    """Build backends with `build()` and report load time, RSS growth and parameter count"""
+    rss_before = process_rss_bytes()
+    started = time.perf_counter()
+    backends = build()
+    load_s = time.perf_counter() - started
+    params = sum(backend.model.count_params() for backend in backends.values())
+    return backends, {
+        "load_s": round(load_s, 3),
+        "rss_increase_mb": round((process_rss_bytes() - rss_before) / 1e6, 1),
+        "parameters": int(params),
+        "weights_mb": round(params * 4 / 1e6, 1),
+    }
+
+def exam_latency(predict_exam, inputs):
+    """Per-image latency (ms) of computing every structure's mask for that image"""
+    predict_exam(inputs[:1])  # warm-up
+    latencies = []
+    for i in range(len(inputs)):
+        started = time.perf_counter()
+        predict_exam(inputs[i:i + 1])
+        latencies.append((time.perf_counter() - started) * 1000.0)
+    return percentiles(latencies)
+
+def compare(samples):
+    separate, separate_stats = load_models(
+        lambda: {name: KerasBackend(MODEL_PATHS[name]) for name in MULTITASK_HEADS})
+    multitask, multitask_stats = load_models(
+        lambda: {"multitask": MultiTaskKerasBackend(MULTITASK_MODEL_PATH, MULTITASK_HEADS)})
+    multitask = multitask["multitask"]
+
+    inputs = {name: load_inputs(name, samples) for name in MULTITASK_HEADS}
+    exam_inputs = inputs[MULTITASK_HEADS[0]]
+    separate_stats["exam_latency_ms"] = exam_latency(
+        lambda x: [backend.predict(x) for backend in separate.values()], exam_inputs)
+    multitask_stats["exam_latency_ms"] = exam_latency(multitask.predict, exam_inputs)
+
+    # Agreement on each structure's own dataset
+    agreement = {}
+    for i, name in enumerate(MULTITASK_HEADS):
+        baseline_masks = predict_all(separate[name], inputs[name]).reshape(-1, 128, 128)
+        masks = predict_all(multitask, inputs[name])[..., i]
+        agreement[name] = drift(name, baseline_masks, masks)
+
+    report = {
+        "samples": {name: len(x) for name, x in inputs.items()},
+        "separate": separate_stats,
+        "multitask": multitask_stats,
+        "exam_speedup_p50": round(separate_stats["exam_latency_ms"]["p50"]
+                                  / multitask_stats["exam_latency_ms"]["p50"], 2),
+        "agreement": agreement,
+    }
+
+    for variant in ("separate", "multitask"):
+        stats = report[variant]
+        print(f"{variant:10s} exam p50 {stats['exam_latency_ms']['p50']:8.2f} ms  "
+              f"p95 {stats['exam_latency_ms']['p95']:8.2f} ms  "
+              f"weights {stats['weights_mb']:7.1f} MB  rss +{stats['rss_increase_mb']:.1f} MB")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the multi-task U-Net with the separate models")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--output", default="multitask_report.json")
+    args = parser.parse_args()
+
+    report = compare(args.samples)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
@@ -0,0 +1,149 @@
+# dataset_cache.py
+# Content-addressed cache of preprocessed 128x128 image/mask pairs, stored as memory-mapped .npy files.
+# Entries are keyed by the SHA-256 of the image and mask bytes plus the preprocessing parameters,
+# so a folder is only re-preprocessed for pairs whose files (or the parameters) actually changed.
+
+import os
+import json
+import hashlib
+import cv2
+import numpy as np
+from fetal_brain_diagnosis import preprocess_image
+
+CACHE_DIR = os.environ.get("DRUEL_DATASET_CACHE_DIR", "./dataset_cache")
+
+# Bump whenever preprocess_image changes, to invalidate every cached entry
+PREPROCESS_VERSION = 1
+
+def list_pairs(image_folder, mask_folder):
+    """Sorted (image path, mask path) lists for every PNG that has a mask with the same name"""
+    image_paths, mask_paths = [], []
+    for fname in sorted(os.listdir(image_folder)):
+        mask_path = os.path.join(mask_folder, fname)
+        if fname.endswith(".png") and os.path.exists(mask_path):
+            image_paths.append(os.path.join(image_folder, fname))
+            mask_paths.append(mask_path)
+    return image_paths, mask_paths
+
+def _stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def _preprocess(data, dtype):
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    if dtype == "uint8":
+        # preprocess_image before its /255 scaling; divide by 255 when reading
+        return cv2.equalizeHist(cv2.resize(img, (128, 128))).reshape(128, 128, 1)
+    return preprocess_image(img).astype(np.float32)
+
+def _write_array(path, array):
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+class DatasetCache:
+    """
+    load(image_folder, mask_folder) returns (images, masks, filenames) where images and masks are
+    read-only memory-mapped (N, 128, 128, 1) arrays of `dtype` ("float32" in [0, 1], or "uint8").
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, dtype="float32"):
+        if dtype not in ("float32", "uint8"):
+            raise ValueError(f"Unsupported cache dtype: {dtype}")
+        self.cache_dir = cache_dir
+        self.dtype = dtype
+        self.params = {"size": 128, "equalize_hist": True, "dtype": dtype, "version": PREPROCESS_VERSION}
+
+    def _shard_dir(self, image_folder, mask_folder):
+        folders = os.path.abspath(image_folder) + "|" + os.path.abspath(mask_folder)
+        params = json.dumps(self.params, sort_keys=True)
+        digest = hashlib.sha256((folders + "|" + params).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{os.path.basename(os.path.normpath(image_folder))}_{digest}")
+
+    def _entry_key(self, image_path, mask_path):
+        h = hashlib.sha256()
+        for path in (image_path, mask_path):
+            with open(path, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        h.update(json.dumps(self.params, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def _read_index(self, shard):
+        try:
+            with open(os.path.join(shard, "index.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"entries": []}
+
+    def load(self, image_folder, mask_folder):
+        shard = self._shard_dir(image_folder, mask_folder)
+        os.makedirs(shard, exist_ok=True)
+        images_path = os.path.join(shard, "images.npy")
+        masks_path = os.path.join(shard, "masks.npy")
+
+        old_entries = self._read_index(shard)["entries"]
+        old_by_name = {entry["name"]: entry for entry in old_entries}
+
+        # Unchanged size+mtime reuses the stored content hash without reading the file
+        entries = []
+        for image_path, mask_path in zip(*list_pairs(image_folder, mask_folder)):
+            name = os.path.basename(image_path)
+            stats = [_stat(image_path), _stat(mask_path)]
+            old = old_by_name.get(name)
+            key = old["key"] if old and old["stats"] == stats else self._entry_key(image_path, mask_path)
+            entries.append({"name": name, "stats": stats, "key": key,
+                            "image_path": image_path, "mask_path": mask_path})
+
+        arrays_exist = os.path.exists(images_path) and os.path.exists(masks_path)
+        if arrays_exist and [e["key"] for e in entries] == [e["key"] for e in old_entries]:
+            return self._open(images_path, masks_path, [e["name"] for e in entries])
+
+        entries = self._rebuild(entries, old_entries, images_path, masks_path, arrays_exist)
+        with open(os.path.join(shard, "index.json.tmp"), "w") as f:
+            json.dump({"params": self.params, "entries": [
+                {"name": e["name"], "stats": e["stats"], "key": e["key"]} for e in entries]}, f)
+        os.replace(os.path.join(shard, "index.json.tmp"), os.path.join(shard, "index.json"))
+
+        return self._open(images_path, masks_path, [e["name"] for e in entries])
+
+    def _rebuild(self, entries, old_entries, images_path, masks_path, arrays_exist):
+        """Write new arrays, copying rows whose key is already cached and preprocessing the rest"""
+        old_rows = {entry["key"]: row for row, entry in enumerate(old_entries)} if arrays_exist else {}
+        old_images = np.load(images_path, mmap_mode="r") if old_rows else None
+        old_masks = np.load(masks_path, mmap_mode="r") if old_rows else None
+
+        images, masks, kept = [], [], []
+        reused = 0
+        for entry in entries:
+            row = old_rows.get(entry["key"])
+            if row is not None:
+                images.append(np.array(old_images[row]))
+                masks.append(np.array(old_masks[row]))
+                reused += 1
+            else:
+                with open(entry["image_path"], "rb") as f:
+                    img = _preprocess(f.read(), self.dtype)
+                with open(entry["mask_path"], "rb") as f:
+                    mask = _preprocess(f.read(), self.dtype)
+                if img is None or mask is None:
+                    continue
+                images.append(img)
+                masks.append(mask)
+            kept.append(entry)
+
+        shape = (0, 128, 128, 1)
+        _write_array(images_path, np.stack(images) if images else np.zeros(shape, dtype=self.dtype))
+        _write_array(masks_path, np.stack(masks) if masks else np.zeros(shape, dtype=self.dtype))
+        print(f"Dataset cache: {len(kept)} pairs ({reused} reused, {len(kept) - reused} preprocessed)")
+        return kept
+
+    def _open(self, images_path, masks_path, names):
+        return np.load(images_path, mmap_mode="r"), np.load(masks_path, mmap_mode="r"), names
+
+def to_float(array):
+    """Model-ready float32 in [0, 1] from either cache dtype"""
+    if array.dtype == np.uint8:
+        return array.astype(np.float32) / 255.0
+    return np.asarray(array, dtype=np.float32)
@@ -0,0 +1,163 @@
+# debug_artifacts.py
+# Sampled debug-image capture written by a background thread, never inline in the request path
+
+import os
+import time
+import queue
+import random
+import logging
+import threading
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# "off", "sample" (DEBUG_SAMPLE_PERCENT of requests) or "always"
+DEBUG_MODE = os.environ.get("DRUEL_DEBUG_ARTIFACTS", "off").lower()
+DEBUG_SAMPLE_PERCENT = float(os.environ.get("DRUEL_DEBUG_SAMPLE_PERCENT", "5"))
+DEBUG_DIR = os.environ.get("DRUEL_DEBUG_DIR", "temp")
+
+# Pending writes beyond this are dropped rather than blocking the request
+QUEUE_SIZE = int(os.environ.get("DRUEL_DEBUG_QUEUE_SIZE", "64"))
+
+# Retention cap for the debug directory; oldest debug_* files are removed first
+MAX_FILES = int(os.environ.get("DRUEL_DEBUG_MAX_FILES", "500"))
+MAX_BYTES = int(os.environ.get("DRUEL_DEBUG_MAX_MB", "100")) * 1024 * 1024
+
+FILE_PREFIX = "debug_"
+
+class DebugArtifactWriter:
+    """
+    Bounded queue of debug images and a daemon thread that writes them and enforces retention.
+    """
+
+    def __init__(self, directory=DEBUG_DIR, queue_size=QUEUE_SIZE, max_files=MAX_FILES, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.written = 0
+        self.dropped = 0
+        self.deleted = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._files = None  # [(mtime, path, size)] oldest first, loaded lazily by the worker
+        self._worker = threading.Thread(target=self._run, name="debug-artifacts", daemon=True)
+        self._worker.start()
+
+    def submit(self, filename, image, scale=None):
+        """
+        Queue `image` to be written as `filename`. Never blocks; returns False if the write was dropped.
+        `image` must not be modified afterwards. With `scale`, it is multiplied and cast to uint8 off-thread.
+        """
+        try:
+            self._queue.put_nowait((filename, image, scale))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            filename, image, scale = self._queue.get()
+            try:
+                self._write(filename, image, scale)
+            except Exception as e:
+                logger.warning(f"Failed to write debug artifact {filename}: {str(e)}")
+
+    def _scan_existing(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.startswith(FILE_PREFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+        files.sort()
+        return files
+
+    def _write(self, filename, image, scale):
+        if self._files is None:
+            self._files = self._scan_existing()
+
+        if scale is not None:
+            image = (image * scale).astype(np.uint8)
+
+        path = os.path.join(self.directory, FILE_PREFIX + filename)
+        if not cv2.imwrite(path, image):
+            raise IOError(f"cv2.imwrite failed for {path}")
+        self.written += 1
+
+        # Overwriting a name (e.g. debug_annotated.png) replaces its old entry
+        self._files = [entry for entry in self._files if entry[1] != path]
+        self._files.append((time.time(), path, os.path.getsize(path)))
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        total_bytes = sum(entry[2] for entry in self._files)
+        while self._files and (len(self._files) > self.max_files or total_bytes > self.max_bytes):
+            _, path, size = self._files.pop(0)
+            total_bytes -= size
+            try:
+                os.remove(path)
+                self.deleted += 1
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "mode": DEBUG_MODE,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "deleted": self.deleted,
+        }
+
+class DebugCapture:
+    """
+    Debug artifacts for one request. The sampling decision is made once, so a request is
+    captured completely or not at all.
+    """
+
+    def __init__(self, writer, enabled, tag=None):
+        self._writer = writer
+        self.enabled = enabled
+        self.tag = tag
+
+    def __bool__(self):
+        return self.enabled
+
+    def save(self, name, image, scale=None):
+        """Queue `image` as debug_<name>[_<tag>].png if this request is being captured"""
+        if not self.enabled:
+            return
+        filename = f"{name}_{self.tag}.png" if self.tag else f"{name}.png"
+        self._writer.submit(filename, image, scale)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = DebugArtifactWriter()
+        return _writer
+
+def start_capture(tag=None):
+    """
+    Decide whether the current request is captured, according to DEBUG_MODE, and return its DebugCapture.
+    """
+    if DEBUG_MODE == "always":
+        enabled = True
+    elif DEBUG_MODE == "sample":
+        enabled = random.random() * 100 < DEBUG_SAMPLE_PERCENT
+    else:
+        enabled = False
+
+    if not enabled:
+        return DebugCapture(None, False, tag)
+    return DebugCapture(get_writer(), True, tag)
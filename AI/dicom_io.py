@@ -0,0 +1,256 @@
+# dicom_io.py
+# DICOM ingestion: frames are read lazily (memory-mapped when the pixel data is uncompressed, one frame
+# decoded at a time otherwise) and the pixel spacing comes from the header instead of the 0.3 mm default.
+# pydicom is optional; it is only imported when a DICOM file is actually opened.
+
+import io
+import math
+import cv2
+import numpy as np
+from image_io import decode_image_bytes, decode_upload, load_image
+
+DICOM_EXTENSIONS = (".dcm", ".dicom")
+
+# mm per 128x128 mask pixel used when the header has no spacing (and for PNG/JPEG input)
+DEFAULT_PIXEL_SPACING = 0.3
+
+# Uncompressed little-endian transfer syntaxes, whose frames can be mapped straight from the file
+_NATIVE_SYNTAXES = ("1.2.840.10008.1.2", "1.2.840.10008.1.2.1")
+_PIXEL_DATA = 0x7FE00010
+# Ultrasound region units code for centimetres (PS3.3 C.8.5.5.1.15)
+_UNITS_CM = 3
+
+class FrameOutOfRange(ValueError):
+    """The requested frame is not in the upload (a single image has only frame 0)"""
+
+def parse_frame(value):
+    """Frame index from a request field (None or empty = 0); ValueError unless a non-negative integer"""
+    if value is None or value == "":
+        return 0
+    try:
+        frame = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("frame must be a non-negative integer")
+    if frame < 0:
+        raise ValueError("frame must be a non-negative integer")
+    return frame
+
+def _pydicom():
+    try:
+        import pydicom
+    except ImportError:
+        raise RuntimeError("DICOM input needs pydicom (pip install pydicom)")
+    return pydicom
+
+def is_dicom(source):
+    """True for DICOM Part 10 data (the "DICM" marker after the 128-byte preamble): path, bytes or file object"""
+    if isinstance(source, str):
+        if source.lower().endswith(DICOM_EXTENSIONS):
+            return True
+        try:
+            with open(source, "rb") as f:
+                header = f.read(132)
+        except OSError:
+            return False
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        header = bytes(source[:132])
+    else:
+        position = source.tell()
+        header = source.read(132)
+        source.seek(position)
+    return len(header) == 132 and header[128:132] == b"DICM"
+
+def header_pixel_spacing(dataset):
+    """
+    (x, y) spacing in mm per pixel (column, row) from PixelSpacing, ImagerPixelSpacing or the first
+    calibrated ultrasound region (PhysicalDeltaX/Y in cm), or None when the header has none
+    """
+    for keyword in ("PixelSpacing", "ImagerPixelSpacing"):
+        spacing = dataset.get(keyword)
+        if spacing:
+            # Stored as (row spacing, column spacing)
+            return float(spacing[1]), float(spacing[0])
+    for region in dataset.get("SequenceOfUltrasoundRegions", []):
+        if region.get("PhysicalUnitsXDirection") == _UNITS_CM and region.get("PhysicalDeltaX"):
+            spacing_x = float(region.PhysicalDeltaX) * 10.0
+            # Square pixels unless the region is calibrated in y too
+            if region.get("PhysicalUnitsYDirection") == _UNITS_CM and region.get("PhysicalDeltaY"):
+                return spacing_x, float(region.PhysicalDeltaY) * 10.0
+            return spacing_x, spacing_x
+    return None
+
+def pipeline_spacings(pixel_spacing, frame_shape):
+    """
+    (mask spacing, source spacing) for a frame of `frame_shape`, each an (x, y) pair in mm per pixel
+    of the 128x128 mask and of the frame. The frame is resized to 128x128 without keeping its aspect
+    ratio, so a mask pixel covers width / 128 source pixels across and height / 128 down. With a
+    header, `pixel_spacing` is the (x, y) source spacing and the mask spacing is derived from it;
+    without one (PNG/JPEG), the 0.3 mm default is the mask spacing on both axes (as it always has
+    been) and the source spacing is derived from that.
+    """
+    height, width = frame_shape[:2]
+    scale_x, scale_y = width / 128.0, height / 128.0
+    if pixel_spacing is None:
+        return ((DEFAULT_PIXEL_SPACING, DEFAULT_PIXEL_SPACING),
+                (DEFAULT_PIXEL_SPACING / scale_x, DEFAULT_PIXEL_SPACING / scale_y))
+    spacing_x, spacing_y = pixel_spacing
+    return (spacing_x * scale_x, spacing_y * scale_y), (spacing_x, spacing_y)
+
+def measurement_spacing(spacing, structure):
+    """
+    The mm per pixel a structure's fit converts with, from an (x, y) spacing: the x spacing for the
+    widths measured across the image (TCD, LVW); for the skull ellipse, whose axes can lie at any
+    angle, the geometric mean of the two (exact when the pixels are square)
+    """
+    spacing_x, spacing_y = spacing
+    if structure == "brain":
+        return math.sqrt(spacing_x * spacing_y)
+    return spacing_x
+
+def to_gray8(frame, photometric="MONOCHROME2"):
+    """A decoded DICOM frame as the 8-bit grayscale image the pipelines expect"""
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(np.ascontiguousarray(frame), cv2.COLOR_RGB2GRAY)
+    if frame.dtype != np.uint8:
+        frame = cv2.normalize(frame.astype(np.float32), None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    if photometric == "MONOCHROME1":
+        frame = 255 - frame
+    return frame
+
+class DicomFile:
+    """
+    A DICOM file opened without reading its pixel data. `source` is a path, bytes or a binary
+    file object (kept open by the caller). frame(i) maps or decodes only frame i.
+    """
+
+    def __init__(self, source):
+        pydicom = _pydicom()
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        self.source = source
+        # Elements over 1 KB (the pixel data) stay on disk until accessed
+        self.dataset = pydicom.dcmread(source, defer_size="1 KB")
+        ds = self.dataset
+        if _PIXEL_DATA not in ds:
+            raise ValueError("DICOM file has no pixel data")
+
+        self.rows, self.columns = int(ds.Rows), int(ds.Columns)
+        self.frame_count = int(ds.get("NumberOfFrames", 1) or 1)
+        self.samples = int(ds.get("SamplesPerPixel", 1))
+        self.photometric = str(ds.get("PhotometricInterpretation", "MONOCHROME2"))
+        self.pixel_spacing = header_pixel_spacing(ds)
+        self._layout = self._native_layout()
+        self._frames = None
+        if self._layout is not None and isinstance(source, str):
+            offset, dtype, shape = self._layout
+            self._frames = np.memmap(source, dtype=dtype, mode="r", offset=offset,
+                                     shape=(self.frame_count,) + shape)
+
+    def _native_layout(self):
+        """(file offset, dtype, frame shape) of uncompressed pixel data, or None when it must be decoded"""
+        ds = self.dataset
+        syntax = str(ds.file_meta.get("TransferSyntaxUID", ""))
+        planar = int(ds.get("PlanarConfiguration", 0) or 0)
+        bits = int(ds.BitsAllocated)
+        if syntax not in _NATIVE_SYNTAXES or bits not in (8, 16) or planar != 0:
+            return None
+        if self.photometric not in ("MONOCHROME1", "MONOCHROME2", "RGB"):
+            return None
+
+        element = ds.get_item(_PIXEL_DATA)
+        offset = getattr(element, "value_tell", None)
+        if offset is None:
+            return None
+        dtype = np.dtype("<u1" if bits == 8 else ("<i2" if int(ds.get("PixelRepresentation", 0)) else "<u2"))
+        shape = (self.rows, self.columns) + ((self.samples,) if self.samples > 1 else ())
+        return offset, dtype, shape
+
+    def _read_native(self, index):
+        """One uncompressed frame: from the memory map for a path, by seek + read for a file object"""
+        if self._frames is not None:
+            return np.asarray(self._frames[index])
+        offset, dtype, shape = self._layout
+        frame_bytes = int(np.prod(shape)) * dtype.itemsize
+        self.source.seek(offset + index * frame_bytes)
+        return np.frombuffer(self.source.read(frame_bytes), dtype=dtype).reshape(shape)
+
+    def frame(self, index=0):
+        """Frame `index` as an 8-bit grayscale image"""
+        if not 0 <= index < self.frame_count:
+            raise FrameOutOfRange(f"Frame {index} out of range (the file has {self.frame_count})")
+        if self._layout is not None:
+            return to_gray8(self._read_native(index), self.photometric)
+
+        try:
+            from pydicom.pixels import pixel_array
+        except ImportError:
+            pixel_array = None
+        if pixel_array is not None:
+            # pydicom 3 decodes a single frame straight from the source
+            if not isinstance(self.source, str):
+                self.source.seek(0)
+            frame = pixel_array(self.source, index=index)
+        else:
+            # Older pydicom decodes every frame at once (cached on the dataset)
+            from pydicom.pixel_data_handlers.util import convert_color_space
+            frames = self.dataset.pixel_array
+            frame = frames[index] if self.frame_count > 1 else frames
+            if self.photometric.startswith("YBR"):
+                frame = convert_color_space(frame, self.photometric, "RGB")
+        return to_gray8(frame, self.photometric)
+
+    @property
+    def fps(self):
+        """Cine frame rate from the header (CineRate, else FrameTime in ms), or None"""
+        if self.dataset.get("CineRate"):
+            return float(self.dataset.CineRate)
+        if self.dataset.get("FrameTime"):
+            return 1000.0 / float(self.dataset.FrameTime)
+        return None
+
+    def iter_frames(self, max_frames=None):
+        """Yield (index, grayscale frame), decoding one frame at a time"""
+        count = self.frame_count if max_frames is None else min(self.frame_count, max_frames)
+        for index in range(count):
+            yield index, self.frame(index)
+
+def read_dicom_frame(source, index=0):
+    """(grayscale frame, (x, y) pixel spacing in mm or None) from a DICOM path, bytes or file object"""
+    dicom = DicomFile(source)
+    return dicom.frame(index), dicom.pixel_spacing
+
+def load_scan(source):
+    """(grayscale image or None, header (x, y) pixel spacing in mm or None) from a DICOM or image path/bytes"""
+    if is_dicom(source):
+        return read_dicom_frame(source)
+    return load_image(source), None
+
+def decode_scan_bytes(data):
+    """(grayscale image or None, header (x, y) pixel spacing or None) from DICOM or encoded image bytes"""
+    if not is_dicom(data):
+        return decode_image_bytes(data), None
+    try:
+        return read_dicom_frame(data)
+    except RuntimeError:
+        raise
+    except Exception:
+        return None, None
+
+def decode_scan_upload(file_storage, frame=0):
+    """
+    Decode an upload that is either DICOM (frame `frame`) or an encoded image (PNG/JPEG/...).
+    Returns (grayscale image or None if unreadable, header (x, y) pixel spacing in mm or None).
+    FrameOutOfRange if the upload has no frame `frame`.
+    """
+    stream = file_storage.stream
+    stream.seek(0)
+    if not is_dicom(stream) and not (file_storage.filename or "").lower().endswith(DICOM_EXTENSIONS):
+        if frame:
+            raise FrameOutOfRange(f"Frame {frame} out of range (an image has a single frame)")
+        return decode_upload(file_storage), None
+    try:
+        return read_dicom_frame(stream, frame)
+    except (RuntimeError, FrameOutOfRange):
+        raise
+    except Exception:
+        return None, None
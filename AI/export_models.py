@@ -0,0 +1,65 @@
+# export_models.py
+# Export the trained U-Nets to TFLite for CPU inference, optionally with post-training quantization.
+#
+# Usage:
+#   python export_models.py                                  # all models, float32
+#   python export_models.py --quantization int8 float16      # quantized variants
+#   python export_models.py --models brain --quantization int8 --calibration-samples 200
+
+import argparse
+import numpy as np
+import tensorflow as tf
+from dataset_cache import DatasetCache
+from fetal_brain_diagnosis import build_unet
+from inference_backends import QUANTIZATIONS, tflite_path
+from model_registry import DATASET_DIRS, MODEL_PATHS, MULTITASK_HEADS, MULTITASK_MODEL_PATH, MULTITASK_NAME
+
+def representative_dataset(image_folder, mask_folder, samples):
+    """Calibration inputs for INT8 quantization: preprocessed images from the training set (dataset cache)"""
+    def generator():
+        images, _, _ = DatasetCache().load(image_folder, mask_folder)
+        for img in images[:samples]:
+            yield [np.asarray(img, dtype=np.float32).reshape(1, 128, 128, 1)]
+    return generator
+
+def export_model(name, quantization="float32", calibration_samples=100):
+    """Convert the .h5 weights of model `name` to TFLite and return the output path"""
+    if name == MULTITASK_NAME:
+        from unet import build_multitask_unet, stack_heads
+        weights_path = MULTITASK_MODEL_PATH
+        model = build_multitask_unet(MULTITASK_HEADS, compile=False)
+        model.load_weights(weights_path)
+        model = stack_heads(model)
+    else:
+        weights_path = MODEL_PATHS[name]
+        model = build_unet()
+        model.load_weights(weights_path)
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        # Weights and activations in INT8, calibrated on real images; inputs/outputs stay float32
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(*DATASET_DIRS.get(name, DATASET_DIRS["brain"]), calibration_samples)
+
+    output_path = tflite_path(weights_path, quantization)
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+
+    print(f"Exported {name} ({quantization}) to {output_path}")
+    return output_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export U-Net weights to TFLite")
+    parser.add_argument("--models", nargs="+", choices=sorted(MODEL_PATHS) + [MULTITASK_NAME],
+                        default=sorted(MODEL_PATHS))
+    parser.add_argument("--quantization", nargs="+", choices=QUANTIZATIONS, default=["float32"])
+    parser.add_argument("--calibration-samples", type=int, default=100,
+                        help="images from AI/dataset used to calibrate INT8 quantization")
+    args = parser.parse_args()
+
+    for name in args.models:
+        for quantization in args.quantization:
+            export_model(name, quantization, args.calibration_samples)
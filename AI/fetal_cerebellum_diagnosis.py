@@ -3,9 +3,9 @@
 
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from tensorflow.keras.models import load_model
-from train_cerebellum_model import build_unet, preprocess_image
+from dicom_io import load_scan, measurement_spacing, pipeline_spacings
+from fetal_brain_diagnosis import build_unet, preprocess_image
+from metrics import record_threshold_level
 import math
 
 # ---------------- Reference Range ----------------
@@ -13,45 +13,59 @@ def tcd_reference_range(ga_weeks):
     return ga_weeks  # Approx: TCD(mm) ~= Gestational Age (weeks)
 
 # ---------------- TCD Measurement ----------------
-def calculate_tcd_from_mask(mask, original_img, pixel_spacing=0.3, gest_age_weeks=24):
+def fit_tcd(mask, pixel_spacing=0.3):
+    """Ellipse fitted to the largest contour of the 0.5-thresholded mask: (tcd_mm, ellipse) or (None, None)"""
+    record_threshold_level("cerebellum", 0)
     mask = (mask > 0.5).astype(np.uint8)
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
     if not contours or len(contours) < 1:
-        return None, original_img, "No cerebellum detected"
+        return None, None
 
     largest = max(contours, key=cv2.contourArea)
     ellipse = cv2.fitEllipse(largest)
     (x, y), (major, minor), angle = ellipse
 
     tcd_mm = major * pixel_spacing  # Assuming major axis across cerebellar lobes
-    expected = tcd_reference_range(gest_age_weeks)
-
-    status = "Normal" if abs(tcd_mm - expected) <= 3 else "Abnormal"
+    return tcd_mm, ellipse
 
+def annotate_tcd(original_img, ellipse, tcd_mm, status):
     annotated = cv2.cvtColor(original_img, cv2.COLOR_GRAY2BGR)
     cv2.ellipse(annotated, ellipse, (0, 255, 0), 2)
     cv2.putText(annotated, f"TCD: {tcd_mm:.1f}mm ({status})", (10, 25),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
+    return annotated
+
+def calculate_tcd_from_mask(mask, original_img, pixel_spacing=0.3, gest_age_weeks=24):
+    tcd_mm, ellipse = fit_tcd(mask, pixel_spacing)
+    if tcd_mm is None:
+        return None, original_img, "No cerebellum detected"
+
+    expected = tcd_reference_range(gest_age_weeks)
+    status = "Normal" if abs(tcd_mm - expected) <= 3 else "Abnormal"
 
-    return tcd_mm, annotated, status
+    return tcd_mm, annotate_tcd(original_img, ellipse, tcd_mm, status), status
 
 # ---------------- Run Inference ----------------
-def run_tcd_analysis(image_path, model_path, gest_age_weeks):
+def run_tcd_analysis(image, model_path, gest_age_weeks):
+    """`image` is a file path or the encoded image bytes (PNG/JPEG or DICOM, whose header spacing is used)"""
     model = build_unet()
     model.load_weights(model_path)
 
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    img, spacing = load_scan(image)
     if img is None:
         return None, None, "Image not found"
 
     input_img = preprocess_image(img).reshape(1, 128, 128, 1)
     predicted_mask = model.predict(input_img)[0].reshape(128, 128)
 
+    mask_spacing = measurement_spacing(pipeline_spacings(spacing, img.shape)[0], "cerebellum")
     tcd_mm, annotated_img, status = calculate_tcd_from_mask(
-        predicted_mask, img, pixel_spacing=0.3, gest_age_weeks=gest_age_weeks
+        predicted_mask, img, pixel_spacing=mask_spacing, gest_age_weeks=gest_age_weeks
     )
 
+    import matplotlib.pyplot as plt
+
     # Display annotated image
     plt.imshow(cv2.cvtColor(annotated_img, cv2.COLOR_BGR2RGB))
     plt.title(f"TCD: {tcd_mm:.1f}mm ({status})")
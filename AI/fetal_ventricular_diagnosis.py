@@ -3,8 +3,9 @@
 
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from train_ventricular_model import build_unet, preprocess_image
+from dicom_io import load_scan, measurement_spacing, pipeline_spacings
+from fetal_brain_diagnosis import build_unet, preprocess_image
+from metrics import record_threshold_level
 
 # Reference Range
 def lvw_reference_range(ga_weeks):
@@ -12,43 +13,59 @@ def lvw_reference_range(ga_weeks):
     return 10.0
 
 # Measurement
-def calculate_lvw_from_mask(mask, original_img, pixel_spacing=0.3, gest_age_weeks=24):
+def fit_lvw(mask, pixel_spacing=0.3):
+    """Bounding box of the largest contour of the 0.5-thresholded mask: (lvw_mm, (x, y, w, h)) or (None, None)"""
+    record_threshold_level("ventricular", 0)
     mask = (mask > 0.5).astype(np.uint8)
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
     if not contours:
-        return None, original_img, "No ventricles detected"
+        return None, None
 
     largest = max(contours, key=cv2.contourArea)
     x, y, w, h = cv2.boundingRect(largest)
 
     lvw_mm = w * pixel_spacing
-    expected = lvw_reference_range(gest_age_weeks)
-    status = "Normal" if lvw_mm <= expected else "Abnormal"
+    return lvw_mm, (x, y, w, h)
 
+def annotate_lvw(original_img, box, lvw_mm, status):
+    x, y, w, h = box
     annotated = cv2.cvtColor(original_img, cv2.COLOR_GRAY2BGR)
     cv2.rectangle(annotated, (x, y), (x + w, y + h), (0, 255, 0), 2)
     cv2.putText(annotated, f"LVW: {lvw_mm:.1f}mm ({status})", (10, 25),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
+    return annotated
 
-    return lvw_mm, annotated, status
+def calculate_lvw_from_mask(mask, original_img, pixel_spacing=0.3, gest_age_weeks=24):
+    lvw_mm, box = fit_lvw(mask, pixel_spacing)
+    if lvw_mm is None:
+        return None, original_img, "No ventricles detected"
+
+    expected = lvw_reference_range(gest_age_weeks)
+    status = "Normal" if lvw_mm <= expected else "Abnormal"
+
+    return lvw_mm, annotate_lvw(original_img, box, lvw_mm, status), status
 
 # ---------------- Inference ----------------
-def run_lvw_analysis(image_path, model_path, gest_age_weeks):
+def run_lvw_analysis(image, model_path, gest_age_weeks):
+    """`image` is a file path or the encoded image bytes (PNG/JPEG or DICOM, whose header spacing is used)"""
     model = build_unet()
     model.load_weights(model_path)
 
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    img, spacing = load_scan(image)
     if img is None:
         return None, None, "Image not found"
 
     input_img = preprocess_image(img).reshape(1, 128, 128, 1)
     predicted_mask = model.predict(input_img)[0].reshape(128, 128)
 
+    mask_spacing = measurement_spacing(pipeline_spacings(spacing, img.shape)[0], "ventricular")
     lvw_mm, annotated_img, status = calculate_lvw_from_mask(
-        predicted_mask, img, pixel_spacing=0.3, gest_age_weeks=gest_age_weeks
+        predicted_mask, img, pixel_spacing=mask_spacing, gest_age_weeks=gest_age_weeks
     )
 
+    import matplotlib.pyplot as plt
+
     plt.imshow(cv2.cvtColor(annotated_img, cv2.COLOR_BGR2RGB))
     plt.title(f"LV Width: {lvw_mm:.1f}mm ({status})")
     plt.axis('off')
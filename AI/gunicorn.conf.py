@@ -0,0 +1,68 @@
+# gunicorn.conf.py
+# Production serving for server.py: one master that imports the app and reads the model weights once,
+# then forks N workers that share those pages copy-on-write. TensorFlow is only initialised in the
+# workers (its thread pools do not survive fork), each with its share of the CPU cores.
+#
+# Usage (from AI/):
+#   gunicorn -c gunicorn.conf.py server:app
+#   DRUEL_SERVING_PROFILE=latency gunicorn -c gunicorn.conf.py server:app
+#   kill -HUP <master pid>    # graceful restart: new workers warm up, old ones finish in-flight requests
+
+import os
+import multiprocessing
+
+# "throughput": few workers with many threads each, so the micro-batcher fills larger batches.
+# "latency": more single-threaded workers and no batching wait, so a request never queues behind others.
+PROFILES = {
+    "throughput": {"workers": 2, "threads": 8, "max_batch_size": 16, "max_batch_wait_ms": 10},
+    "latency": {"workers": max(1, multiprocessing.cpu_count() // 2), "threads": 2,
+                "max_batch_size": 1, "max_batch_wait_ms": 0},
+}
+SERVING_PROFILE = os.environ.get("DRUEL_SERVING_PROFILE", "throughput").lower()
+if SERVING_PROFILE not in PROFILES:
+    raise ValueError(f"DRUEL_SERVING_PROFILE must be one of {sorted(PROFILES)}, got '{SERVING_PROFILE}'")
+_profile = PROFILES[SERVING_PROFILE]
+
+bind = f"0.0.0.0:{os.environ.get('DRUEL_AI_PORT', '4000')}"
+workers = int(os.environ.get("DRUEL_WORKERS", _profile["workers"]))
+threads = int(os.environ.get("DRUEL_WORKER_THREADS", _profile["threads"]))
+worker_class = "gthread"
+
+# Import the app (and the weights, see when_ready) in the master before forking
+preload_app = True
+
+# Warm-up runs before a worker starts accepting requests, so allow for it in the heartbeat timeout
+timeout = int(os.environ.get("DRUEL_WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.environ.get("DRUEL_GRACEFUL_TIMEOUT", "60"))
+keepalive = 5
+# Recycle workers now and then (staggered by the jitter) to bound slow memory growth
+max_requests = int(os.environ.get("DRUEL_MAX_REQUESTS", "5000"))
+max_requests_jitter = max_requests // 10
+
+# Split the cores between workers instead of every worker sizing its pools to the whole machine.
+# These are read when the app modules are imported, which happens after this file is loaded.
+_worker_threads = max(1, multiprocessing.cpu_count() // workers)
+os.environ.setdefault("DRUEL_TF_INTRA_OP_THREADS", str(_worker_threads))
+os.environ.setdefault("DRUEL_TF_INTER_OP_THREADS", "1")
+os.environ.setdefault("DRUEL_MAX_BATCH_SIZE", str(_profile["max_batch_size"]))
+os.environ.setdefault("DRUEL_MAX_BATCH_WAIT_MS", str(_profile["max_batch_wait_ms"]))
+os.environ["DRUEL_DEFER_WARMUP"] = "1"
+
+# "sync": a worker loads its models before accepting requests (no 503s during restarts);
+# "background": it accepts at once and answers "warming" until ready, like the dev server
+WORKER_WARMUP = os.environ.get("DRUEL_WORKER_WARMUP", "sync").lower()
+
+def when_ready(server):
+    """Master, after the app is imported and before the first fork: read the weights once"""
+    import model_registry
+    model_registry.preload_weights(list(model_registry.MODEL_PATHS))
+    server.log.info(f"Serving profile '{SERVING_PROFILE}': {workers} workers x {threads} threads, "
+                    f"{_worker_threads} intra-op threads per worker")
+
+def post_worker_init(worker):
+    """Worker, after fork: size the OpenCV pool, then load and warm the models"""
+    import cv2
+    import model_registry
+    cv2.setNumThreads(_worker_threads)
+    model_registry.release_warmup(wait=WORKER_WARMUP == "sync", timeout=timeout * 0.8)
+    worker.log.info(f"Worker {worker.pid} models: {model_registry.startup_report()['status']}")
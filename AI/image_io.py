@@ -0,0 +1,126 @@
+# image_io.py
+# In-memory image decoding for uploads: no temp files on the request path
+
+import io
+import os
+import hashlib
+import tempfile
+import threading
+import cv2
+import numpy as np
+from flask import Request
+
+# Request bodies up to this size are kept in memory
+MAX_UPLOAD_BYTES = 32 * 1024 * 1024
+
+# Hard cap on a request body; only batch archives should come near it
+MAX_BATCH_UPLOAD_BYTES = int(os.environ.get("DRUEL_MAX_BATCH_UPLOAD_MB", "1024")) * 1024 * 1024
+
+# Initial size of the per-thread read buffer; grows to the largest upload seen
+READ_CHUNK = 1024 * 1024
+
+_local = threading.local()
+
+class InMemoryRequest(Request):
+    """
+    Keeps uploaded files in a BytesIO instead of werkzeug's spooled temp file,
+    which spills anything over 500KB to disk. Bodies over MAX_UPLOAD_BYTES (batch
+    archives) still spool to disk so they cannot exhaust RAM.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length > MAX_UPLOAD_BYTES:
+            return tempfile.SpooledTemporaryFile(max_size=MAX_UPLOAD_BYTES)
+        return io.BytesIO()
+
+def configure_app(app):
+    """Make `app` parse uploads in memory"""
+    app.request_class = InMemoryRequest
+    app.config.setdefault("MAX_CONTENT_LENGTH", MAX_BATCH_UPLOAD_BYTES)
+
+def _read_into_buffer(stream):
+    """Read `stream` into this thread's reusable buffer and return a view of the bytes read"""
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None:
+        buffer = _local.buffer = bytearray(READ_CHUNK)
+
+    size = 0
+    while True:
+        if size == len(buffer):
+            buffer.extend(bytes(len(buffer)))
+        read = stream.readinto(memoryview(buffer)[size:])
+        if not read:
+            break
+        size += read
+
+    return np.frombuffer(buffer, dtype=np.uint8, count=size)
+
+def decode_image_bytes(data, flags=cv2.IMREAD_GRAYSCALE):
+    """
+    Decode encoded image bytes (PNG/JPEG/...) with cv2.imdecode. Returns None if they are not an image.
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    if data.size == 0:
+        return None
+    return cv2.imdecode(data, flags)
+
+def decode_upload(file_storage, flags=cv2.IMREAD_GRAYSCALE):
+    """
+    Decode an uploaded werkzeug FileStorage straight from its stream.
+    Returns None if the upload is empty or not a valid image.
+    """
+    stream = file_storage.stream
+    stream.seek(0)
+
+    if isinstance(stream, io.BytesIO):
+        # Decode from the BytesIO's own memory without copying it
+        with stream.getbuffer() as view:
+            data = np.frombuffer(view, dtype=np.uint8)
+            img = cv2.imdecode(data, flags) if data.size else None
+            del data
+        return img
+
+    return decode_image_bytes(_read_into_buffer(stream), flags)
+
+def upload_digest(file_storage):
+    """SHA-256 hex digest of an upload's bytes; the stream is left at the start for decoding"""
+    stream = file_storage.stream
+    stream.seek(0)
+    digest = hashlib.sha256()
+    if isinstance(stream, io.BytesIO):
+        with stream.getbuffer() as view:
+            digest.update(view)
+    else:
+        for chunk in iter(lambda: stream.read(READ_CHUNK), b""):
+            digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def load_image(source, flags=cv2.IMREAD_GRAYSCALE):
+    """
+    Load an image from a file path or from encoded bytes. Returns None if it cannot be read.
+    DICOM input gives its first frame (use dicom_io directly for other frames and the pixel spacing).
+    """
+    from dicom_io import is_dicom, read_dicom_frame
+    if is_dicom(source):
+        return read_dicom_frame(source)[0]
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_image_bytes(source, flags)
+    return cv2.imread(source, flags)
+
+def iter_image_folder(folder, limit=None):
+    """
+    Yield (filename, grayscale image) for the PNG files in `folder`, in sorted order.
+    Unreadable files are skipped.
+    """
+    count = 0
+    for fname in sorted(os.listdir(folder)):
+        if limit is not None and count >= limit:
+            break
+        if not fname.endswith(".png"):
+            continue
+        img = cv2.imread(os.path.join(folder, fname), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            continue
+        count += 1
+        yield fname, img
@@ -0,0 +1,186 @@
+# inference_backends.py
+# CPU inference backends for the U-Nets: full-precision Keras or an exported TFLite model
+
+import os
+import threading
+import numpy as np
+
+# "keras" (the .h5 weights) or "tflite" (exported by export_models.py)
+INFERENCE_BACKEND = os.environ.get("DRUEL_INFERENCE_BACKEND", "keras").lower()
+
+# Which exported TFLite file to use: "float32", "float16" or "int8"
+TFLITE_QUANTIZATION = os.environ.get("DRUEL_TFLITE_QUANTIZATION", "float32").lower()
+
+QUANTIZATIONS = ("float32", "float16", "int8")
+
+# Model files read into memory before the serving workers fork (see gunicorn.conf.py)
+_preloaded = {}
+
+def tflite_path(weights_path, quantization="float32"):
+    """Path of the exported TFLite model next to its .h5 weights, e.g. unet_brain_seg_int8.tflite"""
+    base = os.path.splitext(weights_path)[0]
+    suffix = "" if quantization == "float32" else f"_{quantization}"
+    return f"{base}{suffix}.tflite"
+
+def weights_cache_path(weights_path):
+    """Plain-array copy of the .h5 weights, e.g. unet_brain_seg.weights.npz"""
+    return os.path.splitext(weights_path)[0] + ".weights.npz"
+
+def _npz_is_fresh(weights_path):
+    cache_path = weights_cache_path(weights_path)
+    return os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(weights_path)
+
+def preload(path):
+    """
+    Read a model into memory in the parent process so forked workers share its pages copy-on-write:
+    the flatbuffer bytes for a .tflite file, the .npz weight arrays for .h5 weights.
+    Returns False when there is nothing TensorFlow-free to preload (.h5 without a fresh .npz).
+    """
+    if path.endswith(".tflite"):
+        with open(path, "rb") as f:
+            _preloaded[path] = f.read()
+        return True
+    if not _npz_is_fresh(path):
+        return False
+    with np.load(weights_cache_path(path)) as data:
+        _preloaded[path] = [data[f"arr_{i}"] for i in range(len(data.files))]
+    return True
+
+def _load_cached_weights(model, weights_path):
+    """
+    Load weights from the .npz cache when it is newer than the .h5, otherwise from the .h5
+    (and refresh the cache). The .npz is a flat list of arrays, much cheaper to read than HDF5.
+    Arrays preloaded before fork are used as they are.
+    """
+    if weights_path in _preloaded:
+        model.set_weights(_preloaded[weights_path])
+        return
+
+    cache_path = weights_cache_path(weights_path)
+    if _npz_is_fresh(weights_path):
+        with np.load(cache_path) as data:
+            model.set_weights([data[f"arr_{i}"] for i in range(len(data.files))])
+        return
+
+    model.load_weights(weights_path)
+    try:
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, *model.get_weights())
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # read-only model directory: keep loading from .h5
+
+class KerasBackend:
+    """
+    The build_unet() model with its .h5 weights, run through a compiled InferenceRunner.
+    Without `weights_path` the weights stay randomly initialised (latency benchmarks only).
+    """
+
+    name = "keras"
+
+    def __init__(self, weights_path, jit_compile=None):
+        from unet import build_unet
+        from inference_runner import InferenceRunner
+
+        self.model = build_unet(compile=False)
+        if weights_path:
+            _load_cached_weights(self.model, weights_path)
+        self.runner = InferenceRunner(self.model, jit_compile=jit_compile)
+
+    def predict(self, inputs):
+        """(N, 128, 128, 1) float32 -> (N, 128, 128, 1) probabilities"""
+        return self.runner.run(inputs)
+
+    def warm_up(self, batch_sizes):
+        """Trace (and XLA-compile) the runner for every batch bucket before real traffic arrives"""
+        self.runner.warm_up(max(batch_sizes))
+
+class MultiTaskKerasBackend(KerasBackend):
+    """
+    The multi-task U-Net (shared encoder, one decoder per head) with its .h5 weights.
+    predict returns (N, 128, 128, len(heads)) probabilities, one channel per head.
+    """
+
+    def __init__(self, weights_path, heads, jit_compile=None):
+        from unet import build_multitask_unet, stack_heads
+        from inference_runner import InferenceRunner
+
+        self.heads = list(heads)
+        model = build_multitask_unet(self.heads, compile=False)
+        _load_cached_weights(model, weights_path)
+        self.model = stack_heads(model)
+        self.runner = InferenceRunner(self.model, jit_compile=jit_compile)
+
+class TFLiteBackend:
+    """
+    A TFLite flatbuffer run by the TFLite interpreter. Uses tflite_runtime when installed,
+    otherwise the interpreter bundled with TensorFlow. Inputs and outputs stay float32
+    even for quantized models.
+    """
+
+    name = "tflite"
+
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        if model_path not in _preloaded and not os.path.exists(model_path):
+            raise FileNotFoundError(f"{model_path} not found; run export_models.py first")
+
+        self._interpreter_class = Interpreter
+        self.model_path = model_path
+        self.num_threads = num_threads or None
+        # One interpreter per batch size so changing batch sizes does not reallocate tensors
+        self._interpreters = {}
+        self._lock = threading.Lock()
+        self._get_interpreter(1)
+
+    def _get_interpreter(self, batch_size):
+        interpreter = self._interpreters.get(batch_size)
+        if interpreter is None:
+            content = _preloaded.get(self.model_path)
+            if content is not None:
+                interpreter = self._interpreter_class(model_content=content, num_threads=self.num_threads)
+            else:
+                interpreter = self._interpreter_class(model_path=self.model_path, num_threads=self.num_threads)
+            input_index = interpreter.get_input_details()[0]["index"]
+            interpreter.resize_tensor_input(input_index, [batch_size, 128, 128, 1])
+            interpreter.allocate_tensors()
+            self._interpreters[batch_size] = interpreter
+        return interpreter
+
+    def predict(self, inputs):
+        """(N, 128, 128, 1) float32 -> (N, 128, 128, 1) probabilities"""
+        inputs = np.ascontiguousarray(inputs, dtype=np.float32)
+        with self._lock:
+            interpreter = self._get_interpreter(len(inputs))
+            interpreter.set_tensor(interpreter.get_input_details()[0]["index"], inputs)
+            interpreter.invoke()
+            return interpreter.get_tensor(interpreter.get_output_details()[0]["index"]).copy()
+
+    def warm_up(self, batch_sizes):
+        """Allocate an interpreter for each batch size and run it once"""
+        for batch_size in batch_sizes:
+            self.predict(np.zeros((batch_size, 128, 128, 1), dtype=np.float32))
+
+def load_backend(weights_path, backend=None, quantization=None, num_threads=None, heads=None):
+    """
+    Build the configured backend for the model whose .h5 weights are at `weights_path`.
+    `heads` selects the multi-task U-Net with those heads.
+    """
+    backend = backend or INFERENCE_BACKEND
+    quantization = quantization or TFLITE_QUANTIZATION
+
+    if backend == "keras":
+        if heads:
+            return MultiTaskKerasBackend(weights_path, heads)
+        return KerasBackend(weights_path)
+    if backend == "tflite":
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown TFLite quantization: {quantization}")
+        return TFLiteBackend(tflite_path(weights_path, quantization), num_threads=num_threads)
+    raise ValueError(f"Unknown inference backend: {backend}")
@@ -0,0 +1,306 @@
+# inference_scheduler.py
+# Dynamic micro-batching: concurrent requests for the same model share one forward pass
+
+import os
+import math
+import time
+import logging
+import threading
+from collections import deque
+import numpy as np
+from metrics import BATCH_SIZES, QUEUE_REJECTIONS, STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Tuning knobs (overridable per scheduler)
+MAX_BATCH_SIZE = int(os.environ.get("DRUEL_MAX_BATCH_SIZE", "8"))
+MAX_WAIT_MS = float(os.environ.get("DRUEL_MAX_BATCH_WAIT_MS", "5"))
+
+# Admission lanes, highest priority first: interactive single-scan requests are always batched
+# before queued bulk (batch/re-analysis) work. Each lane is bounded; a full lane rejects new requests.
+PRIORITIES = ("interactive", "bulk")
+MAX_QUEUE = {
+    "interactive": int(os.environ.get("DRUEL_MAX_QUEUE_INTERACTIVE", "32")),
+    "bulk": int(os.environ.get("DRUEL_MAX_QUEUE_BULK", "64")),
+}
+
+# How many recent queue waits to keep for percentile stats
+WAIT_SAMPLES = 1024
+
+class QueueFull(Exception):
+    """A request was rejected because its admission lane is full"""
+
+    def __init__(self, name, priority, depth, retry_after_s):
+        super().__init__(f"Inference queue for '{name}' is full ({depth} {priority} requests waiting)")
+        self.name = name
+        self.priority = priority
+        self.depth = depth
+        self.retry_after_s = retry_after_s
+
+class _PendingRequest:
+    def __init__(self, input_img):
+        self.input_img = input_img
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class InferenceScheduler:
+    """
+    Collects single-image predictions for one model into batches of up to `max_batch_size`,
+    waiting at most `max_wait_ms` after the first request before running the batch.
+    Requests queue in bounded priority lanes (see PRIORITIES); batches take interactive requests first.
+    `model` is an inference backend from inference_backends.py.
+    """
+
+    def __init__(self, model, name="model", max_batch_size=None, max_wait_ms=None, max_queue=None):
+        self.model = model
+        self.name = name
+        self.max_batch_size = max_batch_size or MAX_BATCH_SIZE
+        self.max_wait_ms = MAX_WAIT_MS if max_wait_ms is None else max_wait_ms
+        self.max_queue = dict(MAX_QUEUE, **(max_queue or {}))
+
+        self._lanes = {priority: deque() for priority in PRIORITIES}
+        self._queue_cond = threading.Condition()
+        self._rejected = {priority: 0 for priority in PRIORITIES}
+        self._forward_total_s = 0.0
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = {}
+        self._batches = 0
+        self._requests = 0
+        self._wait_total_ms = 0.0
+        self._wait_max_ms = 0.0
+        self._recent_waits_ms = deque(maxlen=WAIT_SAMPLES)
+        # Set by retire(): the worker stops once the lanes are empty; later requests go to the successor
+        self._retired = False
+        self._stopped = False
+        self._successor = None
+
+        self._worker = threading.Thread(target=self._run, name=f"inference-{name}", daemon=True)
+        self._worker.start()
+
+    def predict(self, input_img, priority="interactive"):
+        """
+        Predict the mask for one preprocessed (128, 128, 1) image. Blocks until its batch has run.
+        Returns a (128, 128) probability mask, or (128, 128, heads) for a multi-task model.
+        Raises QueueFull straight away when the `priority` lane is full.
+        """
+        pending = _PendingRequest(input_img)
+        self._enqueue([pending], priority, block=False)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def predict_many(self, input_imgs, priority="interactive", block=False):
+        """
+        Predict masks for several preprocessed images, queued together so they share batches.
+        Returns a list of masks (shaped as in predict) in input order.
+        With `block`, waits for room in the lane instead of raising QueueFull (backpressure for bulk work).
+        """
+        pending = [_PendingRequest(img) for img in input_imgs]
+        self._enqueue(pending, priority, block)
+        for p in pending:
+            p.done.wait()
+        for p in pending:
+            if p.error is not None:
+                raise p.error
+        return [p.result for p in pending]
+
+    def _enqueue(self, pending, priority, block):
+        if priority not in self._lanes:
+            raise ValueError(f"Unknown priority '{priority}' (expected one of {PRIORITIES})")
+        lane, capacity = self._lanes[priority], self.max_queue[priority]
+
+        rest = []
+        with self._queue_cond:
+            if self._stopped:
+                rest = pending
+            elif not block:
+                if len(lane) + len(pending) > capacity:
+                    self._rejected[priority] += 1
+                    QUEUE_REJECTIONS.inc(self.name, priority)
+                    raise QueueFull(self.name, priority, len(lane), self._retry_after_s(len(lane)))
+                lane.extend(pending)
+                self._queue_cond.notify_all()
+            else:
+                for i, p in enumerate(pending):
+                    while len(lane) >= capacity and not self._stopped:
+                        self._queue_cond.wait()
+                    if self._stopped:
+                        rest = pending[i:]
+                        break
+                    p.enqueued_at = time.perf_counter()
+                    lane.append(p)
+                    self._queue_cond.notify_all()
+        if rest:
+            self._successor_or_raise()._enqueue(rest, priority, block)
+
+    def _successor_or_raise(self):
+        if self._successor is None:
+            raise RuntimeError(f"Inference scheduler for '{self.name}' has been retired")
+        return self._successor
+
+    def check_admission(self, priority):
+        """Raise QueueFull if a request of `priority` would be rejected right now"""
+        with self._queue_cond:
+            stopped = self._stopped
+            depth = len(self._lanes[priority])
+            if not stopped and depth >= self.max_queue[priority]:
+                self._rejected[priority] += 1
+                QUEUE_REJECTIONS.inc(self.name, priority)
+                raise QueueFull(self.name, priority, depth, self._retry_after_s(depth))
+        if stopped:
+            self._successor_or_raise().check_admission(priority)
+
+    def retire(self, successor=None, timeout=None):
+        """
+        Stop once the requests already queued have run (the worker exits when the lanes are empty).
+        Requests arriving afterwards, from callers still holding this scheduler, go to `successor`.
+        Returns True if drained within `timeout` seconds.
+        """
+        with self._queue_cond:
+            self._successor = successor
+            self._retired = True
+            self._queue_cond.notify_all()
+        self._worker.join(timeout)
+        return not self._worker.is_alive()
+
+    def _retry_after_s(self, depth):
+        """Whole seconds to drain `depth` queued images at the measured per-image forward time"""
+        with self._stats_lock:
+            per_image_s = self._forward_total_s / self._requests if self._requests else 0.0
+        return max(1, math.ceil(depth * per_image_s))
+
+    def _pop_next(self):
+        for priority in PRIORITIES:
+            if self._lanes[priority]:
+                return self._lanes[priority].popleft()
+        return None
+
+    def _collect_batch(self):
+        with self._queue_cond:
+            first = self._pop_next()
+            while first is None:
+                if self._retired:
+                    self._stopped = True
+                    self._queue_cond.notify_all()
+                    return None
+                self._queue_cond.wait()
+                first = self._pop_next()
+            batch = [first]
+            deadline = first.enqueued_at + self.max_wait_ms / 1000.0
+
+            while len(batch) < self.max_batch_size:
+                pending = self._pop_next()
+                if pending is not None:
+                    batch.append(pending)
+                    continue
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._queue_cond.wait(remaining)
+
+            # Room was freed in the lanes: wake producers blocked on a full lane
+            self._queue_cond.notify_all()
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                # Retired and drained: release the model
+                self.model = None
+                return
+            started = time.perf_counter()
+
+            try:
+                inputs = np.stack([p.input_img.reshape(128, 128, 1) for p in batch])
+                masks = self.model.predict(inputs).reshape(len(batch), 128, 128, -1)
+                if masks.shape[-1] == 1:
+                    masks = masks[..., 0]
+                for pending, mask in zip(batch, masks):
+                    pending.result = mask
+            except Exception as e:
+                logger.error(f"Batch inference failed for '{self.name}': {str(e)}")
+                for pending in batch:
+                    pending.error = e
+
+            self._record(batch, started)
+            for pending in batch:
+                pending.done.set()
+
+    def _record(self, batch, started):
+        forward_s = time.perf_counter() - started
+        BATCH_SIZES.observe(len(batch), self.name)
+        STAGE_LATENCY.observe(forward_s, self.name, "forward")
+        with self._stats_lock:
+            self._forward_total_s += forward_s
+            self._batches += 1
+            self._requests += len(batch)
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+            for pending in batch:
+                wait_ms = (started - pending.enqueued_at) * 1000.0
+                self._wait_total_ms += wait_ms
+                self._wait_max_ms = max(self._wait_max_ms, wait_ms)
+                self._recent_waits_ms.append(wait_ms)
+
+    def queue_depth(self):
+        with self._queue_cond:
+            return sum(len(lane) for lane in self._lanes.values())
+
+    def lane_stats(self):
+        """Depth, capacity and rejections per admission lane"""
+        with self._queue_cond:
+            return {priority: {"depth": len(self._lanes[priority]), "capacity": self.max_queue[priority],
+                               "rejected": self._rejected[priority]} for priority in PRIORITIES}
+
+    def stats(self):
+        """Batch-size histogram, queue-wait and admission-lane statistics for tuning"""
+        lanes = self.lane_stats()
+        with self._stats_lock:
+            waits = np.array(self._recent_waits_ms) if self._recent_waits_ms else np.zeros(1)
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "requests": self._requests,
+                "batches": self._batches,
+                "mean_batch_size": round(self._requests / self._batches, 2) if self._batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                "queue_depth": sum(lane["depth"] for lane in lanes.values()),
+                "lanes": lanes,
+                "queue_wait_ms": {
+                    "mean": round(self._wait_total_ms / self._requests, 3) if self._requests else 0.0,
+                    "p50": round(float(np.percentile(waits, 50)), 3),
+                    "p95": round(float(np.percentile(waits, 95)), 3),
+                    "max": round(self._wait_max_ms, 3),
+                },
+            }
+
+class ChannelView:
+    """
+    One head of a multi-task scheduler, with the same predict/predict_many interface
+    (returning (128, 128) masks) as a single-model scheduler
+    """
+
+    def __init__(self, scheduler, channel):
+        self.scheduler = scheduler
+        self.channel = channel
+
+    def predict(self, input_img, priority="interactive"):
+        return self.scheduler.predict(input_img, priority)[..., self.channel]
+
+    def predict_many(self, input_imgs, priority="interactive", block=False):
+        return [mask[..., self.channel] for mask in self.scheduler.predict_many(input_imgs, priority, block)]
+
+    def check_admission(self, priority):
+        self.scheduler.check_admission(priority)
+
+    def queue_depth(self):
+        return self.scheduler.queue_depth()
+
+    def lane_stats(self):
+        return self.scheduler.lane_stats()
+
+    def stats(self):
+        return self.scheduler.stats()
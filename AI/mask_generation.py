@@ -0,0 +1,138 @@
+# mask_generation.py
+# Generate training masks for the thalamic, cerebellar and ventricular planes in parallel.
+# Images whose masks are already current are skipped, so re-runs only process new or changed images.
+#
+# Usage:
+#   python mask_generation.py                                  # all planes, skip by mtime
+#   python mask_generation.py --planes cerebellum --check hash --workers 8
+#   python mask_generation.py --planes brain --force           # regenerate everything
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from classical_segmentation import segment
+from model_registry import DATASET_DIRS
+
+# Written next to the masks; records the image hash and recipe version each mask was made from
+MANIFEST_NAME = ".mask_manifest.json"
+
+# classical_segmentation recipe per plane (keys match DATASET_DIRS) and its version;
+# bump a version when its recipe changes
+RECIPES = {
+    "brain": ("thalamic", 1),
+    "cerebellum": ("cerebellum", 1),
+    "ventricular": ("ventricular", 1),
+}
+
+def generate_mask(img, plane):
+    """128x128 uint8 mask (0/255) for a grayscale image of the given plane"""
+    recipe, _ = RECIPES[plane]
+    return segment(img, recipe) * 255
+
+def write_atomic(path, data):
+    """Write to a temporary file in the same folder, then rename over `path`"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _init_worker():
+    # One OpenCV thread per process; the pool provides the parallelism
+    cv2.setNumThreads(1)
+
+def _process(task):
+    """
+    Worker: (plane, image path, mask path, expected hash or None, force) -> (status, image hash).
+    status is "generated", "skipped" or "failed".
+    """
+    plane, image_path, mask_path, expected_hash, force = task
+    try:
+        with open(image_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return "failed", None
+
+    image_hash = hashlib.sha256(data).hexdigest()
+    if not force and expected_hash is not None and expected_hash == image_hash and os.path.exists(mask_path):
+        return "skipped", image_hash
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return "failed", image_hash
+    ok, encoded = cv2.imencode(".png", generate_mask(img, plane))
+    if not ok:
+        return "failed", image_hash
+    write_atomic(mask_path, encoded.tobytes())
+    return "generated", image_hash
+
+def _load_manifest(mask_folder):
+    try:
+        with open(os.path.join(mask_folder, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _is_current_by_mtime(image_path, mask_path):
+    return os.path.exists(mask_path) and os.path.getmtime(mask_path) >= os.path.getmtime(image_path)
+
+def generate_plane(plane, workers=None, check="mtime", force=False):
+    """Generate the masks for one plane; returns counts and throughput"""
+    image_folder, mask_folder = DATASET_DIRS[plane]
+    os.makedirs(mask_folder, exist_ok=True)
+    _, version = RECIPES[plane]
+    manifest = _load_manifest(mask_folder)
+    started = time.perf_counter()
+
+    counts = {"generated": 0, "skipped": 0, "failed": 0}
+    tasks = []
+    for fname in sorted(os.listdir(image_folder)):
+        if not fname.endswith(".png"):
+            continue
+        image_path = os.path.join(image_folder, fname)
+        mask_path = os.path.join(mask_folder, fname)
+        entry = manifest.get(fname, {})
+        stale_recipe = entry.get("recipe", version) != version
+        if not force and not stale_recipe and check == "mtime" and _is_current_by_mtime(image_path, mask_path):
+            counts["skipped"] += 1
+            continue
+        expected_hash = entry.get("sha256") if check == "hash" and not stale_recipe else None
+        tasks.append((fname, (plane, image_path, mask_path, expected_hash, force)))
+
+    if tasks:
+        chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            results = pool.map(_process, [task for _, task in tasks], chunksize=chunksize)
+            for (fname, _), (status, image_hash) in zip(tasks, results):
+                counts[status] += 1
+                if status != "failed":
+                    manifest[fname] = {"sha256": image_hash, "recipe": version}
+
+    write_atomic(os.path.join(mask_folder, MANIFEST_NAME), json.dumps(manifest, indent=1).encode())
+
+    elapsed = time.perf_counter() - started
+    processed = counts["generated"] + counts["skipped"] + counts["failed"]
+    counts["elapsed_s"] = round(elapsed, 2)
+    counts["images_per_sec"] = round(processed / elapsed, 1) if elapsed > 0 else 0.0
+    print(f"{plane}: {counts['generated']} generated, {counts['skipped']} skipped, {counts['failed']} failed "
+          f"in {elapsed:.1f}s ({counts['images_per_sec']} images/sec) -> {mask_folder}")
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate U-Net training masks for the fetal ultrasound planes")
+    parser.add_argument("--planes", nargs="+", choices=sorted(RECIPES), default=sorted(RECIPES))
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--check", choices=["mtime", "hash"], default="mtime",
+                        help="how to decide a mask is current: mask newer than image, or same image content hash")
+    parser.add_argument("--force", action="store_true", help="regenerate every mask")
+    args = parser.parse_args(argv)
+
+    return {plane: generate_plane(plane, args.workers, args.check, args.force) for plane in args.planes}
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
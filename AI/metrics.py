@@ -0,0 +1,149 @@
+# metrics.py
+# In-process metrics for the AI services, exposed in the Prometheus text format at /metrics.
+# Recording is a lock, a dict lookup and (for histograms) a bisect, so it is cheap on the hot path.
+
+import bisect
+import threading
+
+# Latency buckets in seconds, from a cache hit to a slow CPU forward pass
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+_metrics = []
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 3)
+            series[index] += 1  # index == len(buckets) is the +Inf-only bucket
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self):
+        with self._lock:
+            values = {labels: list(series) for labels, series in self._values.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(float(series[-2]))}")
+            lines.append(f"{self.name}_count{label_text} {series[-1]}")
+        return lines
+
+class Gauge:
+    """
+    Value read from `function()` at scrape time; with `labelnames`, `function()` returns
+    a dict of label-value tuple -> value
+    """
+
+    def __init__(self, name, documentation, function, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labelnames = tuple(labelnames)
+        _metrics.append(self)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        if not self.labelnames:
+            return lines + [f"{self.name} {_format_value(self.function())}"]
+        for labels, value in sorted(self.function().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+def process_rss_bytes():
+    """Resident set size of this process (Linux /proc, falling back to peak RSS)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# ---------------- Metrics recorded by the services ----------------
+REQUESTS = Counter("druel_requests_total", "HTTP requests by route, method and status",
+                   ["route", "method", "status"])
+REQUEST_LATENCY = Histogram("druel_request_duration_seconds", "HTTP request latency by route", ["route"])
+STAGE_LATENCY = Histogram("druel_stage_duration_seconds", "Pipeline stage latency by model and stage",
+                          ["model", "stage"])
+BATCH_SIZES = Histogram("druel_inference_batch_size", "Images per forward pass by model", ["model"],
+                        buckets=BATCH_SIZE_BUCKETS)
+THRESHOLD_LEVELS = Counter("druel_threshold_level_total",
+                           "Mask threshold-ladder level chosen (\"fallback\" = traditional CV mask)",
+                           ["model", "level"])
+MEASUREMENTS = Counter("druel_measurements_total", "Masks measured by model", ["model"])
+CV_FALLBACKS = Counter("druel_cv_fallback_total", "Measurements that fell back to the traditional CV mask",
+                       ["model"])
+QUEUE_REJECTIONS = Counter("druel_queue_rejections_total", "Requests rejected with 429 by a full admission lane",
+                           ["model", "priority"])
+MODEL_RELOADS = Counter("druel_model_reloads_total",
+                        "Model versions loaded after startup by model and outcome (promoted, shadow, unchanged, failed)",
+                        ["model", "outcome"])
+ERRORS = Counter("druel_errors_total", "Failed requests by route and error type", ["route", "type"])
+Gauge("druel_process_resident_memory_bytes", "Resident memory of this process", process_rss_bytes)
+
+def record_threshold_level(model, level):
+    """Record the ladder level used to binarize a mask (an index, or "fallback")"""
+    MEASUREMENTS.inc(model)
+    THRESHOLD_LEVELS.inc(model, str(level))
+    if level == "fallback":
+        CV_FALLBACKS.inc(model)
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
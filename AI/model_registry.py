@@ -0,0 +1,591 @@
+# model_registry.py
+# Shared registry for the segmentation U-Nets so one process can host all of them
+
+import os
+import time
+import queue
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from inference_backends import INFERENCE_BACKEND, TFLITE_QUANTIZATION, load_backend, preload, tflite_path
+from inference_scheduler import MAX_BATCH_SIZE, ChannelView, InferenceScheduler
+from metrics import MODEL_RELOADS, Gauge
+from shadow import ShadowComparison, ShadowView
+
+logger = logging.getLogger(__name__)
+
+# Weights for each structure; all three use the same build_unet() architecture
+MODEL_PATHS = {
+    "brain": "./models/unet_brain_seg.h5",
+    "cerebellum": "./models/unet_cerebellum_seg.h5",
+    "ventricular": "./models/unet_ventricular_seg.h5",
+}
+
+# Multi-task U-Net (train_multitask_model.py): one shared encoder, one head per model above.
+# With DRUEL_MULTITASK=1 it replaces the three separate models, computing every mask in one pass.
+MULTITASK_NAME = "multitask"
+MULTITASK_MODEL_PATH = "./models/unet_multitask_seg.h5"
+MULTITASK_HEADS = list(MODEL_PATHS)
+MULTITASK_ENABLED = os.environ.get("DRUEL_MULTITASK", "0") == "1"
+
+# Every model the registry can load
+_model_files = dict(MODEL_PATHS, **{MULTITASK_NAME: MULTITASK_MODEL_PATH})
+
+# Training images and masks for each model
+DATASET_DIRS = {
+    "brain": ("./dataset/Trans_thalamic_images", "./dataset/Trans_thalamic_masks"),
+    "cerebellum": ("./dataset/Trans_cerebellum_images", "./dataset/Trans_cerebellum_masks"),
+    "ventricular": ("./dataset/Trans_ventricular_images", "./dataset/Trans_ventricular_masks"),
+}
+
+# TF thread pool sizes shared by every model in the process (0 lets TensorFlow decide)
+TF_INTRA_OP_THREADS = int(os.environ.get("DRUEL_TF_INTRA_OP_THREADS", "0"))
+TF_INTER_OP_THREADS = int(os.environ.get("DRUEL_TF_INTER_OP_THREADS", "0"))
+
+# Set by gunicorn.conf.py: start_warmup() only queues models, and each worker starts loading them
+# after fork (release_warmup) so no TensorFlow state is created in the parent process
+DEFER_WARMUP = os.environ.get("DRUEL_DEFER_WARMUP", "0") == "1"
+
+# Batch sizes run once per model before it is marked ready
+WARMUP_BATCH_SIZES = [1, MAX_BATCH_SIZE]
+
+# Hot reload (reload_model): each new version is copied here under its hash, so the file being loaded
+# cannot change underneath (train_model.py overwrites its checkpoint) and older versions stay available
+MODEL_ARCHIVE_DIR = os.environ.get("DRUEL_MODEL_ARCHIVE_DIR", "./models/versions")
+# Seconds between checks of the weight files for a new checkpoint (0 disables the watch)
+WATCH_INTERVAL_S = float(os.environ.get("DRUEL_MODEL_WATCH_S", "0"))
+# Share of traffic a reloaded version first serves in shadow (0 promotes it as soon as it is warm)
+SHADOW_FRACTION = float(os.environ.get("DRUEL_SHADOW_FRACTION", "0"))
+# Longest wait for requests queued on a replaced version before it is logged as slow to drain
+DRAIN_TIMEOUT_S = float(os.environ.get("DRUEL_DRAIN_TIMEOUT_S", "30"))
+
+# Model lifecycle: "pending" -> "loading" -> "warming" -> "ready" (or "failed")
+_states = {name: "pending" for name in _model_files}
+_models = {}
+_versions = {}
+_schedulers = {}
+_model_locks = {name: threading.Lock() for name in _model_files}
+_lock = threading.Lock()
+_threads_configured = False
+_warmup_queue = queue.Queue()
+_warmup_thread = None
+_deferred_warmup = []
+# Versions each model has served, oldest first, and new versions being warmed or shadowed
+_history = {name: [] for name in _model_files}
+_candidates = {}
+_watch_thread = None
+
+# Startup timing, relative to when this module was imported
+_startup_origin = time.perf_counter()
+_startup_phases = {}
+_ready_after_s = None
+
+def configure_tf_threads(intra_op=None, inter_op=None):
+    """
+    Size the single TF thread pool for this process. Must run before the first model is built.
+    Nothing to do (and no TensorFlow import) when serving with TFLite.
+    """
+    global _threads_configured
+    if _threads_configured or INFERENCE_BACKEND != "keras":
+        return
+
+    import tensorflow as tf
+
+    intra_op = TF_INTRA_OP_THREADS if intra_op is None else intra_op
+    inter_op = TF_INTER_OP_THREADS if inter_op is None else inter_op
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    _threads_configured = True
+    logger.info(f"TF threads configured (intra_op={intra_op}, inter_op={inter_op})")
+
+def resolve(name):
+    """Registry entry that serves model `name`: the multi-task model for its heads when enabled"""
+    if MULTITASK_ENABLED and name in MULTITASK_HEADS:
+        return MULTITASK_NAME
+    return name
+
+def record_startup_phase(phase, seconds):
+    """Record how long a startup phase took, for /api/health"""
+    with _lock:
+        _startup_phases[phase] = round(seconds, 3)
+
+def _set_state(name, state):
+    global _ready_after_s
+    with _lock:
+        _states[name] = state
+        started = [s for s in _states.values() if s != "pending"]
+        if state == "ready" and all(s == "ready" for s in started):
+            _ready_after_s = round(time.perf_counter() - _startup_origin, 3)
+
+def served_file(path):
+    """The file the configured backend reads for the weights at `path` (the exported .tflite with TFLite)"""
+    return tflite_path(path, TFLITE_QUANTIZATION) if INFERENCE_BACKEND == "tflite" else path
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def _weights_version(backend, path):
+    """Backend, quantization and a hash of the file it was loaded from: identifies what produced a mask"""
+    variant = f"{backend.name}-{TFLITE_QUANTIZATION}" if backend.name == "tflite" else backend.name
+    return f"{variant}:{_file_digest(served_file(path))}"
+
+def _record_version(name, version, path):
+    _history[name].append({"version": version, "path": path, "loaded_at": time.time()})
+
+def get_model(name):
+    """
+    Return the inference backend registered under `name` (see inference_backends.py),
+    loading it on first use. Returns None if the model could not be loaded.
+    """
+    name = resolve(name)
+    with _model_locks[name]:
+        if name in _models:
+            return _models[name]
+
+        _set_state(name, "loading")
+        started = time.perf_counter()
+        configure_tf_threads()
+
+        try:
+            heads = MULTITASK_HEADS if name == MULTITASK_NAME else None
+            model = load_backend(_model_files[name], num_threads=TF_INTRA_OP_THREADS, heads=heads)
+            _versions[name] = _weights_version(model, _model_files[name])
+            _record_version(name, _versions[name], _model_files[name])
+            logger.info(f"Model '{name}' loaded from {_model_files[name]} ({model.name} backend)")
+        except Exception as e:
+            logger.error(f"Error loading model '{name}': {str(e)}")
+            model = None
+
+        record_startup_phase(f"{name}_load", time.perf_counter() - started)
+        _models[name] = model
+        if model is None:
+            _set_state(name, "failed")
+        return model
+
+def model_version(name):
+    """Version of the weights serving model `name` (None until loaded), used in cache keys"""
+    resolved = resolve(name)
+    version = _versions.get(resolved)
+    if version is None or resolved == name:
+        return version
+    return f"{version}/{name}"
+
+def warm_up(name):
+    """Load model `name` and run warm-up inferences so the first real request is not slow"""
+    name = resolve(name)
+    model = get_model(name)
+    if model is None:
+        return
+
+    _set_state(name, "warming")
+    started = time.perf_counter()
+    try:
+        model.warm_up(WARMUP_BATCH_SIZES)
+    except Exception as e:
+        logger.error(f"Warm-up failed for '{name}': {str(e)}")
+        _set_state(name, "failed")
+        return
+
+    record_startup_phase(f"{name}_warmup", time.perf_counter() - started)
+    get_scheduler(name)
+    _set_state(name, "ready")
+    logger.info(f"Model '{name}' ready")
+
+def _warmup_worker():
+    while True:
+        task = _warmup_queue.get()
+        if callable(task):
+            task()
+        else:
+            warm_up(task)
+
+def _queue_warmup(task):
+    """Run `task` (a model name to warm, or a function) on the warm-up thread. Call with _lock held."""
+    global _warmup_thread
+    _warmup_queue.put(task)
+    if _warmup_thread is None:
+        _warmup_thread = threading.Thread(target=_warmup_worker, name="model-warmup", daemon=True)
+        _warmup_thread.start()
+
+def start_warmup(names):
+    """
+    Load and warm the given models on a background thread, so the server can answer
+    /api/health (as "warming") while they get ready. Models already started are skipped.
+    Models are warmed one at a time on a single thread; Keras model building is not thread-safe.
+    """
+    with _lock:
+        names = list(dict.fromkeys(resolve(name) for name in names))
+        if DEFER_WARMUP and _deferred_warmup is not None:
+            _deferred_warmup.extend(name for name in names if name not in _deferred_warmup)
+            return
+
+        for name in names:
+            if _states[name] == "pending":
+                _states[name] = "loading"
+                _queue_warmup(name)
+    start_watch()
+
+def preload_weights(names):
+    """
+    Read the weights of `names` into memory without TensorFlow, in the parent process before
+    workers fork, so every worker builds its model from the same copy-on-write pages.
+    """
+    for name in dict.fromkeys(resolve(name) for name in names):
+        path = served_file(_model_files[name])
+        try:
+            if preload(path):
+                logger.info(f"Preloaded weights for '{name}' from {path}")
+            else:
+                logger.info(f"No .npz weight cache for '{name}' yet; each worker reads {path}")
+        except OSError as e:
+            logger.warning(f"Could not preload '{name}': {str(e)}")
+
+def release_warmup(wait=False, timeout=None):
+    """
+    Start loading the models queued while warm-up was deferred (in a forked worker).
+    With `wait`, block until every one is ready or failed (or `timeout` seconds pass).
+    """
+    global _deferred_warmup
+    with _lock:
+        names, _deferred_warmup = list(_deferred_warmup or []), None
+    start_warmup(names)
+
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    while wait and startup_report(names)["status"] == "warming":
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+        time.sleep(0.1)
+
+def is_ready(name):
+    with _lock:
+        return _states[resolve(name)] == "ready"
+
+def model_states():
+    """Map of model name -> lifecycle state (heads served by the multi-task model report its state)"""
+    with _lock:
+        return {name: _states[resolve(name)] for name in _model_files}
+
+def startup_report(names=None):
+    """
+    Overall status for `names` (default: every model started): "ready", "warming" or "failed",
+    plus per-model states and startup timing by phase.
+    """
+    with _lock:
+        states = {name: _states[resolve(name)] for name in (names or _model_files)}
+        if names is None:
+            states = {name: state for name, state in states.items() if state != "pending"}
+
+        if any(state == "failed" for state in states.values()):
+            status = "failed"
+        elif states and all(state == "ready" for state in states.values()):
+            status = "ready"
+        else:
+            status = "warming"
+
+        return {
+            "status": status,
+            "models": states,
+            "startup": {
+                "phases_s": dict(_startup_phases),
+                "ready_after_s": _ready_after_s,
+            },
+        }
+
+def get_scheduler(name):
+    """
+    Return the micro-batching scheduler for model `name`, or None if the model failed to load.
+    A head of the multi-task model gets a view of the multi-task scheduler returning its channel.
+    """
+    if resolve(name) != name:
+        scheduler = get_scheduler(resolve(name))
+        return ChannelView(scheduler, MULTITASK_HEADS.index(name)) if scheduler else None
+
+    model = get_model(name)
+    if model is None:
+        return None
+
+    with _lock:
+        if name not in _schedulers:
+            _schedulers[name] = InferenceScheduler(model, name=name)
+        candidate = _candidates.get(name)
+        if candidate is not None and candidate.comparison is not None:
+            return ShadowView(_schedulers[name], candidate.comparison)
+        return _schedulers[name]
+
+def predict_structures(input_img):
+    """
+    Masks for every structure from one preprocessed (128, 128, 1) image in a single forward pass
+    of the multi-task model: {head: (128, 128) mask}. None if the model failed to load.
+    """
+    scheduler = get_scheduler(MULTITASK_NAME)
+    if scheduler is None:
+        return None
+    masks = scheduler.predict(input_img)
+    return {head: masks[..., i] for i, head in enumerate(MULTITASK_HEADS)}
+
+# ---------------- Hot reload: a new version is warmed next to the serving one, then swapped in ----------------
+class Candidate:
+    """A new version of a model, loaded and warmed on the warm-up thread while the current version serves"""
+
+    def __init__(self, name, source, shadow_fraction, expected_version=None):
+        self.name = name
+        self.source = source
+        self.shadow_fraction = shadow_fraction
+        self.expected_version = expected_version
+        # "loading" -> "warming" -> "warmed" or "shadow" -> "promoted" (or "discarded"); "unchanged" / "failed"
+        self.state = "loading"
+        self.version = None
+        self.path = None
+        self.model = None
+        self.scheduler = None
+        self.comparison = None
+        self.error = None
+        self.requested_at = time.time()
+        self.load_s = None
+
+    def report(self):
+        report = {"state": self.state, "source": self.source, "version": self.version,
+                  "requested_at": self.requested_at, "load_s": self.load_s}
+        if self.error:
+            report["error"] = self.error
+        if self.comparison is not None:
+            report["shadow"] = self.comparison.report()
+        return report
+
+def _is_archived(path):
+    return os.path.abspath(path).startswith(os.path.abspath(MODEL_ARCHIVE_DIR) + os.sep)
+
+def _archive(name, path):
+    """
+    Copy the file the backend reads for the weights at `path` to MODEL_ARCHIVE_DIR/<name>/<hash>/
+    and return the weights path to load from there. The hash is taken of the copy, so a checkpoint
+    rewritten during the copy cannot end up under the wrong version.
+    """
+    source = served_file(path)
+    folder = os.path.join(MODEL_ARCHIVE_DIR, name)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".incoming")
+    try:
+        with os.fdopen(fd, "wb") as tmp, open(source, "rb") as f:
+            shutil.copyfileobj(f, tmp)
+        version_dir = os.path.join(folder, _file_digest(tmp_path))
+        os.makedirs(version_dir, exist_ok=True)
+        os.replace(tmp_path, os.path.join(version_dir, os.path.basename(source)))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return os.path.join(version_dir, os.path.basename(path))
+
+def reload_model(name, path=None, version=None, shadow_fraction=None):
+    """
+    Load a new version of model `name` in the background: the weights at `path` (default: its
+    configured file, e.g. a checkpoint just written by train_model.py) or an earlier `version` from
+    its history. Once warmed it is promoted, or with `shadow_fraction` > 0 (default DRUEL_SHADOW_FRACTION)
+    it first receives that share of requests in shadow until promote() or discard().
+    Returns the candidate's report; raises ValueError when the reload cannot start.
+    """
+    name = resolve(name)
+    if name not in _model_files:
+        raise ValueError(f"Unknown model '{name}'")
+    shadow_fraction = SHADOW_FRACTION if shadow_fraction is None else float(shadow_fraction)
+    if not 0.0 <= shadow_fraction <= 1.0:
+        raise ValueError("shadow must be a fraction between 0 and 1")
+
+    with _lock:
+        if _states[name] != "ready":
+            raise ValueError(f"Model '{name}' is not serving yet ({_states[name]})")
+        if version is not None:
+            entry = next((e for e in reversed(_history[name]) if e["version"] == version), None)
+            if entry is None:
+                raise ValueError(f"Unknown version '{version}' of '{name}'")
+            path = entry["path"]
+        path = path or _model_files[name]
+        if not os.path.exists(served_file(path)):
+            raise ValueError(f"{served_file(path)} not found")
+
+        previous = _candidates.get(name)
+        if previous is not None and previous.state in ("loading", "warming"):
+            raise ValueError(f"A new version of '{name}' is already loading")
+        candidate = _candidates[name] = Candidate(name, path, shadow_fraction, version)
+        _queue_warmup(lambda: _load_candidate(candidate))
+
+    if previous is not None:
+        _release(previous, "replaced")
+    logger.info(f"Reloading '{name}' from {path}" + (f" ({shadow_fraction:.0%} shadow traffic)" if shadow_fraction else ""))
+    return candidate.report()
+
+def _load_candidate(candidate):
+    """Runs on the warm-up thread (Keras model building is not thread-safe)"""
+    name = candidate.name
+    started = time.perf_counter()
+    try:
+        configure_tf_threads()
+        path = candidate.source if _is_archived(candidate.source) else _archive(name, candidate.source)
+        heads = MULTITASK_HEADS if name == MULTITASK_NAME else None
+        model = load_backend(path, num_threads=TF_INTRA_OP_THREADS, heads=heads)
+        candidate.path, candidate.version = path, _weights_version(model, path)
+        if candidate.expected_version not in (None, candidate.version):
+            raise ValueError(f"the weights at {candidate.source} are now {candidate.version}, "
+                             f"not {candidate.expected_version}")
+        if candidate.version != _versions.get(name):
+            candidate.state = "warming"
+            model.warm_up(WARMUP_BATCH_SIZES)
+    except Exception as e:
+        logger.error(f"Reload of '{name}' from {candidate.source} failed: {str(e)}")
+        candidate.state, candidate.error = "failed", str(e)
+        MODEL_RELOADS.inc(name, "failed")
+        return
+    candidate.load_s = round(time.perf_counter() - started, 3)
+
+    with _lock:
+        if _candidates.get(name) is not candidate:
+            return  # discarded or replaced while loading
+        if candidate.version == _versions.get(name):
+            # e.g. the watched file was touched or rewritten with the same weights
+            del _candidates[name]
+            candidate.state = "unchanged"
+        elif candidate.shadow_fraction > 0:
+            candidate.model = model
+            candidate.scheduler = InferenceScheduler(model, name=f"{name}-candidate")
+            structures = MULTITASK_HEADS if name == MULTITASK_NAME else [name]
+            candidate.comparison = ShadowComparison(candidate.scheduler, candidate.shadow_fraction, structures)
+            candidate.state = "shadow"
+        else:
+            candidate.model = model
+            candidate.state = "warmed"
+
+    MODEL_RELOADS.inc(name, "promoted" if candidate.state == "warmed" else candidate.state)
+    if candidate.state == "unchanged":
+        logger.info(f"Weights for '{name}' unchanged ({candidate.version}); nothing to reload")
+    elif candidate.state == "shadow":
+        logger.info(f"Version {candidate.version} of '{name}' warmed in {candidate.load_s}s; "
+                    f"shadowing {candidate.shadow_fraction:.0%} of requests")
+    else:
+        promote(name)
+
+def promote(name):
+    """
+    Switch model `name` to its warmed candidate atomically: new requests, and result cache keys, use
+    the new version at once; requests already queued finish on the old version, which is released
+    once drained (in the background). Returns the new version; ValueError if there is none to promote.
+    """
+    name = resolve(name)
+    with _lock:
+        candidate = _candidates.get(name)
+        if candidate is None or candidate.model is None:
+            raise ValueError(f"'{name}' has no warmed version to promote")
+        del _candidates[name]
+        old_version, old_scheduler = _versions.get(name), _schedulers.get(name)
+        scheduler = candidate.scheduler or InferenceScheduler(candidate.model, name=name)
+        scheduler.name = name
+        _models[name] = candidate.model
+        _versions[name] = candidate.version
+        _schedulers[name] = scheduler
+        _record_version(name, candidate.version, candidate.path)
+        candidate.state = "promoted"
+
+    if candidate.comparison is not None:
+        candidate.comparison.close()
+    logger.info(f"Model '{name}' switched from {old_version} to {candidate.version}")
+    if old_scheduler is not None:
+        threading.Thread(target=_drain, args=(name, old_scheduler, scheduler, old_version),
+                         name=f"drain-{name}", daemon=True).start()
+    return candidate.version
+
+def _drain(name, old_scheduler, successor, old_version):
+    started = time.perf_counter()
+    if old_scheduler.retire(successor, timeout=DRAIN_TIMEOUT_S):
+        logger.info(f"Version {old_version} of '{name}' drained in {time.perf_counter() - started:.2f}s and released")
+    else:
+        logger.warning(f"Version {old_version} of '{name}' still has queued requests after {DRAIN_TIMEOUT_S}s")
+
+def discard(name):
+    """Drop the version being loaded or shadowed for `name`; the serving version is unaffected"""
+    with _lock:
+        candidate = _candidates.pop(resolve(name), None)
+    if candidate is None:
+        raise ValueError(f"'{name}' has no new version loading or in shadow")
+    _release(candidate, "discarded")
+    return candidate.report()
+
+def _release(candidate, state):
+    candidate.state = state
+    if candidate.comparison is not None:
+        candidate.comparison.close()
+    if candidate.scheduler is not None:
+        # Shadow requests arriving afterwards fail and are counted as such
+        candidate.scheduler.retire(timeout=0)
+    candidate.model = None
+    logger.info(f"Version {candidate.version} of '{candidate.name}' {state}")
+
+def versions_report():
+    """Serving version, history and any new version (with its shadow comparison) per loaded model"""
+    with _lock:
+        report = {name: {"version": _versions.get(name), "state": _states[name], "history": list(_history[name])}
+                  for name in _model_files if name in _models}
+        candidates = dict(_candidates)
+    for name, candidate in candidates.items():
+        report[name]["candidate"] = candidate.report()
+    return report
+
+def _watch_worker():
+    seen = {}      # name -> (mtime, size) of the weight file when last reloaded (or first seen)
+    settling = {}  # name -> signature of a change waiting one more interval
+    while True:
+        time.sleep(WATCH_INTERVAL_S)
+        for name in [name for name, model in list(_models.items()) if model is not None]:
+            try:
+                stat = os.stat(served_file(_model_files[name]))
+            except OSError:
+                continue
+            signature = (stat.st_mtime, stat.st_size)
+            if seen.setdefault(name, signature) == signature:
+                settling.pop(name, None)
+                continue
+            # Reload only once the file has not changed for a whole interval (not half-written)
+            if settling.get(name) != signature:
+                settling[name] = signature
+                continue
+            try:
+                reload_model(name)
+            except ValueError as e:
+                logger.info(f"Weight file of '{name}' changed; reload deferred: {str(e)}")
+                continue
+            seen[name] = signature
+            settling.pop(name, None)
+
+def start_watch():
+    """Start watching the weight files for new checkpoints (DRUEL_MODEL_WATCH_S > 0), once per process"""
+    global _watch_thread
+    with _lock:
+        if WATCH_INTERVAL_S <= 0 or _watch_thread is not None:
+            return
+        _watch_thread = threading.Thread(target=_watch_worker, name="model-watch", daemon=True)
+        _watch_thread.start()
+    logger.info(f"Watching model weights for new versions every {WATCH_INTERVAL_S:g}s")
+
+def scheduler_stats():
+    """Per-model batching statistics for every scheduler started so far"""
+    with _lock:
+        schedulers = dict(_schedulers)
+    return {name: scheduler.stats() for name, scheduler in schedulers.items()}
+
+def lane_stats():
+    """Admission-lane depth, capacity and rejections per model for every scheduler started so far"""
+    with _lock:
+        schedulers = dict(_schedulers)
+    return {name: scheduler.lane_stats() for name, scheduler in schedulers.items()}
+
+def queue_depths():
+    """Queued requests per (model, priority lane)"""
+    return {(name, priority): lane["depth"] for name, lanes in lane_stats().items()
+            for priority, lane in lanes.items()}
+
+Gauge("druel_inference_queue_depth", "Requests waiting for inference by model and priority lane",
+      queue_depths, ["model", "priority"])
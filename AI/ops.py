@@ -0,0 +1,183 @@
+# ops.py
+# Operational endpoints shared by every AI service (standalone apps and server.py)
+
+import os
+import json
+import hmac
+import time
+from flask import Blueprint, Response, g, jsonify, request
+from metrics import ERRORS, REQUEST_LATENCY, REQUESTS, render
+from inference_scheduler import PRIORITIES, QueueFull
+from model_registry import (discard, lane_stats, model_states, promote, reload_model, scheduler_stats, startup_report,
+                            versions_report)
+from result_cache import get_cache
+from tracing import (INCLUDE_TRACE_HEADER, SCAN_HEADER, TRACE_HEADER, current_trace, end_trace, span,
+                     start_trace, write_trace)
+
+bp = Blueprint("ops", __name__)
+
+# Seconds a client should wait before retrying while models warm up
+WARMUP_RETRY_AFTER_S = 5
+
+# "interactive" (default) or "bulk": the admission lane a request's inference queues in
+PRIORITY_HEADER = "X-Priority"
+
+# Shared secret for the /api/admin endpoints (X-Admin-Token); unset = only clients on this host
+ADMIN_TOKEN = os.environ.get("DRUEL_ADMIN_TOKEN", "")
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+def request_priority(default="interactive"):
+    """Admission lane for the current request, from the X-Priority header"""
+    priority = (request.headers.get(PRIORITY_HEADER) or default).lower()
+    return priority if priority in PRIORITIES else default
+
+def note_error(exc):
+    """Label the current request's error count in /metrics with the exception type"""
+    g.error_type = type(exc).__name__
+
+@bp.before_app_request
+def _start_request():
+    g.request_started = time.perf_counter()
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    start_trace((request.headers.get(TRACE_HEADER) or "")[:128] or None,
+                (request.headers.get(SCAN_HEADER) or "")[:128] or None, route)
+
+    # Receiving and parsing the multipart body is the "upload" span (the views would parse it anyway)
+    if request.method == "POST":
+        with span(request.blueprint, "upload"):
+            request.files
+
+@bp.after_app_request
+def _record_request(response):
+    """
+    Request count, latency and errors for /metrics, for every route of the app.
+    Streamed (NDJSON) responses are timed until their headers are sent.
+    """
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    REQUESTS.inc(route, request.method, str(response.status_code))
+    started = g.get("request_started")
+    if started is not None:
+        REQUEST_LATENCY.observe(time.perf_counter() - started, route)
+    if response.status_code >= 400:
+        ERRORS.inc(route, g.get("error_type", f"http_{response.status_code}"))
+
+    trace = current_trace()
+    if trace is not None:
+        trace.status = response.status_code
+        response.headers[TRACE_HEADER] = trace.trace_id
+        if request.headers.get(INCLUDE_TRACE_HEADER) == "1" and response.is_json and not response.is_streamed:
+            body = response.get_json(silent=True)
+            if isinstance(body, dict):
+                body["trace"] = trace.to_dict()
+                response.set_data(json.dumps(body))
+    return response
+
+@bp.teardown_app_request
+def _write_trace(exc):
+    """Runs once the response is fully sent, so streamed batch responses are traced to the end"""
+    trace = current_trace()
+    if trace is None:
+        return
+    trace.finish(500 if exc is not None and trace.status is None else None)
+    # Health checks and scrapes would flood the log
+    if request.blueprint != "ops":
+        write_trace(trace)
+    end_trace()
+
+def model_unavailable(name):
+    """Response for a request that arrives before model `name` is ready"""
+    if model_states()[name] == "failed":
+        return jsonify({"error": "Model not loaded. Please check server logs."}), 500
+
+    response = jsonify({"error": "Model is warming up. Please retry shortly."})
+    response.headers["Retry-After"] = str(WARMUP_RETRY_AFTER_S)
+    return response, 503
+
+@bp.app_errorhandler(QueueFull)
+def queue_full(exc):
+    """429 for a request turned away by a full admission lane, so the caller backs off instead of timing out"""
+    note_error(exc)
+    response = jsonify({"error": "Server is busy. Please retry shortly.",
+                        "priority": exc.priority, "queue_depth": exc.depth})
+    response.headers["Retry-After"] = str(exc.retry_after_s)
+    return response, 429
+
+@bp.route("/api/health", methods=["GET"])
+def health_check():
+    """
+    "ready" (200) once every model this process serves is loaded and warmed,
+    otherwise "warming" or "failed" (503), with startup timing by phase and inference queue depths
+    """
+    report = startup_report()
+    report["model_loaded"] = report["status"] == "ready"
+    report["queues"] = lane_stats()
+    return jsonify(report), 200 if report["status"] == "ready" else 503
+
+@bp.route("/api/inference-stats", methods=["GET"])
+def inference_stats():
+    """Micro-batching statistics (batch sizes, queue waits) per model"""
+    return jsonify(scheduler_stats())
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text-format metrics: requests, stage latencies, batch sizes, thresholds, errors, memory"""
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+@bp.route("/api/cache-stats", methods=["GET"])
+def cache_stats():
+    """Result cache size and hit/miss counters for masks and measurements"""
+    return jsonify(get_cache().stats())
+
+def _admin_denied():
+    """403 response unless the request may use the admin endpoints, else None"""
+    if ADMIN_TOKEN:
+        if hmac.compare_digest(request.headers.get(ADMIN_TOKEN_HEADER, ""), ADMIN_TOKEN):
+            return None
+    elif request.remote_addr in ("127.0.0.1", "::1"):
+        return None
+    return jsonify({"error": "Forbidden"}), 403
+
+@bp.route("/api/admin/models", methods=["GET"])
+def model_versions():
+    """Serving version and version history per model, and any new version loading or in shadow"""
+    return _admin_denied() or jsonify(versions_report())
+
+@bp.route("/api/admin/models/<name>/reload", methods=["POST"])
+def reload(name):
+    """
+    Load and warm a new version of model `name` in the background (202) while the current one serves.
+    JSON body (all optional): "path" of the weights (default: the configured file), or "version" from
+    the history to roll back to, and "shadow" (0-1), the share of requests to mirror to it before promotion.
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    body = request.get_json(silent=True) or {}
+    try:
+        candidate = reload_model(name, path=body.get("path"), version=body.get("version"),
+                                 shadow_fraction=body.get("shadow"))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify(candidate), 202
+
+@bp.route("/api/admin/models/<name>/promote", methods=["POST"])
+def promote_version(name):
+    """Switch traffic to the new version in shadow; the old version drains and is released"""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    try:
+        return jsonify({"version": promote(name)})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+
+@bp.route("/api/admin/models/<name>/discard", methods=["POST"])
+def discard_version(name):
+    """Drop the new version loading or in shadow, keeping the serving one"""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    try:
+        return jsonify(discard(name))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
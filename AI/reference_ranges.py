@@ -0,0 +1,50 @@
+# reference_ranges.py
+# Reference biometry tables by gestational age, shared by the Flask apps and the batch biometry engine
+
+# Reference measurements for gestational ages 18-24 weeks
+REFERENCE_DATA = {
+    18: {"hc": 145, "bpd": 42},
+    19: {"hc": 155, "bpd": 45},
+    20: {"hc": 170, "bpd": 48},
+    21: {"hc": 180, "bpd": 50},
+    22: {"hc": 190, "bpd": 53},
+    23: {"hc": 200, "bpd": 56},
+    24: {"hc": 210, "bpd": 59}
+}
+
+# Tolerance range (±10%) for normal measurements
+TOLERANCE = 0.10
+
+# TCD reference data (gestational age in weeks -> expected TCD in mm)
+TCD_REFERENCE = {
+    18: 18,
+    19: 19,
+    20: 20,
+    21: 21,
+    22: 22,
+    23: 23,
+    24: 24
+}
+
+# Allowed TCD deviation (+/- mm) from the expected value
+TCD_TOLERANCE_MM = 2
+
+# Normal ranges based on gestational age
+NORMAL_RANGES = {
+    18: {"HC": 145, "BPD": 42, "TCD": 18, "LVW_max": 10},
+    19: {"HC": 155, "BPD": 45, "TCD": 19, "LVW_max": 10},
+    20: {"HC": 170, "BPD": 48, "TCD": 20, "LVW_max": 10},
+    21: {"HC": 180, "BPD": 50, "TCD": 21, "LVW_max": 10},
+    22: {"HC": 190, "BPD": 53, "TCD": 22, "LVW_max": 10},
+    23: {"HC": 200, "BPD": 56, "TCD": 23, "LVW_max": 10},
+    24: {"HC": 210, "BPD": 59, "TCD": 24, "LVW_max": 10},
+}
+
+def get_normal_ranges(gest_age_weeks):
+    # If gestational age is outside our table, use closest value
+    if gest_age_weeks < 18:
+        return NORMAL_RANGES[18]
+    elif gest_age_weeks > 24:
+        return NORMAL_RANGES[24]
+    else:
+        return NORMAL_RANGES[gest_age_weeks]
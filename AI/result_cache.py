@@ -0,0 +1,215 @@
+# result_cache.py
+# Two-level cache of predicted masks and measurements, keyed by image content hash and model version.
+# Re-uploads of the same image skip preprocessing and inference; only the gestational-age
+# evaluation (evaluate_measurement / is_tcd_normal / analyze_lvw) runs again.
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from model_registry import model_version
+
+logger = logging.getLogger(__name__)
+
+# In-memory LRU budget; 0 disables the cache
+MEMORY_BYTES = int(os.environ.get("DRUEL_RESULT_CACHE_MB", "256")) * 1024 * 1024
+
+# Optional on-disk tier below the LRU (unset = memory only), with its own budget
+DISK_DIR = os.environ.get("DRUEL_RESULT_CACHE_DIR", "")
+DISK_BYTES = int(os.environ.get("DRUEL_RESULT_CACHE_DISK_MB", "2048")) * 1024 * 1024
+
+# What is cached per image: the (128, 128) probability mask, the GA-independent measurements (with the
+# overlay geometry), and for annotations.py the decoded scan and its encoded overlay renders
+KINDS = ("mask", "measurement", "scan", "render")
+# Kinds stored as numpy arrays (.npy on disk) and as raw bytes; the rest are JSON
+ARRAY_KINDS = ("mask", "scan")
+BYTES_KINDS = ("render",)
+
+def _sizeof(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, bytes):
+        return len(value)
+    return len(json.dumps(value))
+
+class ResultCache:
+    """
+    LRU of masks (numpy arrays) and measurements (JSON-able dicts) bounded by `max_bytes`,
+    backed by an optional directory bounded by `disk_max_bytes` (oldest files evicted first).
+    Values must not be modified after put/get.
+    """
+
+    def __init__(self, max_bytes=MEMORY_BYTES, disk_dir=DISK_DIR, disk_max_bytes=DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._disk_bytes = None  # scanned lazily
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._counters = {kind: {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0} for kind in KINDS}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, kind, key):
+        """Cached value of `kind` for `key`, or None"""
+        if not self.enabled or key is None:
+            return None
+        with self._lock:
+            value = self._entries.get((kind, key))
+            if value is not None:
+                self._entries.move_to_end((kind, key))
+                self._counters[kind]["memory_hits"] += 1
+                return value
+
+        value = self._disk_get(kind, key)
+        with self._lock:
+            if value is None:
+                self._counters[kind]["misses"] += 1
+                return None
+            self._counters[kind]["disk_hits"] += 1
+        self._memory_put(kind, key, value)
+        return value
+
+    def put(self, kind, key, value):
+        if not self.enabled or key is None or value is None:
+            return
+        if isinstance(value, np.ndarray):
+            # Own copy: a mask is often a view into a whole batch of predictions
+            value = value.copy()
+            value.flags.writeable = False
+        self._memory_put(kind, key, value)
+        self._disk_put(kind, key, value)
+
+    def _memory_put(self, kind, key, value):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop((kind, key), None)
+            if old is not None:
+                self._bytes -= _sizeof(old)
+            self._entries[(kind, key)] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                (old_kind, _), old = self._entries.popitem(last=False)
+                self._bytes -= _sizeof(old)
+                self._counters[old_kind]["evictions"] += 1
+
+    def _disk_path(self, kind, key):
+        name = hashlib.sha256(f"{kind}:{key}".encode()).hexdigest()
+        extension = ".npy" if kind in ARRAY_KINDS else (".bin" if kind in BYTES_KINDS else ".json")
+        return os.path.join(self.disk_dir, name[:2], name + extension)
+
+    def _disk_get(self, kind, key):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(kind, key)
+        try:
+            if kind in ARRAY_KINDS:
+                return np.load(path)
+            if kind in BYTES_KINDS:
+                with open(path, "rb") as f:
+                    return f.read()
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, kind, key, value):
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(kind, key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            # An overwritten entry's old file no longer counts against the budget
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                if kind in ARRAY_KINDS:
+                    np.save(f, value)
+                elif kind in BYTES_KINDS:
+                    f.write(value)
+                else:
+                    f.write(json.dumps(value).encode())
+            os.replace(tmp_path, path)
+            self._enforce_disk_budget(os.path.getsize(path) - old_size)
+        except OSError as e:
+            logger.warning(f"Result cache write failed: {str(e)}")
+
+    def _scan_disk(self):
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        return files
+
+    def _enforce_disk_budget(self, added):
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, _, size in self._scan_disk())
+            else:
+                self._disk_bytes += added
+            if self._disk_bytes <= self.disk_max_bytes:
+                return
+
+            # Over budget: drop the oldest files down to 90% of the budget
+            files = sorted(self._scan_disk())
+            total = sum(size for _, _, size in files)
+            for _, path, size in files:
+                if total <= self.disk_max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            counters = {kind: dict(values) for kind, values in self._counters.items()}
+            entries, used = len(self._entries), self._bytes
+        for values in counters.values():
+            lookups = values["memory_hits"] + values["disk_hits"] + values["misses"]
+            values["hit_rate"] = round((values["memory_hits"] + values["disk_hits"]) / lookups, 3) if lookups else 0.0
+        return {
+            "enabled": self.enabled,
+            "memory": {"entries": entries, "bytes": used, "max_bytes": self.max_bytes},
+            "disk": {"dir": self.disk_dir, "bytes": self._disk_bytes, "max_bytes": self.disk_max_bytes}
+                    if self.disk_dir else None,
+            "kinds": counters,
+        }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """The process-wide result cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
+
+def cache_key(name, image_digest, variant=None):
+    """
+    Key for an image analysed by model `name`, optionally for a `variant` of the analysis
+    (e.g. the "refine" measurement mode); None (not cached) until the model is loaded
+    """
+    version = model_version(name)
+    if version is None:
+        return None
+    key = f"{name}:{version}:{image_digest}"
+    return f"{key}:{variant}" if variant else key
@@ -0,0 +1,125 @@
+# roi_refinement.py
+# Coarse-to-fine measurement: the usual 128x128 pass over the whole frame localizes the skull or
+# cerebellum, then a square ROI around it is cropped from the original image and segmented again,
+# so each mask pixel covers far fewer source pixels. Refined measurements are fitted in the crop and
+# converted with the source pixel spacing (the coarse mode applies it to 128x128 mask pixels).
+
+import os
+import cv2
+from biometry import select_thresholds
+from fetal_brain_diagnosis import fit_bpd_and_hc, preprocess_image
+from fetal_cerebellum_diagnosis import fit_tcd
+
+# "coarse": one pass over the downsampled frame (the original behaviour); "refine": coarse + ROI pass
+MODES = ("coarse", "refine")
+DEFAULT_MODE = os.environ.get("DRUEL_MEASUREMENT_MODE", "coarse").lower()
+
+# Context kept around the structure, as a fraction of its size on every side
+ROI_MARGIN = float(os.environ.get("DRUEL_ROI_MARGIN", "0.25"))
+# The ROI is never smaller than the model input (that would only upsample the crop)
+MIN_ROI_SIDE = 128
+
+# How the coarse mask is binarized to find the ROI: as each structure's measurement path does
+# (the brain threshold ladder; a fixed 0.5 for the cerebellum, see fit_tcd)
+ROI_THRESHOLDS = {
+    "brain": {},
+    "cerebellum": {"thresholds": [0.5], "min_pixels": 0},
+}
+
+# Why the coarse fit was used instead of the requested refinement
+FALLBACK_NO_ROI = "Structure not localized in the coarse mask; the coarse measurement was used"
+FALLBACK_NO_FIT = "No contour could be fitted in the refined ROI; the coarse measurement was used"
+
+def parse_mode(value):
+    """Measurement mode from a request field (None = DEFAULT_MODE); ValueError if unknown"""
+    mode = (value or DEFAULT_MODE).lower()
+    if mode not in MODES:
+        raise ValueError(f"measurementMode must be one of {', '.join(MODES)}")
+    return mode
+
+def locate_roi(coarse_mask, frame_shape, structure="brain", margin=ROI_MARGIN):
+    """
+    Square (x, y, side) in frame pixels around the largest component of the coarse mask
+    (binarized with the thresholds of `structure`), kept inside the frame. None if the mask is empty.
+    """
+    binary, _, level = select_thresholds(coarse_mask, **ROI_THRESHOLDS[structure])
+    if level[0] < 0:
+        return None
+    contours, _ = cv2.findContours(binary[0], cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+
+    frame_h, frame_w = frame_shape[:2]
+    scale_x, scale_y = frame_w / binary.shape[2], frame_h / binary.shape[1]
+    center_x, center_y = (x + w / 2) * scale_x, (y + h / 2) * scale_y
+    side = max(w * scale_x, h * scale_y) * (1 + 2 * margin)
+    side = int(round(min(max(side, MIN_ROI_SIDE), frame_w, frame_h)))
+
+    x0 = int(round(min(max(center_x - side / 2, 0), frame_w - side)))
+    y0 = int(round(min(max(center_y - side / 2, 0), frame_h - side)))
+    return x0, y0, side
+
+def crop(img, roi):
+    x, y, side = roi
+    return img[y:y + side, x:x + side]
+
+def roi_scale(roi):
+    """Frame pixels per pixel of the refined 128x128 mask"""
+    return roi[2] / 128.0
+
+def ellipse_to_frame(ellipse, roi):
+    """An ellipse fitted on the refined mask, in original frame coordinates"""
+    (cx, cy), (major, minor), angle = ellipse
+    scale = roi_scale(roi)
+    return (roi[0] + cx * scale, roi[1] + cy * scale), (major * scale, minor * scale), angle
+
+def refine(img, coarse_mask, predict, structure="brain", margin=ROI_MARGIN):
+    """
+    Locate the ROI of `structure` from `coarse_mask` and segment the crop with `predict` (preprocessed
+    (128, 128, 1) input -> (128, 128) mask). Returns (roi, refined mask), or (None, None).
+    """
+    roi = locate_roi(coarse_mask, img.shape, structure, margin)
+    if roi is None:
+        return None, None
+    return roi, predict(preprocess_image(crop(img, roi)))
+
+def refine_bpd_and_hc(img, coarse_mask, predict, pixel_spacing=0.3, debug=None):
+    """
+    BPD and HC from the refined ROI mask: (bpd_mm, hc_mm, ellipse in frame coordinates, roi),
+    or (None, None, None, roi) when no ROI or no ellipse is found.
+    `pixel_spacing` is in mm per source pixel (see dicom_io.pipeline_spacings).
+    """
+    roi, mask = refine(img, coarse_mask, predict, "brain")
+    if roi is None:
+        return None, None, None, None
+    bpd_mm, hc_mm, ellipse = fit_bpd_and_hc(mask, crop(img, roi), pixel_spacing * roi_scale(roi), debug)
+    if ellipse is None:
+        return None, None, None, roi
+    return bpd_mm, hc_mm, ellipse_to_frame(ellipse, roi), roi
+
+def refine_tcd(img, coarse_mask, predict, pixel_spacing=0.3):
+    """
+    TCD from the refined ROI mask: (tcd_mm, ellipse in frame coordinates, roi); None values when not found.
+    `pixel_spacing` is in mm per source pixel.
+    """
+    roi, mask = refine(img, coarse_mask, predict, "cerebellum")
+    if roi is None:
+        return None, None, None
+    tcd_mm, ellipse = fit_tcd(mask, pixel_spacing * roi_scale(roi))
+    if ellipse is None:
+        return None, None, roi
+    return tcd_mm, ellipse_to_frame(ellipse, roi), roi
+
+def refine_fields(roi, refined):
+    """Cached and reported fields of a "refine" request: the ROI used, or why the coarse fit was used"""
+    if refined:
+        return {"roi": list(roi)}
+    return {"roi": None, "refine_fallback": FALLBACK_NO_FIT if roi is not None else FALLBACK_NO_ROI}
+
+def refine_report(measurement):
+    """Response fields for a "refine" request from its cached measurement"""
+    report = {"measurement_mode": "refine", "roi": measurement.get("roi")}
+    if measurement.get("refine_fallback"):
+        report["refine_fallback"] = measurement["refine_fallback"]
+    return report
@@ -0,0 +1,42 @@
+# server.py
+# Single Flask process hosting the brain, cerebellum, ventricular and cine-loop analysis APIs.
+# Replaces running app.py, app_cerebellum.py and app_ventricular.py as three separate servers:
+# the models come from one shared registry and share one TF thread pool.
+
+import time
+_import_started = time.perf_counter()
+
+import os
+import logging
+from flask import Flask
+from image_io import configure_app
+from model_registry import MODEL_PATHS, record_startup_phase, start_warmup
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PORT = int(os.environ.get("DRUEL_AI_PORT", "4000"))
+
+from annotations import bp as annotations_bp
+from app import bp as brain_bp
+from app_cerebellum import bp as cerebellum_bp
+from app_cine import bp as cine_bp
+from app_ventricular import bp as ventricular_bp
+from ops import bp as ops_bp
+
+app = Flask(__name__)
+configure_app(app)
+app.register_blueprint(brain_bp)
+app.register_blueprint(cerebellum_bp)
+app.register_blueprint(ventricular_bp)
+app.register_blueprint(cine_bp)
+app.register_blueprint(annotations_bp)
+app.register_blueprint(ops_bp)
+
+record_startup_phase("imports", time.perf_counter() - _import_started)
+
+# Every model loads and warms in the background; /api/health reports "warming" until all are ready
+start_warmup(list(MODEL_PATHS))
+
+if __name__ == "__main__":
+    app.run(debug=False, port=PORT)
@@ -0,0 +1,166 @@
+# shadow.py
+# Shadow traffic for a candidate model version: a sample of real requests is also run on the
+# candidate (off the request path) and its latency, masks and measurements are compared with the
+# serving version before it is promoted.
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from biometry import measure_batch
+from inference_scheduler import QueueFull
+
+logger = logging.getLogger(__name__)
+
+# Recent comparisons kept for the report
+SHADOW_SAMPLES = 512
+# Sampled requests waiting for the candidate beyond which new samples are dropped
+MAX_SHADOW_BACKLOG = 8
+
+MEASUREMENTS = ("bpd_mm", "hc_mm", "tcd_mm", "lvw_mm")
+
+def _dice(a, b):
+    total = a.sum() + b.sum()
+    return 1.0 if total == 0 else 2.0 * np.logical_and(a, b).sum() / total
+
+def _summary(values, digits=3):
+    if not values:
+        return None
+    values = np.array(values)
+    return {"mean": round(float(values.mean()), digits), "p95": round(float(np.percentile(values, 95)), digits),
+            "max": round(float(values.max()), digits)}
+
+class ShadowComparison:
+    """
+    Runs a `fraction` of the serving version's requests on `scheduler` (the candidate's) and records
+    latency, mask Dice and measurement differences. `structures` names the mask channel(s): one
+    structure for a single model, the heads of a multi-task model.
+    """
+
+    def __init__(self, scheduler, fraction, structures):
+        self.scheduler = scheduler
+        self.fraction = fraction
+        self.structures = list(structures)
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"shadow-{scheduler.name}")
+        self._lock = threading.Lock()
+        self._backlog = 0
+        self._closed = False
+        self._counts = {"sampled": 0, "compared": 0, "dropped": 0, "failed": 0}
+        self._latency_ms = {"serving": deque(maxlen=SHADOW_SAMPLES), "candidate": deque(maxlen=SHADOW_SAMPLES)}
+        self._dice = {structure: deque(maxlen=SHADOW_SAMPLES) for structure in self.structures}
+        self._differences = {}  # "structure.measurement" -> deque of |candidate - serving| in mm
+
+    def sample(self, inputs, masks, serving_s):
+        """Queue a comparison for a request the serving version answered in `serving_s`, if it is sampled"""
+        if random.random() >= self.fraction:
+            return
+        with self._lock:
+            if self._closed:
+                return
+            self._counts["sampled"] += 1
+            if self._backlog >= MAX_SHADOW_BACKLOG:
+                self._counts["dropped"] += 1
+                return
+            self._backlog += 1
+            # Under the lock so close() cannot shut the pool down in between
+            self._pool.submit(self._compare, list(inputs), np.stack(masks), serving_s / len(inputs))
+
+    def _compare(self, inputs, masks, serving_s):
+        try:
+            started = time.perf_counter()
+            # Bulk lane without waiting: shadow work never delays or queues behind real traffic
+            candidate = np.stack(self.scheduler.predict_many(inputs, "bulk"))
+            candidate_s = (time.perf_counter() - started) / len(inputs)
+            self._record(masks, candidate, serving_s, candidate_s)
+        except QueueFull:
+            with self._lock:
+                self._counts["dropped"] += 1
+        except Exception as e:
+            logger.warning(f"Shadow comparison failed for '{self.scheduler.name}': {str(e)}")
+            with self._lock:
+                self._counts["failed"] += 1
+        finally:
+            with self._lock:
+                self._backlog -= 1
+
+    def _record(self, masks, candidate, serving_s, candidate_s):
+        dice = {}
+        differences = {}
+        for i, structure in enumerate(self.structures):
+            serving_masks = masks[..., i] if masks.ndim == 4 else masks
+            candidate_masks = candidate[..., i] if candidate.ndim == 4 else candidate
+            dice[structure] = [_dice(a > 0.5, b > 0.5) for a, b in zip(serving_masks, candidate_masks)]
+
+            serving_values = measure_batch(serving_masks, structure)
+            candidate_values = measure_batch(candidate_masks, structure)
+            for name in MEASUREMENTS:
+                if name in serving_values:
+                    diff = np.abs(candidate_values[name] - serving_values[name])
+                    differences[f"{structure}.{name}"] = diff[np.isfinite(diff)]
+
+        with self._lock:
+            self._counts["compared"] += len(masks)
+            self._latency_ms["serving"].extend([serving_s * 1000.0] * len(masks))
+            self._latency_ms["candidate"].extend([candidate_s * 1000.0] * len(masks))
+            for structure, values in dice.items():
+                self._dice[structure].extend(values)
+            for name, values in differences.items():
+                self._differences.setdefault(name, deque(maxlen=SHADOW_SAMPLES)).extend(values.tolist())
+
+    def report(self):
+        """Counts, per-image latency of both versions, mask Dice and measurement differences (mm)"""
+        with self._lock:
+            return {
+                "fraction": self.fraction,
+                **self._counts,
+                "latency_ms": {version: _summary(list(values)) for version, values in self._latency_ms.items()},
+                "dice": {structure: _summary(list(values), 4) for structure, values in self._dice.items()},
+                "abs_difference_mm": {name: _summary(list(values)) for name, values in self._differences.items()},
+            }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._pool.shutdown(wait=False)
+
+class ShadowView:
+    """
+    The serving scheduler of a model with the same interface, also passing a sample of its requests
+    to a ShadowComparison. Callers only wait for, and only get, the serving version's masks.
+    """
+
+    def __init__(self, scheduler, comparison):
+        self.scheduler = scheduler
+        self.comparison = comparison
+
+    @property
+    def name(self):
+        return self.scheduler.name
+
+    def predict(self, input_img, priority="interactive"):
+        started = time.perf_counter()
+        mask = self.scheduler.predict(input_img, priority)
+        self.comparison.sample([input_img], [mask], time.perf_counter() - started)
+        return mask
+
+    def predict_many(self, input_imgs, priority="interactive", block=False):
+        started = time.perf_counter()
+        masks = self.scheduler.predict_many(input_imgs, priority, block)
+        if masks:
+            self.comparison.sample(input_imgs, masks, time.perf_counter() - started)
+        return masks
+
+    def check_admission(self, priority):
+        self.scheduler.check_admission(priority)
+
+    def queue_depth(self):
+        return self.scheduler.queue_depth()
+
+    def lane_stats(self):
+        return self.scheduler.lane_stats()
+
+    def stats(self):
+        return self.scheduler.stats()
@@ -0,0 +1,81 @@
+# test_app_batch.py
+# /api/analyze-brain/batch and /api/analyze-brain must report the same BPD and HC for an image:
+# both fit cv2.fitEllipse to the thresholded mask (the batch route only thresholds a chunk at once).
+# The U-Net is replaced by the dataset's mask for the image, so no weights or TensorFlow are needed.
+#
+# Usage:
+#   cd AI && python -m pytest -q test_app_batch.py
+
+import io
+import os
+import json
+import cv2
+import numpy as np
+import pytest
+
+# Nothing is loaded in the background when app.py is imported
+os.environ.setdefault("DRUEL_DEFER_WARMUP", "1")
+
+import app as brain_app
+from metrics import MEASUREMENTS, THRESHOLD_LEVELS
+from model_registry import DATASET_DIRS
+
+SAMPLES = ["Patient00168_Plane3_1_of_3.png", "Patient00188_Plane3_1_of_3.png"]
+
+class MaskScheduler:
+    """Answers every input with one fixed mask, through the scheduler interface the route uses"""
+
+    def __init__(self, mask):
+        self.mask = mask
+
+    def check_admission(self, priority):
+        pass
+
+    def predict(self, input_img, priority="interactive"):
+        return self.mask
+
+    def predict_many(self, input_imgs, priority="interactive", block=False):
+        return [self.mask for _ in input_imgs]
+
+def upload(path):
+    with open(path, "rb") as f:
+        return io.BytesIO(f.read()), os.path.basename(path)
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_batch_and_single_image_measurements_match(monkeypatch, name):
+    image_dir, mask_dir = DATASET_DIRS["brain"]
+    mask = cv2.imread(os.path.join(mask_dir, name), cv2.IMREAD_GRAYSCALE).astype(np.float32) / 255.0
+    monkeypatch.setattr(brain_app, "is_ready", lambda model: True)
+    monkeypatch.setattr(brain_app, "get_scheduler", lambda model: MaskScheduler(mask))
+    client = brain_app.app.test_client()
+    path = os.path.join(image_dir, name)
+
+    single = client.post("/api/analyze-brain", data={"gestationalAge": "20", "image": upload(path)},
+                         content_type="multipart/form-data")
+    batch = client.post("/api/analyze-brain/batch", data={"gestationalAge": "20", "images": [upload(path)]},
+                        content_type="multipart/form-data")
+
+    assert single.status_code == 200
+    lines = [json.loads(line) for line in batch.get_data(as_text=True).splitlines()]
+    assert lines[-1] == {"done": True, "count": 1, "errors": 0}
+    single_report, batch_report = single.get_json(), lines[0]
+    assert batch_report["bpd_mm"] == single_report["bpd_mm"]
+    assert batch_report["hc_mm"] == single_report["hc_mm"]
+
+def test_batch_items_are_counted_in_metrics(monkeypatch):
+    image_dir, mask_dir = DATASET_DIRS["brain"]
+    mask = cv2.imread(os.path.join(mask_dir, SAMPLES[0]), cv2.IMREAD_GRAYSCALE).astype(np.float32) / 255.0
+    monkeypatch.setattr(brain_app, "is_ready", lambda model: True)
+    monkeypatch.setattr(brain_app, "get_scheduler", lambda model: MaskScheduler(mask))
+    measured = MEASUREMENTS._values.get(("brain",), 0)
+    level_0 = THRESHOLD_LEVELS._values.get(("brain", "0"), 0)
+
+    # A distinct upload, so the result cache cannot answer it
+    encoded = cv2.imencode(".png", cv2.imread(os.path.join(image_dir, SAMPLES[0]), cv2.IMREAD_GRAYSCALE) // 2)[1]
+    response = brain_app.app.test_client().post(
+        "/api/analyze-brain/batch", data={"gestationalAge": "20", "images": [(io.BytesIO(encoded.tobytes()), "a.png")]},
+        content_type="multipart/form-data")
+
+    assert json.loads(response.get_data(as_text=True).splitlines()[-1])["errors"] == 0
+    assert MEASUREMENTS._values[("brain",)] == measured + 1
+    assert THRESHOLD_LEVELS._values[("brain", "0")] == level_0 + 1
@@ -0,0 +1,55 @@
+# test_biometry.py
+# measure_batch (moments of the filled largest contour) against the single-image fits on the
+# dataset's masks. The ventricular width is the same bounding box and must match exactly; the
+# ellipse axes are estimated differently, so BPD, HC and TCD are held to the typical (median)
+# difference measured on these masks, with some headroom.
+#
+# Usage:
+#   cd AI && python -m pytest -q test_biometry.py
+
+import os
+import glob
+import cv2
+import numpy as np
+import pytest
+from biometry import measure_batch
+from fetal_brain_diagnosis import fit_bpd_and_hc
+from fetal_cerebellum_diagnosis import fit_tcd
+from fetal_ventricular_diagnosis import fit_lvw
+from model_registry import DATASET_DIRS
+
+# Largest median relative difference accepted (measured: BPD 9%, HC 7%, TCD 6%)
+MEDIAN_TOLERANCE = {"bpd_mm": 0.15, "hc_mm": 0.12, "tcd_mm": 0.1}
+
+def dataset_masks(structure):
+    paths = sorted(glob.glob(os.path.join(DATASET_DIRS[structure][1], "*.png")))
+    if not paths:
+        pytest.skip(f"No {structure} masks in the dataset")
+    return np.stack([cv2.imread(path, cv2.IMREAD_GRAYSCALE).astype(np.float32) / 255.0 for path in paths])
+
+def single_image(structure, mask):
+    """The values the analysis endpoints report for `mask`"""
+    if structure == "brain":
+        bpd_mm, hc_mm, _ = fit_bpd_and_hc(mask, np.zeros(mask.shape, np.uint8))
+        return {"bpd_mm": bpd_mm, "hc_mm": hc_mm}
+    if structure == "cerebellum":
+        return {"tcd_mm": fit_tcd(mask)[0]}
+    return {"lvw_mm": fit_lvw(mask)[0]}
+
+def relative_differences(structure):
+    masks = dataset_masks(structure)
+    batch = measure_batch(masks, structure)
+    fits = [single_image(structure, mask) for mask in masks]
+    differences = {}
+    for name in fits[0]:
+        reference = np.array([fit[name] for fit in fits], dtype=np.float64)
+        differences[name] = np.abs(batch[name] - reference) / reference
+    return differences
+
+def test_ventricular_width_matches_fit_lvw():
+    assert relative_differences("ventricular")["lvw_mm"].max() == 0
+
+@pytest.mark.parametrize("structure", ["brain", "cerebellum"])
+def test_ellipse_measurements_are_close_to_the_fits(structure):
+    for name, differences in relative_differences(structure).items():
+        assert np.median(differences) <= MEDIAN_TOLERANCE[name], name
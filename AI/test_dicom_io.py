@@ -0,0 +1,77 @@
+# test_dicom_io.py
+# Pixel spacing from a DICOM header is kept per axis: the frame is squashed to 128x128 without
+# keeping its aspect ratio, so a mask pixel covers a different distance across than down.
+#
+# Usage:
+#   cd AI && python -m pytest -q test_dicom_io.py
+
+import io
+import numpy as np
+import pytest
+from dicom_io import header_pixel_spacing, load_scan, measurement_spacing, pipeline_spacings
+from fetal_brain_diagnosis import preprocess_image
+from fetal_ventricular_diagnosis import fit_lvw
+
+pydicom = pytest.importorskip("pydicom")
+
+# Frame size and (x, y) spacing in mm of the synthetic scan; the bright bar is BAR_WIDTH pixels across
+WIDTH, HEIGHT = 640, 392
+SPACING = (0.2, 0.3)
+BAR_WIDTH = 200
+
+def bar_frame():
+    img = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    x0, y0 = 180, 150
+    img[y0:y0 + 60, x0:x0 + BAR_WIDTH] = 255
+    return img
+
+def dicom_bytes(img, pixel_spacing):
+    """`img` written as a single-frame DICOM file with PixelSpacing (row, column) = `pixel_spacing`"""
+    from pydicom.dataset import FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, UltrasoundImageStorage, generate_uid
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = UltrasoundImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = pydicom.Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID, ds.SOPInstanceUID = meta.MediaStorageSOPClassUID, meta.MediaStorageSOPInstanceUID
+    ds.Rows, ds.Columns = img.shape
+    ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 8, 8, 7, 0
+    ds.PixelSpacing = list(pixel_spacing)
+    ds.PixelData = img.tobytes()
+    buffer = io.BytesIO()
+    ds.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+def test_header_spacing_is_read_per_axis():
+    ds = pydicom.Dataset()
+    ds.PixelSpacing = [0.3, 0.2]
+    assert header_pixel_spacing(ds) == (0.2, 0.3)
+
+    region = pydicom.Dataset()
+    region.PhysicalUnitsXDirection = region.PhysicalUnitsYDirection = 3
+    region.PhysicalDeltaX, region.PhysicalDeltaY = 0.02, 0.03
+    ds = pydicom.Dataset()
+    ds.SequenceOfUltrasoundRegions = [region]
+    assert header_pixel_spacing(ds) == pytest.approx((0.2, 0.3))
+
+def test_mask_spacing_follows_each_axis():
+    mask_spacing, source_spacing = pipeline_spacings(SPACING, (HEIGHT, WIDTH))
+    assert source_spacing == SPACING
+    assert mask_spacing == pytest.approx((0.2 * WIDTH / 128, 0.3 * HEIGHT / 128))
+    # PNG/JPEG keep the 0.3 mm default per mask pixel on both axes
+    assert pipeline_spacings(None, (HEIGHT, WIDTH))[0] == (0.3, 0.3)
+
+def test_lvw_of_a_non_square_dicom_frame():
+    img, spacing = load_scan(dicom_bytes(bar_frame(), (SPACING[1], SPACING[0])))
+    assert spacing == pytest.approx(SPACING)
+
+    mask = (preprocess_image(img)[..., 0] > 0.5).astype(np.float32)
+    mask_spacing, _ = pipeline_spacings(spacing, img.shape)
+    lvw_mm, _ = fit_lvw(mask, pixel_spacing=measurement_spacing(mask_spacing, "ventricular"))
+
+    # One mask pixel of rounding at the bar's edges
+    assert lvw_mm == pytest.approx(BAR_WIDTH * SPACING[0], abs=mask_spacing[0])
@@ -0,0 +1,24 @@
+# test_result_cache.py
+# The on-disk tier's byte count must follow the files actually kept: overwriting an entry
+# replaces its file, so only the change in size counts against the budget.
+#
+# Usage:
+#   cd AI && python -m pytest -q test_result_cache.py
+
+import os
+import numpy as np
+from result_cache import ResultCache
+
+def disk_usage(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+def test_overwritten_entries_are_counted_once(tmp_path):
+    cache = ResultCache(max_bytes=1024 * 1024, disk_dir=str(tmp_path), disk_max_bytes=1024 * 1024)
+    cache.put("mask", "a", np.zeros((128, 128), np.float32))
+    cache.put("mask", "b", np.zeros((128, 128), np.float32))
+    for _ in range(20):
+        cache.put("mask", "a", np.ones((128, 128), np.float32))
+    cache.put("measurement", "a", {"bpd_mm": 40.0})
+    cache.put("measurement", "a", {"bpd_mm": 41.25, "hc_mm": 150.5})
+
+    assert cache.stats()["disk"]["bytes"] == disk_usage(tmp_path)
@@ -0,0 +1,63 @@
+# test_roi_refinement.py
+# The coarse (128x128 mask) and refined (ROI crop) measurements of the same scan must agree:
+# both are converted to mm with the spacings from dicom_io.pipeline_spacings and measurement_spacing.
+#
+# Usage:
+#   python -m pytest -q test_roi_refinement.py
+
+import cv2
+import numpy as np
+import pytest
+from dicom_io import measurement_spacing, pipeline_spacings
+from fetal_brain_diagnosis import calculate_bpd_and_hc_from_mask, preprocess_image
+from fetal_cerebellum_diagnosis import fit_tcd
+from roi_refinement import FALLBACK_NO_FIT, FALLBACK_NO_ROI, refine_bpd_and_hc, refine_fields, refine_tcd
+
+# Relative difference allowed between the coarse and refined values
+TOLERANCE = 0.1
+
+def synthetic_scan(width=640, height=392, axes=(150, 110), angle=20):
+    """Dark frame with one bright filled ellipse, off-centre and rotated by `angle` degrees"""
+    img = np.zeros((height, width), dtype=np.uint8)
+    cv2.ellipse(img, (width // 2 + 40, height // 2 - 10), axes, angle, 0, 360, 255, thickness=-1)
+    return img
+
+def predict(input_img):
+    """Stands in for the U-Net: the bright pixels of the preprocessed input"""
+    return (input_img[..., 0] > 0.5).astype(np.float32)
+
+@pytest.mark.parametrize("shape", [(640, 392), (800, 600), (256, 256)])
+def test_bpd_and_hc_coarse_and_refined_agree(shape):
+    img = synthetic_scan(*shape, axes=(shape[0] // 4, shape[1] // 4))
+    mask_spacing, source_spacing = (measurement_spacing(s, "brain") for s in pipeline_spacings(None, img.shape))
+    coarse_mask = predict(preprocess_image(img))
+
+    bpd, hc, _, _, _ = calculate_bpd_and_hc_from_mask(coarse_mask, img, pixel_spacing=mask_spacing)
+    refined_bpd, refined_hc, ellipse, roi = refine_bpd_and_hc(img, coarse_mask, predict, pixel_spacing=source_spacing)
+
+    assert roi is not None and ellipse is not None
+    assert refined_bpd == pytest.approx(bpd, rel=TOLERANCE)
+    assert refined_hc == pytest.approx(hc, rel=TOLERANCE)
+
+def test_tcd_coarse_and_refined_agree():
+    # TCD is converted with the x spacing: its axis runs across the frame, as in the dataset's masks
+    img = synthetic_scan(axes=(60, 110), angle=5)
+    mask_spacing, source_spacing = (measurement_spacing(s, "cerebellum") for s in pipeline_spacings(None, img.shape))
+    coarse_mask = predict(preprocess_image(img))
+
+    tcd, _ = fit_tcd(coarse_mask, pixel_spacing=mask_spacing)
+    refined_tcd, _, roi = refine_tcd(img, coarse_mask, predict, pixel_spacing=source_spacing)
+
+    assert roi is not None
+    assert refined_tcd == pytest.approx(tcd, rel=TOLERANCE)
+
+def test_refine_without_a_fit_falls_back():
+    img = synthetic_scan()
+    coarse_mask = predict(preprocess_image(img))
+
+    # The cerebellum fit has no classical fallback: an empty refined mask gives no ellipse
+    tcd, ellipse, roi = refine_tcd(img, coarse_mask, lambda x: np.zeros(x.shape[:2], np.float32))
+
+    assert roi is not None and tcd is None
+    assert refine_fields(roi, refined=False) == {"roi": None, "refine_fallback": FALLBACK_NO_FIT}
+    assert refine_fields(None, refined=False)["refine_fallback"] == FALLBACK_NO_ROI
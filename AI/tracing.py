@@ -0,0 +1,122 @@
+# tracing.py
+# Per-request traces: a request/trace ID taken from the caller (or generated), timed spans for each
+# pipeline stage, an optional "trace" field in the response and a rotating JSON-lines trace log
+
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import logging.handlers
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from metrics import STAGE_LATENCY
+
+# Sent by the Node controllers; echoed back on every response
+TRACE_HEADER = "X-Request-ID"
+SCAN_HEADER = "X-Scan-ID"
+# "1" asks for the span breakdown in the JSON response body
+INCLUDE_TRACE_HEADER = "X-Include-Trace"
+
+# JSON-lines trace log ("" disables it), rotated by size
+TRACE_LOG = os.environ.get("DRUEL_TRACE_LOG", "logs/trace.jsonl")
+TRACE_LOG_MAX_BYTES = int(os.environ.get("DRUEL_TRACE_LOG_MAX_MB", "50")) * 1024 * 1024
+TRACE_LOG_BACKUPS = int(os.environ.get("DRUEL_TRACE_LOG_BACKUPS", "5"))
+
+_current = ContextVar("druel_trace", default=None)
+_trace_logger = None
+_trace_logger_lock = threading.Lock()
+
+class Trace:
+    def __init__(self, trace_id, scan_id=None, route=None):
+        self.trace_id = trace_id
+        self.scan_id = scan_id
+        self.route = route
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.spans = []
+        self.status = None
+        self.duration_ms = None
+
+    def add_span(self, stage, model, started, duration):
+        self.spans.append({
+            "stage": stage,
+            "model": model,
+            "start_ms": round((started - self.started) * 1000.0, 3),
+            "duration_ms": round(duration * 1000.0, 3),
+        })
+
+    def finish(self, status=None):
+        if status is not None:
+            self.status = status
+        self.duration_ms = round((time.perf_counter() - self.started) * 1000.0, 3)
+
+    def to_dict(self):
+        by_stage = {}
+        for s in self.spans:
+            by_stage[s["stage"]] = round(by_stage.get(s["stage"], 0.0) + s["duration_ms"], 3)
+        elapsed_ms = self.duration_ms
+        if elapsed_ms is None:
+            elapsed_ms = round((time.perf_counter() - self.started) * 1000.0, 3)
+        return {
+            "trace_id": self.trace_id,
+            "scan_id": self.scan_id,
+            "route": self.route,
+            "timestamp": round(self.timestamp, 3),
+            "status": self.status,
+            "duration_ms": elapsed_ms,
+            "stages_ms": by_stage,
+            "spans": list(self.spans),
+        }
+
+def start_trace(trace_id=None, scan_id=None, route=None):
+    """Begin the current request's trace; a new ID is generated when the caller sent none"""
+    trace = Trace(trace_id or uuid.uuid4().hex, scan_id, route)
+    _current.set(trace)
+    return trace
+
+def current_trace():
+    return _current.get()
+
+def end_trace():
+    _current.set(None)
+
+@contextmanager
+def span(model, stage):
+    """Time a pipeline stage: recorded in druel_stage_duration_seconds and as a span of the current trace"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_LATENCY.observe(duration, model, stage)
+        trace = _current.get()
+        if trace is not None:
+            trace.add_span(stage, model, started, duration)
+
+def _get_trace_logger():
+    """JSON-lines logger whose file writes happen on a listener thread, not in the request"""
+    global _trace_logger
+    with _trace_logger_lock:
+        if _trace_logger is None:
+            _trace_logger = _create_trace_logger()
+        return _trace_logger
+
+def _create_trace_logger():
+    logger = logging.getLogger("druel.trace")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    os.makedirs(os.path.dirname(TRACE_LOG) or ".", exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        TRACE_LOG, maxBytes=TRACE_LOG_MAX_BYTES, backupCount=TRACE_LOG_BACKUPS)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    records = queue.Queue(-1)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logging.handlers.QueueListener(records, handler).start()
+    return logger
+
+def write_trace(trace):
+    if TRACE_LOG:
+        _get_trace_logger().info(json.dumps(trace.to_dict()))
@@ -1,12 +1,10 @@
 # train_model.py
 
-import os
-import numpy as np
-import cv2
 from tensorflow.keras.models import Model
 from tensorflow.keras.layers import Input, Conv2D, MaxPooling2D, UpSampling2D, concatenate
 from tensorflow.keras.callbacks import ModelCheckpoint
 from tensorflow.keras.optimizers import Adam
+from training_pipeline import BATCH_SIZE, ThroughputCallback, build_datasets
 
 # U-Net Architecture
 def build_unet(input_size=(128, 128, 1)):
@@ -32,34 +30,13 @@ def build_unet(input_size=(128, 128, 1)):
     model.compile(optimizer=Adam(), loss='binary_crossentropy', metrics=['accuracy'])
     return model
 
-# Preprocessing
-def preprocess_image(img):
-    img = cv2.resize(img, (128, 128))
-    img = cv2.equalizeHist(img)
-    img = img / 255.0
-    return img.reshape(128, 128, 1)
-
-# Load Data
-def load_training_data(image_folder, mask_folder):
-    X, y = [], []
-    for fname in os.listdir(image_folder):
-        if fname.endswith(".png"):
-            img_path = os.path.join(image_folder, fname)
-            mask_path = os.path.join(mask_folder, fname)
-            img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-            mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
-            if img is None or mask is None:
-                continue
-            X.append(preprocess_image(img))
-            y.append(preprocess_image(mask))
-    return np.array(X), np.array(y)
-
-# Train Model
-def train_unet_model(image_folder, mask_folder):
-    X, y = load_training_data(image_folder, mask_folder)
+# Train Model (data streamed through the shared tf.data pipeline)
+def train_unet_model(image_folder, mask_folder, batch_size=BATCH_SIZE):
+    train_ds, val_ds, num_images = build_datasets(image_folder, mask_folder, batch_size=batch_size)
     model = build_unet()
     checkpoint = ModelCheckpoint("./models/unet_brain_seg.h5", monitor='val_loss', save_best_only=True)
-    model.fit(X, y, validation_split=0.2, epochs=20, batch_size=8, callbacks=[checkpoint])
+    model.fit(train_ds, validation_data=val_ds, epochs=20,
+              callbacks=[checkpoint, ThroughputCallback(num_images)])
     return model
 
 # Run Training
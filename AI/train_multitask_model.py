@@ -0,0 +1,21 @@
+# train_multitask_model.py
+# Train the multi-task U-Net (one shared encoder, a decoder head per structure)
+# on the thalamic, cerebellum and ventricular datasets together
+
+from tensorflow.keras.callbacks import ModelCheckpoint
+from model_registry import DATASET_DIRS, MULTITASK_HEADS, MULTITASK_MODEL_PATH
+from training_pipeline import BATCH_SIZE, ThroughputCallback, build_multitask_datasets
+from unet import build_multitask_unet
+
+def train_multitask_model(batch_size=BATCH_SIZE, epochs=20):
+    # Each plane only has masks for its own structure, so every batch trains a single head
+    train_ds, val_ds, num_images = build_multitask_datasets(DATASET_DIRS, MULTITASK_HEADS, batch_size=batch_size)
+    model = build_multitask_unet(MULTITASK_HEADS)
+    checkpoint = ModelCheckpoint(MULTITASK_MODEL_PATH, monitor='val_loss', save_best_only=True)
+    model.fit(train_ds, validation_data=val_ds, epochs=epochs,
+              callbacks=[checkpoint, ThroughputCallback(num_images)])
+    print(f"Model trained and saved to {MULTITASK_MODEL_PATH}")
+    return model
+
+if __name__ == "__main__":
+    train_multitask_model()
@@ -1,19 +1,16 @@
 # train_ventricular_model.py
 # Train U-Net model to segment lateral ventricles in Trans-ventricular ultrasound images
 
-import os
-import cv2
-import numpy as np
 from tensorflow.keras.models import Model
 from tensorflow.keras.layers import Input, Conv2D, MaxPooling2D, UpSampling2D, concatenate
 from tensorflow.keras.callbacks import ModelCheckpoint
 from tensorflow.keras.optimizers import Adam
+from training_pipeline import BATCH_SIZE, ThroughputCallback, build_datasets
 
 # Paths
 IMAGE_FOLDER = "./dataset/Trans_ventricular_images"
 MASK_FOLDER = "./dataset/Trans_ventricular_masks"
 MODEL_PATH = "./models/unet_ventricular_seg.h5"
-IMG_SIZE = (128, 128)
 
 # U-Net Architecture
 def build_unet(input_size=(128, 128, 1)):
@@ -46,37 +43,14 @@ def build_unet(input_size=(128, 128, 1)):
     model.compile(optimizer=Adam(), loss='binary_crossentropy', metrics=['accuracy'])
     return model
 
-# Preprocessing
-def preprocess_image(img):
-    img = cv2.resize(img, IMG_SIZE)
-    img = cv2.equalizeHist(img)
-    img = img / 255.0
-    return img.reshape(128, 128, 1)
-
-# Load Data
-def load_data():
-    X, y = [], []
-    for fname in os.listdir(IMAGE_FOLDER):
-        img_path = os.path.join(IMAGE_FOLDER, fname)
-        mask_path = os.path.join(MASK_FOLDER, fname)
-
-        img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-        mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
-
-        if img is None or mask is None:
-            continue
-
-        X.append(preprocess_image(img))
-        y.append(preprocess_image(mask))
-
-    return np.array(X), np.array(y)
-
 # Train Model
-def train_model():
-    X, y = load_data()
+def train_model(batch_size=BATCH_SIZE):
+    # Data is streamed through the shared tf.data pipeline
+    train_ds, val_ds, num_images = build_datasets(IMAGE_FOLDER, MASK_FOLDER, batch_size=batch_size)
     model = build_unet()
     checkpoint = ModelCheckpoint(MODEL_PATH, monitor='val_loss', save_best_only=True)
-    model.fit(X, y, validation_split=0.2, epochs=20, batch_size=8, callbacks=[checkpoint])
+    model.fit(train_ds, validation_data=val_ds, epochs=20,
+              callbacks=[checkpoint, ThroughputCallback(num_images)])
     print(f"Model trained and saved to {MODEL_PATH}")
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+# training_pipeline.py
+# Streaming tf.data input pipeline shared by the three training scripts:
+# parallel decode, on-the-fly augmentation, prefetching and images/sec reporting
+
+import os
+import time
+import cv2
+import numpy as np
+import tensorflow as tf
+from dataset_cache import DatasetCache, list_pairs
+from fetal_brain_diagnosis import preprocess_image
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+BATCH_SIZE = int(os.environ.get("DRUEL_TRAIN_BATCH_SIZE", "8"))
+VALIDATION_SPLIT = 0.2
+SHUFFLE_SEED = 42
+
+# Read preprocessed pairs from the memory-mapped dataset cache instead of decoding PNGs every epoch
+USE_DATASET_CACHE = os.environ.get("DRUEL_DATASET_CACHE", "1") == "1"
+
+def _load_pair(image_path, mask_path):
+    """Decode and preprocess one pair exactly like the serving path (preprocess_image)"""
+    img = cv2.imread(image_path.decode(), cv2.IMREAD_GRAYSCALE)
+    mask = cv2.imread(mask_path.decode(), cv2.IMREAD_GRAYSCALE)
+    if img is None or mask is None:
+        # Unreadable pairs are filtered out downstream
+        empty = np.full((128, 128, 1), -1.0, dtype=np.float32)
+        return empty, empty
+    return preprocess_image(img).astype(np.float32), preprocess_image(mask).astype(np.float32)
+
+def _decode(image_path, mask_path):
+    # cv2 releases the GIL, so AUTOTUNE-parallel numpy_function calls decode on several cores
+    img, mask = tf.numpy_function(_load_pair, [image_path, mask_path], [tf.float32, tf.float32])
+    img.set_shape((128, 128, 1))
+    mask.set_shape((128, 128, 1))
+    return img, mask
+
+def _is_valid(img, mask):
+    return tf.reduce_min(img) >= 0.0
+
+def augment(img, mask):
+    """Random flips (applied to image and mask together) and brightness/contrast jitter (image only)"""
+    if tf.random.uniform(()) < 0.5:
+        img = tf.image.flip_left_right(img)
+        mask = tf.image.flip_left_right(mask)
+    img = tf.image.random_brightness(img, 0.1)
+    img = tf.image.random_contrast(img, 0.9, 1.1)
+    return tf.clip_by_value(img, 0.0, 1.0), mask
+
+def _array_rows(images, masks):
+    """Map from row index to (image, mask), reading straight from (memory-mapped) arrays"""
+    def load_row(i):
+        img, mask = images[i], masks[i]
+        if img.dtype == np.uint8:
+            return img.astype(np.float32) / 255.0, mask.astype(np.float32) / 255.0
+        return np.asarray(img, dtype=np.float32), np.asarray(mask, dtype=np.float32)
+
+    def read(i):
+        img, mask = tf.numpy_function(load_row, [i], [tf.float32, tf.float32])
+        img.set_shape((128, 128, 1))
+        mask.set_shape((128, 128, 1))
+        return img, mask
+    return read
+
+def make_dataset(pairs, batch_size=BATCH_SIZE, training=True, indices=None):
+    """
+    tf.data pipeline over (image paths, mask paths) lists or preprocessed (images, masks) arrays.
+    Arrays are read row by row (restricted to `indices` when given), so memory-mapped arrays are
+    never copied into the graph. Training datasets are shuffled every epoch and augmented.
+    """
+    images, masks = pairs
+    if isinstance(images, (list, tuple)):
+        ds = tf.data.Dataset.from_tensor_slices((images, masks))
+    else:
+        rows = np.arange(len(images)) if indices is None else np.asarray(indices)
+        ds = tf.data.Dataset.from_tensor_slices(rows.astype(np.int64))
+    if training:
+        ds = ds.shuffle(len(ds), seed=SHUFFLE_SEED, reshuffle_each_iteration=True)
+
+    if isinstance(images, (list, tuple)):
+        ds = ds.map(_decode, num_parallel_calls=AUTOTUNE, deterministic=not training)
+        ds = ds.filter(_is_valid)
+    else:
+        ds = ds.map(_array_rows(images, masks), num_parallel_calls=AUTOTUNE, deterministic=not training)
+
+    if training:
+        ds = ds.map(augment, num_parallel_calls=AUTOTUNE)
+    return ds.batch(batch_size).prefetch(AUTOTUNE)
+
+def split_indices(n, validation_split=VALIDATION_SPLIT):
+    """Deterministic shuffled (train, validation) row indices"""
+    order = np.random.default_rng(SHUFFLE_SEED).permutation(n)
+    n_val = int(len(order) * validation_split)
+    return order[n_val:], order[:n_val]
+
+def split_pairs(image_paths, mask_paths, validation_split=VALIDATION_SPLIT):
+    """Deterministic shuffled train/validation split of the pair lists"""
+    train_idx, val_idx = split_indices(len(image_paths), validation_split)
+    pick = lambda items, idx: [items[i] for i in idx]
+    return ((pick(image_paths, train_idx), pick(mask_paths, train_idx)),
+            (pick(image_paths, val_idx), pick(mask_paths, val_idx)))
+
+def build_datasets(image_folder, mask_folder, batch_size=BATCH_SIZE, validation_split=VALIDATION_SPLIT,
+                   use_cache=USE_DATASET_CACHE):
+    """
+    Train and validation datasets for one plane.
+    Returns (train_ds, val_ds, number of training images).
+    """
+    if use_cache:
+        images, masks, _ = DatasetCache().load(image_folder, mask_folder)
+        train_idx, val_idx = split_indices(len(images), validation_split)
+        return (make_dataset((images, masks), batch_size, training=True, indices=train_idx),
+                make_dataset((images, masks), batch_size, training=False, indices=val_idx),
+                len(train_idx))
+
+    train_pairs, val_pairs = split_pairs(*list_pairs(image_folder, mask_folder), validation_split)
+    return (make_dataset(train_pairs, batch_size, training=True),
+            make_dataset(val_pairs, batch_size, training=False),
+            len(train_pairs[0]))
+
+def _head_targets(head, heads):
+    """(images, masks) batch of one plane -> (images, {output: masks}, {output: sample weights})"""
+    def to_targets(img, mask):
+        zeros = tf.zeros_like(mask)
+        ones, no_weight = tf.ones(tf.shape(img)[:1]), tf.zeros(tf.shape(img)[:1])
+        targets = {f"{h}_mask": mask if h == head else zeros for h in heads}
+        weights = {f"{h}_mask": ones if h == head else no_weight for h in heads}
+        return img, targets, weights
+    return to_targets
+
+def build_multitask_datasets(dataset_dirs, heads, batch_size=BATCH_SIZE, validation_split=VALIDATION_SPLIT):
+    """
+    Train and validation datasets for the multi-task U-Net from each head's own dataset.
+    Every batch comes from one plane and only that head's loss is weighted; training batches
+    are drawn from the planes in proportion to their size.
+    Returns (train_ds, val_ds, number of training images).
+    """
+    train_sets, val_sets, sizes = [], [], []
+    for head in heads:
+        train_ds, val_ds, n = build_datasets(*dataset_dirs[head], batch_size=batch_size,
+                                             validation_split=validation_split)
+        train_sets.append(train_ds.map(_head_targets(head, heads)))
+        val_sets.append(val_ds.map(_head_targets(head, heads)))
+        sizes.append(n)
+
+    total = sum(sizes)
+    train_ds = tf.data.Dataset.sample_from_datasets(
+        train_sets, weights=[n / total for n in sizes], seed=SHUFFLE_SEED)
+    val_ds = val_sets[0]
+    for ds in val_sets[1:]:
+        val_ds = val_ds.concatenate(ds)
+    return train_ds.prefetch(AUTOTUNE), val_ds.prefetch(AUTOTUNE), total
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """Reports training images per second for every epoch, validation included (also added to the epoch logs)"""
+
+    def __init__(self, num_images):
+        super().__init__()
+        self.num_images = num_images
+        self._started = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._started = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self._started
+        images_per_sec = self.num_images / elapsed if elapsed > 0 else 0.0
+        if logs is not None:
+            logs["images_per_sec"] = images_per_sec
+        print(f"Epoch {epoch + 1}: {images_per_sec:.1f} images/sec ({self.num_images} images in {elapsed:.1f}s)")
@@ -0,0 +1,58 @@
+# unet.py
+# U-Net architecture shared by the brain, cerebellum and ventricular models,
+# plus a multi-task variant with one shared encoder and a decoder head per structure
+
+from tensorflow.keras.models import Model
+from tensorflow.keras.layers import Input, Conv2D, MaxPooling2D, UpSampling2D, concatenate, Concatenate
+from tensorflow.keras.optimizers import Adam
+
+# Same U-Net architecture as in training
+def build_unet(input_size=(128, 128, 1), compile=True):
+    inputs = Input(input_size)
+    # Same layers in the same order as the training scripts' build_unet, and the output layer keeps
+    # its default name, so load_weights() reads the existing .h5 files unchanged
+    outputs = _decoder(*_encoder(inputs))
+    model = Model(inputs, outputs)
+    # Serving skips compile: inference never needs the optimizer or loss
+    if compile:
+        model.compile(optimizer=Adam(), loss='binary_crossentropy', metrics=['accuracy'])
+    return model
+
+def _encoder(inputs):
+    c1 = Conv2D(64, (3, 3), activation='relu', padding='same')(inputs)
+    c1 = Conv2D(64, (3, 3), activation='relu', padding='same')(c1)
+    p1 = MaxPooling2D((2, 2))(c1)
+    c2 = Conv2D(128, (3, 3), activation='relu', padding='same')(p1)
+    c2 = Conv2D(128, (3, 3), activation='relu', padding='same')(c2)
+    p2 = MaxPooling2D((2, 2))(c2)
+    c3 = Conv2D(256, (3, 3), activation='relu', padding='same')(p2)
+    c3 = Conv2D(256, (3, 3), activation='relu', padding='same')(c3)
+    return c1, c2, c3
+
+def _decoder(c1, c2, c3, name=None):
+    """Decoder on the _encoder skips; the output is named "<name>_mask" (Keras' default without `name`)"""
+    u1 = UpSampling2D((2, 2))(c3)
+    u1 = concatenate([u1, c2])
+    c4 = Conv2D(128, (3, 3), activation='relu', padding='same')(u1)
+    c4 = Conv2D(128, (3, 3), activation='relu', padding='same')(c4)
+    u2 = UpSampling2D((2, 2))(c4)
+    u2 = concatenate([u2, c1])
+    c5 = Conv2D(64, (3, 3), activation='relu', padding='same')(u2)
+    c5 = Conv2D(64, (3, 3), activation='relu', padding='same')(c5)
+    return Conv2D(1, (1, 1), activation='sigmoid', name=f"{name}_mask" if name else None)(c5)
+
+# Multi-task U-Net: the build_unet encoder is computed once and feeds one decoder per head.
+# Outputs are named "<head>_mask", in `heads` order.
+def build_multitask_unet(heads, input_size=(128, 128, 1), compile=True):
+    inputs = Input(input_size)
+    c1, c2, c3 = _encoder(inputs)
+    outputs = [_decoder(c1, c2, c3, head) for head in heads]
+    model = Model(inputs, outputs)
+    if compile:
+        model.compile(optimizer=Adam(), loss='binary_crossentropy',
+                      metrics={f"{head}_mask": ['accuracy'] for head in heads})
+    return model
+
+def stack_heads(model):
+    """Single-output view of a multi-task model: (N, 128, 128, heads) with one channel per head"""
+    return Model(model.input, Concatenate(axis=-1)(model.outputs))
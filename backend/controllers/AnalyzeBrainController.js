@@ -4,6 +4,11 @@ const FormData = require("form-data");
 const fs = require("fs");
 const scanService = require("../services/ScanService");
 const fileSystemService = require("../services/FileSystemService");
+const { traceHeaders, logTrace } = require("../services/AITraceService");
+const { storeAnnotatedImage } = require("../services/AnnotationService");
+
+// Point all three at the same port when the AI runs as a single server (AI/server.py)
+const AI_URL = process.env.BRAIN_AI_URL || "http://127.0.0.1:4000";
 
 exports.analyzeBrainScan = async (req, res) => {
   try {
@@ -35,32 +40,41 @@ exports.analyzeBrainScan = async (req, res) => {
     const form = new FormData();
     form.append("image", fs.createReadStream(imagePath));
     form.append("gestationalAge", gestAge);
+    // Optional "refine": coarse-to-fine ROI measurement (see AI/roi_refinement.py)
+    if (req.body.measurementMode) {
+      form.append("measurementMode", req.body.measurementMode);
+    }
 
     // Send to Flask API
     const startTime = Date.now();
-    const flaskResponse = await axios.post("http://127.0.0.1:4000/api/analyze-brain", form, {
+    const flaskResponse = await axios.post(`${AI_URL}/api/analyze-brain`, form, {
       headers: {
         ...form.getHeaders(),
+        ...traceHeaders(scanId),
       },
     });
     const processingTime = (Date.now() - startTime) / 1000; // Convert to seconds
+    const { trace, annotation_url, ...analysis } = flaskResponse.data;
+    logTrace("brain", scanId, trace, processingTime);
 
     // Clean up temp file
     fs.unlinkSync(imagePath);
 
     // Add processing time to the response data
     const reportData = {
-      ...flaskResponse.data,
-      processing_time: processingTime
+      ...analysis,
+      processing_time: processingTime,
+      trace_id: trace?.trace_id
     };
 
     // Save AI report results to database
     const reportId = await scanService.saveAIReport(scanId, reportData);
 
-    // In a real system, we would also save annotated images here
-    // For now, we'll mock this with placeholder path
-    const annotationPath = savedImage.relativePath.replace('.jpg', '_annotated.jpg');
-    await scanService.saveAnnotatedImage(reportId, imageId, annotationPath);
+    // Annotated overlay rendered by the AI service from its cache (no second inference)
+    const annotationPath = await storeAnnotatedImage(AI_URL, annotation_url, savedImage, reportId, gestAge);
+    if (annotationPath) {
+      await scanService.saveAnnotatedImage(reportId, imageId, annotationPath);
+    }
 
     // Return complete response
     res.json({
@@ -70,7 +84,8 @@ exports.analyzeBrainScan = async (req, res) => {
         scanId,
         imageId,
         reportId,
-        imagePath: savedImage.relativePath
+        imagePath: savedImage.relativePath,
+        annotationPath
       }
     });
 
@@ -81,6 +96,11 @@ exports.analyzeBrainScan = async (req, res) => {
     console.error("Response data:", err.response.data);
     console.error("Response status:", err.response.status);
   }
+    // The AI service is overloaded: pass its 429 and Retry-After on so the client can back off
+    if (err.response && err.response.status === 429) {
+      res.set("Retry-After", err.response.headers["retry-after"] || "5");
+      return res.status(429).json({ success: false, error: "AI service is busy. Please retry shortly." });
+    }
     res.status(500).json({ success: false, error: "Image analysis failed." });
   }
 };
\ No newline at end of file
@@ -4,6 +4,11 @@ const FormData = require("form-data");
 const fs = require("fs");
 const scanService = require("../services/ScanService");
 const fileSystemService = require("../services/FileSystemService");
+const { traceHeaders, logTrace } = require("../services/AITraceService");
+const { storeAnnotatedImage } = require("../services/AnnotationService");
+
+// Point all three at the same port when the AI runs as a single server (AI/server.py)
+const AI_URL = process.env.CEREBELLUM_AI_URL || "http://127.0.0.1:4001";
 
 exports.analyzeCerebellum = async (req, res) => {
   try {
@@ -35,13 +40,18 @@ exports.analyzeCerebellum = async (req, res) => {
     const form = new FormData();
     form.append("image", fs.createReadStream(imagePath));
     form.append("gestationalAge", gestAge);
+    // Optional "refine": coarse-to-fine ROI measurement (see AI/roi_refinement.py)
+    if (req.body.measurementMode) {
+      form.append("measurementMode", req.body.measurementMode);
+    }
 
     // Send to Flask API
     const startTime = Date.now();
-    const response = await axios.post("http://127.0.0.1:4001/analyze-cerebellum", form, {
-      headers: form.getHeaders(),
+    const response = await axios.post(`${AI_URL}/analyze-cerebellum`, form, {
+      headers: { ...form.getHeaders(), ...traceHeaders(scanId) },
     });
     const processingTime = (Date.now() - startTime) / 1000; // Convert to seconds
+    logTrace("cerebellum", scanId, response.data.trace, processingTime);
 
     // Clean up temp file
     fs.unlinkSync(imagePath);
@@ -55,16 +65,18 @@ exports.analyzeCerebellum = async (req, res) => {
       status: status,
       processing_time: processingTime,
       confidence_score: 95, // Default confidence score
-      tcd_mm: response.data.tcd_mm
+      tcd_mm: response.data.tcd_mm,
+      trace_id: response.data.trace?.trace_id
     };
 
     // Save AI report to database
     const reportId = await scanService.saveAIReport(scanId, reportData);
 
-    // In a real system, we would also save annotated images here
-    // For now, we'll mock this with placeholder path
-    const annotationPath = savedImage.relativePath.replace('.jpg', '_annotated.jpg');
-    await scanService.saveAnnotatedImage(reportId, imageId, annotationPath);
+    // Annotated overlay rendered by the AI service from its cache (no second inference)
+    const annotationPath = await storeAnnotatedImage(AI_URL, response.data.annotation_url, savedImage, reportId, gestAge);
+    if (annotationPath) {
+      await scanService.saveAnnotatedImage(reportId, imageId, annotationPath);
+    }
 
     // Return complete response
     res.json({
@@ -74,11 +86,17 @@ exports.analyzeCerebellum = async (req, res) => {
         scanId,
         imageId,
         reportId,
-        imagePath: savedImage.relativePath
+        imagePath: savedImage.relativePath,
+        annotationPath
       }
     });
   } catch (error) {
     console.error("Cerebellum analysis failed:", error.message);
+    // The AI service is overloaded: pass its 429 and Retry-After on so the client can back off
+    if (error.response && error.response.status === 429) {
+      res.set("Retry-After", error.response.headers["retry-after"] || "5");
+      return res.status(429).json({ success: false, error: "AI service is busy. Please retry shortly." });
+    }
     res.status(500).json({ success: false, error: "Cerebellum analysis failed." });
   }
 };
\ No newline at end of file
@@ -4,6 +4,11 @@ const FormData = require("form-data");
 const fs = require("fs");
 const scanService = require("../services/ScanService");
 const fileSystemService = require("../services/FileSystemService");
+const { traceHeaders, logTrace } = require("../services/AITraceService");
+const { storeAnnotatedImage } = require("../services/AnnotationService");
+
+// Point all three at the same port when the AI runs as a single server (AI/server.py)
+const AI_URL = process.env.VENTRICULAR_AI_URL || "http://127.0.0.1:4002";
 
 exports.analyzeVentricular = async (req, res) => {
   try {
@@ -38,10 +43,11 @@ exports.analyzeVentricular = async (req, res) => {
 
     // Send to Flask API
     const startTime = Date.now();
-    const response = await axios.post("http://127.0.0.1:4002/analyze-ventricles", form, {
-      headers: form.getHeaders(),
+    const response = await axios.post(`${AI_URL}/analyze-ventricles`, form, {
+      headers: { ...form.getHeaders(), ...traceHeaders(scanId) },
     });
     const processingTime = (Date.now() - startTime) / 1000; // Convert to seconds
+    logTrace("ventricular", scanId, response.data.trace, processingTime);
 
     // Clean up temp file
     fs.unlinkSync(imagePath);
@@ -53,16 +59,18 @@ exports.analyzeVentricular = async (req, res) => {
       status: response.data.status,
       processing_time: processingTime,
       confidence_score: 95, // Default confidence score
-      lvw_mm: response.data.lvw_mm
+      lvw_mm: response.data.lvw_mm,
+      trace_id: response.data.trace?.trace_id
     };
 
     // Save AI report to database
     const reportId = await scanService.saveAIReport(scanId, reportData);
 
-    // In a real system, we would also save annotated images here
-    // For now, we'll mock this with placeholder path
-    const annotationPath = savedImage.relativePath.replace('.jpg', '_annotated.jpg');
-    await scanService.saveAnnotatedImage(reportId, imageId, annotationPath);
+    // Annotated overlay rendered by the AI service from its cache (no second inference)
+    const annotationPath = await storeAnnotatedImage(AI_URL, response.data.annotation_url, savedImage, reportId, gestAge);
+    if (annotationPath) {
+      await scanService.saveAnnotatedImage(reportId, imageId, annotationPath);
+    }
 
     // Return complete response
     res.json({
@@ -73,11 +81,17 @@ exports.analyzeVentricular = async (req, res) => {
         imageId,
         reportId,
         imagePath: savedImage.relativePath,
+        annotationPath,
         recommendation: response.data.recommendation
       }
     });
   } catch (error) {
     console.error("Ventricular analysis failed:", error.message);
+    // The AI service is overloaded: pass its 429 and Retry-After on so the client can back off
+    if (error.response && error.response.status === 429) {
+      res.set("Retry-After", error.response.headers["retry-after"] || "5");
+      return res.status(429).json({ success: false, error: "AI service is busy. Please retry shortly." });
+    }
     res.status(500).json({ success: false, error: "Ventricular analysis failed." });
   }
 };
\ No newline at end of file
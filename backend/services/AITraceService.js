@@ -0,0 +1,31 @@
+// services/AITraceService.js
+// Request tracing for calls to the AI services (see AI/tracing.py)
+const { v4: uuidv4 } = require('uuid');
+
+// Headers that tag an AI request with a trace ID and the scan it belongs to,
+// and ask for the per-stage timing breakdown in the response
+function traceHeaders(scanId) {
+  return {
+    'X-Request-ID': uuidv4(),
+    'X-Scan-ID': String(scanId),
+    'X-Include-Trace': '1',
+  };
+}
+
+// Log where the time of one AI call went: each pipeline stage, and transfer/queueing outside Flask
+function logTrace(label, scanId, trace, totalSeconds) {
+  if (!trace) {
+    return;
+  }
+  const totalMs = totalSeconds * 1000;
+  const stages = Object.entries(trace.stages_ms || {})
+    .map(([stage, ms]) => `${stage}=${ms}ms`)
+    .join(' ');
+  const outsideMs = Math.max(0, totalMs - trace.duration_ms).toFixed(1);
+  console.log(
+    `[trace ${trace.trace_id}] ${label} scan ${scanId}: total ${totalMs.toFixed(1)}ms, ` +
+    `AI ${trace.duration_ms}ms (${stages}), outside AI ${outsideMs}ms`
+  );
+}
+
+module.exports = { traceHeaders, logTrace };
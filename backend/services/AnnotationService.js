@@ -0,0 +1,30 @@
+// services/AnnotationService.js
+// Annotated overlays rendered by the AI services from their cache (see AI/annotations.py)
+const axios = require('axios');
+const fileSystemService = require('./FileSystemService');
+
+// Fetch the overlay of an analysis as JPEG and store it next to the scan's other annotations.
+// Returns its relative path, or null when the analysis has no overlay or it could not be fetched
+// (the report is still saved without it).
+async function storeAnnotatedImage(aiUrl, annotationUrl, savedImage, reportId, gestAge) {
+  if (!annotationUrl) {
+    return null;
+  }
+  try {
+    const response = await axios.get(`${aiUrl}${annotationUrl}`, {
+      responseType: 'arraybuffer',
+      params: { format: 'jpeg', gestationalAge: gestAge },
+    });
+    const saved = await fileSystemService.saveAnnotatedImage(
+      Buffer.from(response.data),
+      savedImage.filename,
+      reportId
+    );
+    return saved.relativePath;
+  } catch (err) {
+    console.error(`Could not fetch annotated image ${annotationUrl}:`, err.message);
+    return null;
+  }
+}
+
+module.exports = { storeAnnotatedImage };